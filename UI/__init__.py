@@ -1,23 +1,32 @@
 """UI package for Focus Dock application
 This package contains all user interface components, dialogs, and widgets used in the app.
-Each module provides a specific part of the UI, such as main window, dialogs, and custom widgets."""
+Each module provides a specific part of the UI, such as main window, dialogs, and custom widgets.
+Modules are imported on first attribute access so startup only loads what the main window needs."""
 
-from .toggle_switch import ToggleSwitch
-from .website_toggle_widget import WebsiteToggleWidget
-from .scroll_number_widget import ScrollNumberWidget
-from .time_edit_dialog import TimeEditDialog
-from .clock_widget import ClockWidget
-from .add_website_dialog import AddWebsiteDialog
-from .add_app_dialog import AddAppDialog
-from .main_window import MainWindow
+import importlib
 
-__all__ = [
-    'ToggleSwitch',
-    'WebsiteToggleWidget',
-    'ScrollNumberWidget',
-    'TimeEditDialog',
-    'ClockWidget',
-    'AddWebsiteDialog',
-    'AddAppDialog',
-    'MainWindow',
-]
+_EXPORTS = {
+    'ToggleSwitch': 'toggle_switch',
+    'WebsiteToggleWidget': 'website_toggle_widget',
+    'ScrollNumberWidget': 'scroll_number_widget',
+    'TimeEditDialog': 'time_edit_dialog',
+    'ClockWidget': 'clock_widget',
+    'AddWebsiteDialog': 'add_website_dialog',
+    'AddAppDialog': 'add_app_dialog',
+    'MainWindow': 'main_window',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value  # Cache so later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,145 @@
+# BlockerClient module
+# Talks to a long-lived mvp_blocker daemon over its local control socket.
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+# Must match CONTROL_PORT / CONTROL_PATH / CONTROL_TOKEN_PATH in mvp_blocker.py
+CONTROL_PORT = 18081
+CONTROL_PATH = os.path.join(tempfile.gettempdir(), f"focusdock-blocker-{getattr(os, 'getuid', lambda: 0)()}.sock")
+CONTROL_TOKEN_PATH = os.path.join(tempfile.gettempdir(), f"focusdock-blocker-{getattr(os, 'getuid', lambda: 0)()}.token")
+
+
+class BlockerError(Exception):
+    """Raised when the blocker daemon cannot be reached or rejects a command"""
+
+
+class BlockerClient:
+    """Client for the blocker control API (start, stop, reload, status, connections, handover, shutdown)"""
+
+    def __init__(self, blocklist_path="blocklist.json", timeout=2.0, startup_timeout=10.0):
+        self.blocklist_path = blocklist_path
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.process = None  # Daemon spawned by this client, if any
+
+    def daemon_command(self):
+        # Command line used to launch the daemon when none is running
+        if sys.platform == "win32":
+            # --onedir builds put the engine in its own folder next to app.exe
+            bundled = os.path.join("mvp_blocker", "mvp_blocker.exe")
+            program = [bundled if os.path.exists(bundled) else "mvp_blocker.exe"]
+        else:
+            program = [sys.executable, "mvp_blocker.py"]
+        return program + [
+            "--daemon",
+            "--blocklist", self.blocklist_path,
+            "--enable-pac",
+            "--app-mode", "strict",
+            "--app-scan", "1.0",
+        ]
+
+    def _connect(self, timeout):
+        if sys.platform == "win32":
+            return socket.create_connection(("127.0.0.1", CONTROL_PORT), timeout=timeout)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(CONTROL_PATH)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _message(self, cmd):
+        # The TCP endpoint wants the daemon's per-run token, re-read each time since a restart replaces it
+        message = {"cmd": cmd}
+        if sys.platform == "win32":
+            with open(CONTROL_TOKEN_PATH, "r", encoding="utf-8") as f:
+                message["token"] = f.read().strip()
+        return json.dumps(message).encode() + b"\n"
+
+    def request(self, cmd, timeout=None):
+        """Send one command and return the daemon's JSON reply"""
+        try:
+            with self._connect(timeout or self.timeout) as sock:
+                sock.sendall(self._message(cmd))
+                reply = b""
+                while not reply.endswith(b"\n"):
+                    chunk = sock.recv(4096)
+                    if not chunk:
+                        break
+                    reply += chunk
+        except OSError as e:
+            raise BlockerError(f"blocker unreachable: {e}") from e
+
+        try:
+            data = json.loads(reply)
+        except ValueError as e:
+            raise BlockerError(f"bad reply from blocker: {reply!r}") from e
+        if not data.get("ok"):
+            raise BlockerError(data.get("error", "command failed"))
+        return data
+
+    def is_running(self):
+        try:
+            self.request("status", timeout=0.5)
+            return True
+        except BlockerError:
+            return False
+
+    def spawn(self):
+        """Launch the daemon in the background if it is not already reachable"""
+        if self.process and self.process.poll() is None:
+            return
+        if self.is_running():
+            return
+        kwargs = {}
+        if sys.platform == "win32":
+            # Use CREATE_NEW_PROCESS_GROUP to isolate the subprocess
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+        try:
+            self.process = subprocess.Popen(self.daemon_command(), **kwargs)
+        except OSError as e:
+            raise BlockerError(f"could not launch blocker: {e}") from e
+
+    def ensure_running(self):
+        """Spawn the daemon if needed and wait until it accepts commands"""
+        self.spawn()
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.is_running():
+                return
+            if self.process and self.process.poll() is not None:
+                raise BlockerError(f"blocker exited with code {self.process.returncode}")
+            time.sleep(0.05)
+        raise BlockerError("blocker did not start in time")
+
+    def start_session(self):
+        self.ensure_running()
+        return self.request("start")
+
+    def stop_session(self):
+        return self.request("stop")
+
+    def reload(self):
+        return self.request("reload")
+
+    def status(self):
+        return self.request("status")
+
+    def connections(self):
+        """Live proxied connections, heaviest first"""
+        return self.request("connections")["connections"]
+
+    def handover(self):
+        """Restart the daemon in place; the listening sockets and the session carry over"""
+        return self.request("handover")
+
+    def shutdown(self):
+        return self.request("shutdown")
@@ -0,0 +1,60 @@
+# BlockerWorker module
+# Runs blocker control calls on a background thread so the GUI never waits on the daemon.
+
+from PyQt6.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
+from UI.blocker_client import BlockerError
+
+
+class BlockerWorker(QObject):
+    """Queues BlockerClient calls onto its own thread and reports each outcome through signals
+
+    Calls run one at a time in submission order, so a stop always lands after the start before it.
+    """
+    requested = pyqtSignal(str)  # Name of the call to run on the worker thread
+    closing = pyqtSignal()
+    succeeded = pyqtSignal(str, object)  # Call name, daemon reply
+    failed = pyqtSignal(str, str)  # Call name, error message
+
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+        self.calls = {
+            "spawn": client.spawn,
+            "start": client.start_session,
+            "stop": client.stop_session,
+            "shutdown": self.shutdown_idle,
+        }
+        self.worker_thread = QThread()
+        self.moveToThread(self.worker_thread)
+        self.requested.connect(self.run)
+        self.closing.connect(self.finish)
+        self.worker_thread.start()
+
+    def submit(self, name):
+        """Queue one call; returns immediately"""
+        self.requested.emit(name)
+
+    def close(self, timeout_ms=5000):
+        """Let queued calls finish, then stop the thread (waits at most timeout_ms)"""
+        self.closing.emit()
+        self.worker_thread.wait(timeout_ms)
+
+    @pyqtSlot(str)
+    def run(self, name):
+        try:
+            reply = self.calls[name]()
+        except BlockerError as e:
+            self.failed.emit(name, str(e))
+        else:
+            self.succeeded.emit(name, reply)
+
+    @pyqtSlot()
+    def finish(self):
+        # Queued behind every submitted call, so nothing is dropped on exit
+        self.worker_thread.quit()
+
+    def shutdown_idle(self):
+        # Leave the daemon running while schedules are configured; they apply without the UI
+        if "scheduled" in self.client.status():
+            return None
+        return self.client.shutdown()
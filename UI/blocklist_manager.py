@@ -25,6 +25,10 @@ class BlocklistManager:
         # Get all website/app names from the blocklist
         return list(self.data.get("websites", {}).keys())
 
+    def get_entry(self, site_name: str) -> Dict:
+        # Get the stored entry (blocked, apps, urls) for a site/app
+        return self.data.get("websites", {}).get(site_name, {})
+
     def is_blocked(self, site_name: str) -> bool:
         # Check if a specific site/app is blocked
         if site_name not in self.data.get("websites", {}):
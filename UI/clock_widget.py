@@ -2,11 +2,23 @@
 # Displays a timer or clock for focus sessions in the UI.
 
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QSpacerItem, QSizePolicy, QDialog, QGraphicsDropShadowEffect
-from PyQt6.QtCore import Qt, QTimer, QRect, pyqtSignal
-from PyQt6.QtGui import QPainter, QColor, QPen, QFont
-from UI.time_edit_dialog import TimeEditDialog
-import subprocess
-import sys
+from PyQt6.QtCore import Qt, QTimer, QRect, QPoint, QCoreApplication, pyqtSignal
+from PyQt6.QtGui import QPainter, QColor, QPen, QFont, QPixmap
+from UI.blocker_client import BlockerClient
+from UI.blocker_worker import BlockerWorker
+from UI.countdown import Countdown
+import json
+import math
+import os
+import time
+
+# Progress ring geometry
+RING_RADIUS = 180
+RING_WIDTH = 24
+
+# Running session state, kept so a restarted UI can resume the countdown
+SESSION_FILE = "session.json"
+
 
 class ClockWidget(QWidget):
     timer_started = pyqtSignal()  # Emitted when timer starts
@@ -26,19 +38,44 @@ class ClockWidget(QWidget):
         self.total_seconds = 0
         self.remaining_seconds = 0
         self.is_running = False
+        self.countdown = Countdown()  # Deadline on the monotonic clock; owns all the countdown arithmetic
 
         # Time values
         self.time_digits = [0, 0, 0, 0, 0, 0]
         self.original_time_digits = [0, 0, 0, 0, 0, 0]  # Store original input
 
-        # Blocker process
-        self.blocker_process = None
+        # Blocker daemon, launched once the window is up so pressing Focus only sends a command.
+        # Every control call runs on the worker thread; results come back as signals.
+        self.blocker = BlockerClient("blocklist.json")
+        self.blocker_worker = BlockerWorker(self.blocker)
+        self.blocker_worker.succeeded.connect(self.on_blocker_done)
+        self.blocker_worker.failed.connect(self.on_blocker_failed)
+        QTimer.singleShot(0, self.spawn_blocker)
+        app = QCoreApplication.instance()
+        if app:
+            app.aboutToQuit.connect(self.shutdown_blocker)
+
+        # Paint resources, created once and reused on every repaint
+        self.ring_pen = QPen(QColor("#E8E8E8"))
+        self.ring_pen.setWidth(RING_WIDTH)
+        self.ring_pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+        self.arc_pen = QPen(QColor("#0067C0"))
+        self.arc_pen.setWidth(RING_WIDTH)
+        self.arc_pen.setCapStyle(Qt.PenCapStyle.RoundCap)
+        self.time_font = QFont("Segoe UI", 48, QFont.Weight.Bold)
+        self.text_color = QColor("#1F1F1F")
+        self.ring_cache = None  # Background ring prerendered into a QPixmap
+
+        # Optional instrumentation: called as paint_hook(elapsed_seconds, exposed_rect)
+        self.paint_hook = None
 
         # Setup UI
         self.setup_ui()
 
-        # Timer for countdown
+        # Timer for countdown, re-armed on each tick to land on the next second boundary
         self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(Qt.TimerType.CoarseTimer)
         self.timer.timeout.connect(self.update_countdown)
 
         # Enable focus to receive keyboard events
@@ -107,22 +144,14 @@ class ClockWidget(QWidget):
             if self.total_seconds > 0:
                 # Store the original time
                 self.original_time_digits = self.time_digits.copy()
-                
-                self.remaining_seconds = self.total_seconds
-                self.is_running = True
-                self.start_button.setText("Stop")
-                self.timer.start(1000)  # Update every second
-
-                self.timer_started.emit()
-
-                # Start blocking websites when timer starts
-                if self.manager:
-                    self.start_blocking()
+                self.start_session(self.countdown.clock() + self.total_seconds)
+                self.save_session()
         else:
             # Stop the timer and reset to original input
             self.is_running = False
             self.start_button.setText("Focus")
             self.timer.stop()
+            self.clear_session()
 
             self.timer_stopped.emit()
             
@@ -149,75 +178,64 @@ class ClockWidget(QWidget):
         self.update()
 
     def start_blocking(self):
-        #Start blocking selected websites
-        if self.blocker_process and self.blocker_process.poll() is None:
-            return
-        
-        try:
-            # Use CREATE_NEW_PROCESS_GROUP to isolate the subprocess
-            if sys.platform == "win32":
-                import subprocess
-                self.blocker_process = subprocess.Popen(
-                    [
-                        "mvp_blocker.exe",
-                        "--blocklist", "blocklist.json",
-                        "--enable-pac",
-                        "--app-mode", "strict",
-                        "--app-scan", "1.0"
-                    ],
-                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
-                )
-        
-            print("[INFO] Blocker script started")
-        except Exception as e:
-            print(f"[ERROR] Failed to start blocker: {e}")
-            self.blocker_process = None
+        # Start blocking selected websites; launching the daemon can take seconds, so it runs off the GUI thread
+        self.blocker_worker.submit("start")
 
     def stop_blocking(self):
-        # Stop the blocking script
-        if self.blocker_process is None:
-            return
-        
-        try:
-            # First, clear PAC by running the script with --disable-pac-only
-            if sys.platform == "win32":
-                subprocess.run([
-                    "mvp_blocker.exe",
-                    "--disable-pac-only"
-                ], timeout=3, creationflags=subprocess.CREATE_NO_WINDOW)
-            
-            # Check if process is still running
-            if self.blocker_process.poll() is None:
-                if sys.platform == "win32":
-                    import os
-                    # Force kill the process tree
-                    try:
-                        os.system(f'taskkill /F /T /PID {self.blocker_process.pid} > nul 2>&1')
-                        print("[INFO] Blocker script terminated")
-                    except Exception as e:
-                        print(f"[WARN] Could not kill blocker: {e}")
-                        self.blocker_process.terminate()
-                    
-                    # Brief wait to confirm termination
-                    try:
-                        self.blocker_process.wait(timeout=1)
-                    except subprocess.TimeoutExpired:
-                        self.blocker_process.kill()
-                        self.blocker_process.wait()
-        except Exception as e:
-            print(f"[WARN] Error stopping blocker: {e}")
-        finally:
-            self.blocker_process = None
+        # Stop blocking; the daemon stays up for the next session
+        self.blocker_worker.submit("stop")
+
+    def shutdown_blocker(self):
+        # Leave the daemon running if a session is still counting down; the worker also keeps it for schedules
+        if not self.is_running:
+            self.blocker_worker.submit("shutdown")
+        # The app is exiting, so wait (bounded) for the queued calls instead of dropping them
+        self.blocker_worker.close()
+
+    def on_blocker_done(self, name, reply):
+        if name == "start":
+            print("[INFO] Blocking session started")
+        elif name == "stop":
+            print("[INFO] Blocking session stopped")
+
+    def on_blocker_failed(self, name, error):
+        if name == "start":
+            print(f"[ERROR] Failed to start blocker: {error}")
+        elif name == "stop":
+            print(f"[WARN] Error stopping blocker: {error}")
+        elif name == "spawn":
+            print(f"[WARN] Could not launch blocker: {error}")
+
+    def start_session(self, deadline):
+        # Begin counting down towards a monotonic deadline
+        first_tick = self.countdown.start(deadline)
+        self.remaining_seconds = self.countdown.remaining
+        self.is_running = True
+        self.start_button.setText("Stop")
+        self.timer.start(first_tick)
+
+        self.timer_started.emit()
+
+        # Start blocking websites when timer starts
+        if self.manager:
+            self.start_blocking()
 
     def update_countdown(self):
-        if self.remaining_seconds > 0:
-            self.remaining_seconds -= 1
-            self.update()
+        # Remaining time always comes from the deadline, so late or missed ticks never drift
+        previous = self.remaining_seconds
+        next_tick = self.countdown.tick()
+        self.remaining_seconds = self.countdown.remaining
+        if next_tick is not None:
+            if self.remaining_seconds != previous:
+                self.update_progress(previous)
+            # Wake up once, right after the displayed second changes
+            self.timer.start(next_tick)
         else:
             # Timer finished
             self.is_running = False
             self.start_button.setText("Focus")
             self.timer.stop()
+            self.clear_session()
             self.timer_stopped.emit()
             self.stop_blocking()
             
@@ -226,13 +244,62 @@ class ClockWidget(QWidget):
             
             self.update()
 
+    def save_session(self):
+        # Persist the deadline as wall-clock time; the monotonic clock does not survive restarts
+        state = {
+            "deadline": time.time() + self.countdown.seconds_to_deadline(),
+            "total_seconds": self.total_seconds,
+            "time_digits": self.original_time_digits,
+        }
+        try:
+            with open(SESSION_FILE, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+        except OSError as e:
+            print(f"[WARN] Could not save session: {e}")
+
+    def clear_session(self):
+        # Forget the persisted session once it has ended
+        try:
+            os.remove(SESSION_FILE)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"[WARN] Could not clear session: {e}")
+
+    def spawn_blocker(self):
+        # Calls run in order, so a start queued earlier has already launched the daemon and this is a no-op
+        self.blocker_worker.submit("spawn")
+
+    def resume_session(self):
+        # Resume a session left running by a previous instance of the UI
+        if self.is_running or not os.path.exists(SESSION_FILE):
+            return
+        try:
+            with open(SESSION_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            left = float(state["deadline"]) - time.time()
+            total = int(state["total_seconds"])
+            digits = [int(d) for d in state.get("time_digits", [])]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[WARN] Ignoring unreadable session: {e}")
+            self.clear_session()
+            return
+
+        if left <= 0 or total <= 0:
+            self.clear_session()
+            return
+
+        if len(digits) == 6:
+            self.time_digits = digits
+            self.original_time_digits = digits.copy()
+        self.total_seconds = total
+        self.start_session(self.countdown.clock() + min(left, total))
+        self.update()
+
     def mousePressEvent(self, event):
         if not self.is_running:
             # Calculate time display area
-            width = self.width()
-            height = self.height()
-            center_x = width // 2
-            center_y = height // 3
+            center_x, center_y = self.ring_center()
             radius = 150
 
             # Check if click is within the time display area
@@ -246,7 +313,8 @@ class ClockWidget(QWidget):
         minutes = self.time_digits[2] * 10 + self.time_digits[3]
         seconds = self.time_digits[4] * 10 + self.time_digits[5]
 
-        # Open dialog
+        # Open dialog (imported on first use to speed up startup)
+        from UI.time_edit_dialog import TimeEditDialog
         dialog = TimeEditDialog(hours, minutes, seconds, self)
         if dialog.exec() == QDialog.DialogCode.Accepted:
             # Update time from dialog
@@ -264,36 +332,89 @@ class ClockWidget(QWidget):
 
             self.update()
 
+    def ring_center(self):
+        # Center of the progress ring in widget coordinates
+        return self.width() // 2, self.height() // 3
+
+    def ring_rect(self):
+        # Bounding box of the ring including the pen width
+        center_x, center_y = self.ring_center()
+        extent = RING_RADIUS + RING_WIDTH // 2 + 2
+        return QRect(center_x - extent, center_y - extent, extent * 2, extent * 2)
+
+    def text_rect(self):
+        # Area covered by the time text
+        center_x, center_y = self.ring_center()
+        return QRect(center_x - RING_RADIUS, center_y - 30, RING_RADIUS * 2, 60)
+
+    def arc_point(self, progress):
+        # End point of the progress arc, which starts at 12 o'clock and runs clockwise
+        center_x, center_y = self.ring_center()
+        angle = math.radians(90 - 360 * progress)
+        return QPoint(int(center_x + RING_RADIUS * math.cos(angle)),
+                      int(center_y - RING_RADIUS * math.sin(angle)))
+
+    def update_progress(self, previous_seconds):
+        # Repaint only the time text and the part of the arc that moved
+        self.update(self.text_rect())
+        if self.total_seconds <= 0:
+            return
+        old = previous_seconds / self.total_seconds
+        new = self.remaining_seconds / self.total_seconds
+        if abs(old - new) > 1 / 8:
+            self.update(self.ring_rect())
+            return
+        points = [self.arc_point(old), self.arc_point((old + new) / 2), self.arc_point(new)]
+        margin = RING_WIDTH // 2 + 4
+        left = min(p.x() for p in points) - margin
+        top = min(p.y() for p in points) - margin
+        right = max(p.x() for p in points) + margin
+        bottom = max(p.y() for p in points) + margin
+        self.update(QRect(left, top, right - left, bottom - top))
+
+    def resizeEvent(self, event):
+        # Ring position depends on size, so the cached layer must be redrawn
+        self.ring_cache = None
+        super().resizeEvent(event)
+
+    def render_ring(self):
+        # Prerender the static background ring at the screen's pixel ratio
+        rect = self.ring_rect()
+        ratio = self.devicePixelRatioF()
+        pixmap = QPixmap(int(rect.width() * ratio), int(rect.height() * ratio))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.GlobalColor.transparent)
+
+        painter = QPainter(pixmap)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setPen(self.ring_pen)
+        painter.setBrush(Qt.BrushStyle.NoBrush)
+        offset = rect.width() // 2 - RING_RADIUS
+        painter.drawEllipse(offset, offset, RING_RADIUS * 2, RING_RADIUS * 2)
+        painter.end()
+        return pixmap
+
     def paintEvent(self, event):
+        started = time.perf_counter() if self.paint_hook else 0.0
         painter = QPainter(self)
         painter.setRenderHint(QPainter.RenderHint.Antialiasing)
 
         # Calculate center and radius
-        width = self.width()
-        height = self.height()
-        center_x = width // 2
-        center_y = height // 3
-        radius = 180
-
-        # Draw outer circle (background) with gradient
-        pen = QPen(QColor("#E8E8E8"))
-        pen.setWidth(24)
-        pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-        painter.setPen(pen)
-        painter.setBrush(Qt.BrushStyle.NoBrush)
-        painter.drawEllipse(center_x - radius, center_y -
-                            radius, radius * 2, radius * 2)
+        center_x, center_y = self.ring_center()
+        radius = RING_RADIUS
+
+        # Draw outer circle (background) from the cached layer
+        if self.ring_cache is None:
+            self.ring_cache = self.render_ring()
+        painter.drawPixmap(self.ring_rect().topLeft(), self.ring_cache)
 
-        # Draw progress arc if timer is set with gradient effect
+        # Draw progress arc if timer is set
         if self.total_seconds > 0:
             progress = self.remaining_seconds / self.total_seconds
             span_angle = int(360 * 16 * progress)
 
-            # Create gradient effect
-            pen = QPen(QColor("#0067C0"))
-            pen.setWidth(24)
-            pen.setCapStyle(Qt.PenCapStyle.RoundCap)
-            painter.setPen(pen)
+            painter.setPen(self.arc_pen)
+            painter.setBrush(Qt.BrushStyle.NoBrush)
             painter.drawArc(center_x - radius, center_y - radius,
                             radius * 2, radius * 2, 90 * 16, -span_angle)
 
@@ -306,9 +427,10 @@ class ClockWidget(QWidget):
         else:
             time_text = f"{self.time_digits[0]}{self.time_digits[1]}:{self.time_digits[2]}{self.time_digits[3]}:{self.time_digits[4]}{self.time_digits[5]}"
 
-        font = QFont("Segoe UI", 48, QFont.Weight.Bold)
-        painter.setFont(font)
-        painter.setPen(QColor("#1F1F1F"))
+        painter.setFont(self.time_font)
+        painter.setPen(self.text_color)
+        painter.drawText(self.text_rect(), Qt.AlignmentFlag.AlignCenter, time_text)
+        painter.end()
 
-        text_rect = QRect(center_x - radius, center_y - 30, radius * 2, 60)
-        painter.drawText(text_rect, Qt.AlignmentFlag.AlignCenter, time_text)
+        if self.paint_hook:
+            self.paint_hook(time.perf_counter() - started, event.rect())
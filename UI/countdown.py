@@ -0,0 +1,48 @@
+# Countdown module
+# Deadline arithmetic for the focus timer, kept free of Qt so it can be checked on its own.
+
+import math
+import time
+
+# Fire ticks slightly after each second boundary so the display has already changed
+TICK_SLACK_MS = 15
+
+
+def seconds_left(deadline: float, now: float) -> int:
+    """Whole seconds still shown on the countdown for a monotonic deadline"""
+    return max(0, math.ceil(deadline - now))
+
+
+def ms_to_next_second(deadline: float, now: float) -> int:
+    """Delay until the countdown next crosses a whole-second boundary"""
+    left = deadline - now
+    if left <= 0:
+        return 0
+    fraction = left - math.floor(left)
+    return int((fraction or 1.0) * 1000) + TICK_SLACK_MS
+
+
+class Countdown:
+    """Deadline-driven countdown state; ClockWidget only arms its timer and repaints
+
+    The remaining time is always recomputed from the deadline, so late or skipped ticks never drift."""
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock  # Monotonic clock, replaceable for tests
+        self.deadline = 0.0
+        self.remaining = 0
+
+    def start(self, deadline: float) -> int:
+        """Count down towards a deadline on self.clock; returns the delay before the first tick in ms"""
+        self.deadline = deadline
+        self.remaining = seconds_left(deadline, self.clock())
+        return ms_to_next_second(deadline, self.clock())
+
+    def tick(self):
+        """Re-read the clock; returns the delay before the next tick in ms, or None once time is up"""
+        now = self.clock()
+        self.remaining = seconds_left(self.deadline, now)
+        return ms_to_next_second(self.deadline, now) if self.remaining > 0 else None
+
+    def seconds_to_deadline(self) -> float:
+        return self.deadline - self.clock()
@@ -6,14 +6,16 @@ from PyQt6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
     QScrollArea, QFrame, QMessageBox, QDialog, QGraphicsDropShadowEffect, QLineEdit
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer
 from PyQt6.QtGui import QColor
 from UI.blocklist_manager import BlocklistManager
 from UI.website_toggle_widget import WebsiteToggleWidget
 from UI.clock_widget import ClockWidget
 from UI.task_panel import TaskPanel
-from UI.add_website_dialog import AddWebsiteDialog
-from UI.add_app_dialog import AddAppDialog
+from UI.search_index import SearchIndex
+
+# Delay between the last keystroke and running the search
+SEARCH_DEBOUNCE_MS = 120
 
 # Main application window class
 class MainWindow(QMainWindow):
@@ -35,6 +37,15 @@ class MainWindow(QMainWindow):
         self.website_widgets = {}  # Dictionary to store website toggle widgets
         self.toggle_all_widget = None  # Widget to toggle all websites/apps
 
+        # Search index over category names, URLs and app patterns
+        self.search_index = SearchIndex()
+        self.search_index.build(self.manager.data.get("websites", {}))
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(self.apply_search)
+        self.visible_sites = None  # Names shown by the last search, None = all
+
         # Set up the user interface
         self._setup_ui()
 
@@ -125,7 +136,7 @@ class MainWindow(QMainWindow):
                 background-color: #FFFFFF;
             }
         """)
-        self.search_input.textChanged.connect(self.filter_websites)  # Connect search input to filter function
+        self.search_input.textChanged.connect(self.filter_websites)  # Debounced search on each keystroke
         search_layout.addWidget(self.search_input)
 
         left_container_layout.addWidget(search_widget)
@@ -246,6 +257,8 @@ class MainWindow(QMainWindow):
         # Connect timer signals to enable/disable left panel
         self.clock_widget.timer_started.connect(lambda: self.set_left_panel_enabled(False))
         self.clock_widget.timer_stopped.connect(lambda: self.set_left_panel_enabled(True))
+        # Resume on the first event loop pass so construction never waits on the blocker daemon
+        QTimer.singleShot(0, self.clock_widget.resume_session)
 
         # RIGHT PANEL: Tasks
         self.task_panel = TaskPanel()
@@ -266,11 +279,14 @@ class MainWindow(QMainWindow):
         )
         self.left_layout.addWidget(widget)
         self.website_widgets[site_name] = widget
+        if self.visible_sites is not None:
+            self.visible_sites.add(site_name)  # New widgets start visible
 
     # Method to handle adding a new website or app
     def handle_add_item(self, item_type):
         #Open dialog to add website or app
         if item_type == "website":
+            from UI.add_website_dialog import AddWebsiteDialog  # Imported on first use to speed up startup
             dialog = AddWebsiteDialog(self)
             if dialog.exec() == QDialog.DialogCode.Accepted:
                 name, url = dialog.get_values()
@@ -280,6 +296,7 @@ class MainWindow(QMainWindow):
                     is_new_entry = name not in self.manager.get_all_sites()
 
                     self.manager.add_website(name, url)
+                    self.search_index.add(name, self.manager.get_entry(name))
 
                     # Only add widget if it's a brand new entry
                     if is_new_entry:
@@ -291,6 +308,7 @@ class MainWindow(QMainWindow):
                     QMessageBox.warning(self, "Input Error", "Please enter both website name and URL.")
         
         elif item_type == "app":
+            from UI.add_app_dialog import AddAppDialog
             dialog = AddAppDialog(self)
             if dialog.exec() == QDialog.DialogCode.Accepted:
                 name, exe = dialog.get_values()
@@ -300,6 +318,7 @@ class MainWindow(QMainWindow):
                 is_new_entry = name not in self.manager.get_all_sites()
                 
                 self.manager.add_app(name, exe)
+                self.search_index.add(name, self.manager.get_entry(name))
                 
                 # Only add widget if it's a brand new entry
                 if is_new_entry:
@@ -346,12 +365,21 @@ class MainWindow(QMainWindow):
 
     # Method to filter websites/apps based on search input
     def filter_websites(self, search_text: str):
-        # Filter website widgets based on search text
-        search_text = search_text.lower().strip()
-        
-        for site_name, widget in self.website_widgets.items():
-            # Show widget if search is empty or site name contains search text
-            if not search_text or search_text in site_name.lower():
-                widget.show()
-            else:
+        # Restart the debounce timer; the search runs once typing pauses
+        self.search_timer.start()
+
+    # Method to show only the widgets matching the current search
+    def apply_search(self):
+        matches = self.search_index.search(self.search_input.text())
+
+        # Only touch widgets whose visibility actually changes
+        previous = self.visible_sites if self.visible_sites is not None else set(self.website_widgets)
+        for site_name in previous - matches:
+            widget = self.website_widgets.get(site_name)
+            if widget:
                 widget.hide()
+        for site_name in matches - previous:
+            widget = self.website_widgets.get(site_name)
+            if widget:
+                widget.show()
+        self.visible_sites = matches
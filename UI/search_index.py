@@ -0,0 +1,103 @@
+# SearchIndex module
+# Prebuilt n-gram index over blocklist categories for the search box.
+
+from typing import Dict, Iterable, List, Optional, Set
+
+# Longest gram stored in the index; longer queries intersect their trigrams
+GRAM_SIZE = 3
+
+
+class SearchIndex:
+    """N-gram index mapping search text to blocklist category names"""
+
+    def __init__(self):
+        self.grams: Dict[str, Set[str]] = {}   # gram -> category names containing it
+        self.fields: Dict[str, List[str]] = {}  # category name -> lowercased searchable fields
+        self._last_query = ""
+        self._last_result: Optional[Set[str]] = None
+
+    @staticmethod
+    def _grams_of(text: str) -> Set[str]:
+        # Every substring of length 1..GRAM_SIZE
+        out = set()
+        for size in range(1, GRAM_SIZE + 1):
+            for i in range(len(text) - size + 1):
+                out.add(text[i:i + size])
+        return out
+
+    def build(self, websites: Dict[str, dict]):
+        """Rebuild the index from the "websites" section of the blocklist"""
+        self.grams.clear()
+        self.fields.clear()
+        for name, info in websites.items():
+            self.add(name, info)
+
+    def add(self, name: str, info: Optional[dict] = None):
+        """Index (or re-index) one category with its URLs and app pattern"""
+        if name in self.fields:
+            self.remove(name)
+        info = info or {}
+        fields = [name.lower()]
+        fields.extend(url.lower() for url in info.get("urls", []) if url)
+        if info.get("apps"):
+            fields.append(info["apps"].lower())
+        self.fields[name] = fields
+        for field in fields:
+            for gram in self._grams_of(field):
+                self.grams.setdefault(gram, set()).add(name)
+        self._last_query, self._last_result = "", None
+
+    def remove(self, name: str):
+        """Drop a category from the index"""
+        fields = self.fields.pop(name, None)
+        if fields is None:
+            return
+        for field in fields:
+            for gram in self._grams_of(field):
+                names = self.grams.get(gram)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del self.grams[gram]
+        self._last_query, self._last_result = "", None
+
+    def search(self, query: str) -> Set[str]:
+        """Return the category names whose name, URLs or app pattern contain query"""
+        query = query.lower().strip()
+        if not query:
+            self._last_query, self._last_result = "", None
+            return set(self.fields)
+
+        # Typing more characters can only narrow the previous result
+        if self._last_result is not None and query.startswith(self._last_query):
+            candidates: Iterable[str] = self._last_result
+        elif len(query) <= GRAM_SIZE:
+            candidates = self.grams.get(query, ())
+        else:
+            candidates = self._candidates(query)
+
+        if len(query) <= GRAM_SIZE and candidates is not self._last_result:
+            # Short queries are exact gram hits, no verification needed
+            result = set(candidates)
+        else:
+            result = {name for name in candidates
+                      if any(query in field for field in self.fields.get(name, ()))}
+
+        self._last_query, self._last_result = query, result
+        return result
+
+    def _candidates(self, query: str) -> Set[str]:
+        # Intersect trigram postings, smallest first
+        postings = []
+        for i in range(len(query) - GRAM_SIZE + 1):
+            names = self.grams.get(query[i:i + GRAM_SIZE])
+            if not names:
+                return set()
+            postings.append(names)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for names in postings[1:]:
+            result &= names
+            if not result:
+                break
+        return result
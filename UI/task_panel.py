@@ -5,13 +5,16 @@ from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
     QPushButton, QScrollArea, QFrame, QGraphicsDropShadowEffect
 )
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QTimer, QCoreApplication
 from PyQt6.QtGui import QColor, QFont
 from UI.task_item import TaskWidget
 from UI.task_input import TaskInputWidget
 import json
 import os
 
+# Delay before pending task changes are written to disk
+SAVE_DEBOUNCE_MS = 500
+
 
 class TaskPanel(QWidget):
     """Right panel for managing tasks"""
@@ -19,9 +22,19 @@ class TaskPanel(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.tasks_file = "tasks.json"
-        self.tasks = []
-        self.task_widgets = []
-        
+        # Tasks and their rows keyed by id(task_data), in display order
+        self.tasks = {}  # key -> task_data
+        self.task_rows = {}  # key -> (widget, separator)
+
+        # Coalesce bursts of changes into a single write
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_DEBOUNCE_MS)
+        self.save_timer.timeout.connect(self.save_tasks)
+        app = QCoreApplication.instance()
+        if app:
+            app.aboutToQuit.connect(self.flush_tasks)
+
         self.load_tasks()
         self.setup_ui()
     
@@ -139,52 +152,66 @@ class TaskPanel(QWidget):
     
     def add_task(self, task_data):
         """Add a new task"""
-        self.tasks.append(task_data)
-        self.save_tasks()
-        self.refresh_tasks()
+        self.tasks[id(task_data)] = task_data
+        self._insert_row(task_data)
+        self.schedule_save()
     
     def delete_task(self, task_widget):
         """Delete a task"""
-        if task_widget.task_data in self.tasks:
-            self.tasks.remove(task_widget.task_data)
-            self.save_tasks()
-            self.refresh_tasks()
+        key = id(task_widget.task_data)
+        if key not in self.task_rows:
+            return
+        was_first = key == next(iter(self.task_rows))
+        self._remove_row(key)
+        del self.tasks[key]
+
+        # The new first row no longer needs a separator above it
+        if was_first and self.task_rows:
+            first_key = next(iter(self.task_rows))
+            widget, separator = self.task_rows[first_key]
+            if separator is not None:
+                self._discard(separator)
+                self.task_rows[first_key] = (widget, None)
+        self.schedule_save()
     
     def on_task_changed(self):
         """Save tasks when any task is modified"""
-        self.save_tasks()
+        self.schedule_save()
     
     def refresh_tasks(self):
-        """Refresh the task list display"""
-        # Clear existing task widgets
-        for widget in self.task_widgets:
-            widget.deleteLater()
-        self.task_widgets.clear()
-        
-        # Remove stretch
-        if self.task_layout.count() > 0:
-            item = self.task_layout.takeAt(self.task_layout.count() - 1)
-            if item:
-                item.invalidate()
-        
-        # Add task widgets
-        for task_data in self.tasks:
-            task_widget = TaskWidget(task_data)
-            task_widget.task_changed.connect(self.on_task_changed)
-            task_widget.task_deleted.connect(self.delete_task)
-            
-            # Add separator
-            if self.task_widgets:
-                separator = QFrame()
-                separator.setFrameShape(QFrame.Shape.HLine)
-                separator.setStyleSheet("background-color: #F3F3F3; max-height: 1px;")
-                self.task_layout.addWidget(separator)
-            
-            self.task_layout.addWidget(task_widget)
-            self.task_widgets.append(task_widget)
-        
-        # Add stretch at the end
-        self.task_layout.addStretch()
+        """Rebuild the whole task list display (initial load)"""
+        for key in list(self.task_rows):
+            self._remove_row(key)
+        for task_data in self.tasks.values():
+            self._insert_row(task_data)
+
+    def _insert_row(self, task_data):
+        # Append one task (and its separator) just above the trailing stretch
+        task_widget = TaskWidget(task_data)
+        task_widget.task_changed.connect(self.on_task_changed)
+        task_widget.task_deleted.connect(self.delete_task)
+
+        separator = None
+        if self.task_rows:
+            separator = QFrame()
+            separator.setFrameShape(QFrame.Shape.HLine)
+            separator.setStyleSheet("background-color: #F3F3F3; max-height: 1px;")
+            self.task_layout.insertWidget(self.task_layout.count() - 1, separator)
+
+        self.task_layout.insertWidget(self.task_layout.count() - 1, task_widget)
+        self.task_rows[id(task_data)] = (task_widget, separator)
+
+    def _remove_row(self, key):
+        # Remove a single task widget and its separator from the layout
+        widget, separator = self.task_rows.pop(key)
+        self._discard(widget)
+        if separator is not None:
+            self._discard(separator)
+
+    def _discard(self, widget):
+        # Detach a widget from the layout and schedule its deletion
+        self.task_layout.removeWidget(widget)
+        widget.deleteLater()
     
     def load_tasks(self):
         """Load tasks from JSON file"""
@@ -192,17 +219,27 @@ class TaskPanel(QWidget):
             try:
                 with open(self.tasks_file, 'r', encoding='utf-8') as f:
                     data = json.load(f)
-                    self.tasks = data.get('tasks', [])
+                    self.tasks = {id(t): t for t in data.get('tasks', [])}
             except Exception as e:
                 print(f"Error loading tasks: {e}")
-                self.tasks = []
+                self.tasks = {}
         else:
-            self.tasks = []
+            self.tasks = {}
     
+    def schedule_save(self):
+        """Write tasks to disk once changes stop arriving"""
+        self.save_timer.start()
+
+    def flush_tasks(self):
+        """Write any pending changes immediately"""
+        if self.save_timer.isActive():
+            self.save_timer.stop()
+            self.save_tasks()
+
     def save_tasks(self):
         """Save tasks to JSON file"""
         try:
             with open(self.tasks_file, 'w', encoding='utf-8') as f:
-                json.dump({'tasks': self.tasks}, f, indent=2, ensure_ascii=False)
+                json.dump({'tasks': list(self.tasks.values())}, f, indent=2, ensure_ascii=False)
         except Exception as e:
             print(f"Error saving tasks: {e}")
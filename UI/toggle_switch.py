@@ -2,7 +2,7 @@
 # Implements a custom toggle switch widget for use in the UI.
 
 from PyQt6.QtWidgets import QWidget
-from PyQt6.QtCore import Qt, pyqtSignal, QPropertyAnimation, QEasingCurve, pyqtProperty
+from PyQt6.QtCore import Qt, QRect, pyqtSignal, QPropertyAnimation, QEasingCurve, pyqtProperty
 from PyQt6.QtGui import QPainter, QColor
 
 
@@ -10,6 +10,11 @@ class ToggleSwitch(QWidget):
     """Custom toggle switch widget"""
     toggled = pyqtSignal(bool)
 
+    # Shared paint colors
+    TRACK_ON = QColor("#0067C0")
+    TRACK_OFF = QColor("#E1E1E1")
+    KNOB = QColor("#FFFFFF")
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self._checked = False
@@ -28,8 +33,11 @@ class ToggleSwitch(QWidget):
 
     @circle_position.setter
     def circle_position(self, pos):
+        # Repaint only the strip swept by the knob (and its shadow)
+        left = min(self._circle_position, pos) + 2
+        right = max(self._circle_position, pos) + 3 + 16 + 2
         self._circle_position = pos
-        self.update()
+        self.update(QRect(left, 0, right - left, 22))
 
     def isChecked(self):
         return self._checked
@@ -40,6 +48,7 @@ class ToggleSwitch(QWidget):
             self.animation.setStartValue(self._circle_position)
             self.animation.setEndValue(22 if checked else 0)
             self.animation.start()
+            self.update()  # Track color changes once, the animation moves the knob
             self.toggled.emit(checked)
 
     def mousePressEvent(self, event):
@@ -51,15 +60,15 @@ class ToggleSwitch(QWidget):
 
         # Draw background track
         if self._checked:
-            painter.setBrush(QColor("#0067C0"))
+            painter.setBrush(self.TRACK_ON)
         else:
-            painter.setBrush(QColor("#E1E1E1"))
+            painter.setBrush(self.TRACK_OFF)
 
         painter.setPen(Qt.PenStyle.NoPen)
         painter.drawRoundedRect(0, 0, 44, 22, 11, 11)
 
         # Draw circle
-        painter.setBrush(QColor("#FFFFFF"))
+        painter.setBrush(self.KNOB)
 
         # Add subtle shadow to circle
         shadow_offset = 1
@@ -2,17 +2,39 @@
 Focus Timer App - Main Entry Point
 This file launches the application by creating the main window.
 All UI components are in the UI/ directory.
+Run with --trace-startup (or FOCUSDOCK_TRACE_STARTUP=1) to print startup phase timings.
 """
 
+import os
+import sys
+import time
+
+_T0 = time.perf_counter()
+TRACE_STARTUP = "--trace-startup" in sys.argv or bool(os.environ.get("FOCUSDOCK_TRACE_STARTUP"))
+
+
+def startup_trace(phase):
+    """Print milliseconds since this module began loading"""
+    if TRACE_STARTUP:
+        print(f"[STARTUP] {(time.perf_counter() - _T0) * 1000:7.1f} ms  {phase}", flush=True)
+
+
+from PyQt6.QtCore import QTimer
 from PyQt6.QtWidgets import QApplication
+startup_trace("import PyQt6")
 from UI import MainWindow
+startup_trace("import UI")
 
 
 def main():
     """Launch the Focus Timer application"""
     app = QApplication([])
+    startup_trace("QApplication")
     window = MainWindow()
+    startup_trace("MainWindow init")
     window.show()
+    # Runs on the first event loop pass, once the window has been shown
+    QTimer.singleShot(0, lambda: startup_trace("window shown"))
     app.exec()
 
 
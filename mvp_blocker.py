@@ -1,27 +1,227 @@
-import argparse, asyncio, json, os, sys, time, ctypes, threading, urllib.parse, fnmatch, argparse, psutil
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from dataclasses import dataclass
-from typing import Iterable, List, Optional, Tuple
+import os, sys, time
+
+# Startup tracing (--trace-startup or FOCUSDOCK_TRACE_STARTUP=1): milliseconds since this module began loading
+_T0 = time.perf_counter()
+TRACE_STARTUP = "--trace-startup" in sys.argv or bool(os.environ.get("FOCUSDOCK_TRACE_STARTUP"))
+
+def startup_trace(phase: str) -> None:
+    if TRACE_STARTUP:
+        print(f"[STARTUP] {(time.perf_counter() - _T0) * 1000:7.1f} ms  {phase}", flush=True)
+
+import argparse, asyncio, bisect, json, re, fnmatch, hashlib, tempfile, socket, struct, contextvars, heapq, hmac, random, secrets, signal
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+# Imported on first use: psutil by AppBlocker, ctypes/winreg by the Windows PAC toggle
+psutil = None
+
+def _load_psutil():
+    global psutil
+    import psutil
+
+startup_trace("imports")
 
 # Track if we enabled PAC
 _pac_enabled = False
 
+# Default control endpoint for --daemon (Unix socket on POSIX, loopback TCP on Windows)
+CONTROL_PORT = 18081
+CONTROL_PATH = os.path.join(tempfile.gettempdir(), f"focusdock-blocker-{getattr(os, 'getuid', lambda: 0)()}.sock")
+# Per-run secret the loopback TCP endpoint requires; any local process (or web page) can reach the port
+CONTROL_TOKEN_PATH = os.path.join(tempfile.gettempdir(), f"focusdock-blocker-{getattr(os, 'getuid', lambda: 0)()}.token")
+
 # ---------- App Blocker ----------
-@dataclass(frozen=True)
-class _Rule:
+class _Rule(NamedTuple):
     pattern: str
-    lower: str
+    lower: str          # Lowercased name glob, normcased path prefix or lowercase hex digest
+    kind: str = "name"  # "name", "path" (path:PREFIX) or "sha256" (sha256:HEX)
 
     def match_name(self, name: str) -> bool:
         # Match process name against rule pattern (case-insensitive)
         return fnmatch.fnmatchcase(name.lower(), self.lower)
 
+    def match_path(self, path: str) -> bool:
+        # Executable path (normcased) under a directory prefix, or matching a path glob
+        return path.startswith(self.lower) or fnmatch.fnmatchcase(path, self.lower)
+
     def __repr__(self) -> str:
         return f"<Rule {self.pattern!r}>"
 
 
+class _Identity(NamedTuple):
+    lname: str          # Process name, lowercased
+    lbase: str          # Executable basename, lowercased
+    path: str = ""      # Executable path, normcased
+    digest: str = ""    # sha256 of the executable, when hash rules asked for it
+
+
+class _Frozen(NamedTuple):
+    proc: "psutil.Process"
+    ident: _Identity    # What the tree was matched by; thawed when no rule matches it any more
+    cgroup: bool        # Frozen via the cgroup freezer rather than a signal
+
+
+class ExeHashCache:
+    """sha256 of executables keyed by (path, size, mtime, inode), so each binary is read only once.
+
+    Hashing runs in a small thread pool; lookup() returns None while a digest is still being computed."""
+    def __init__(self, workers: int = 2, max_entries: int = 4096):
+        self.workers, self.max_entries = workers, max_entries
+        self.digests: Dict[tuple, str] = {}
+        self.pending: Dict[tuple, asyncio.Future] = {}
+        self._pool = None
+
+    @staticmethod
+    def _hash(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def lookup(self, path: str) -> Optional[str]:
+        """Digest of path, "" if it cannot be read, None if hashing is still in progress."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return ""
+        key = (path, st.st_size, st.st_mtime_ns, st.st_ino)
+        digest = self.digests.get(key)
+        if digest is None and key not in self.pending:
+            if self._pool is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="exe-hash")
+            fut = asyncio.get_running_loop().run_in_executor(self._pool, self._hash, path)
+            fut.add_done_callback(lambda f, key=key: self._done(key, f))
+            self.pending[key] = fut
+        return digest
+
+    def _done(self, key: tuple, fut: asyncio.Future):
+        self.pending.pop(key, None)
+        if len(self.digests) >= self.max_entries:
+            del self.digests[next(iter(self.digests))]  # Oldest first; replaced binaries age out
+        # Unreadable binaries are remembered too, until they change on disk
+        self.digests[key] = "" if fut.cancelled() or fut.exception() else fut.result()
+
+    async def wait(self):
+        # Until every hash started so far has finished
+        if self.pending:
+            await asyncio.wait(list(self.pending.values()))
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+class CgroupFreezer:
+    """cgroup v2 freezer (Linux): matched processes move into one frozen leaf group next to our own.
+
+    Unlike SIGSTOP a stray SIGCONT cannot wake them, and children they fork stay frozen. Needs a
+    writable cgroup tree (root or a delegated systemd slice); create() returns None otherwise."""
+    ROOT = "/sys/fs/cgroup"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.origin: Dict[int, str] = {}  # pid -> cgroup it came from
+
+    @classmethod
+    def create(cls) -> Optional["CgroupFreezer"]:
+        if not sys.platform.startswith("linux") or not os.path.exists(os.path.join(cls.ROOT, "cgroup.controllers")):
+            return None
+        try:
+            own = cls._cgroup_of("self")
+            path = os.path.join(cls.ROOT + os.path.dirname(own), f"focusdock-frozen-{os.getpid()}")
+            os.makedirs(path, exist_ok=True)
+            cls._write(os.path.join(path, "cgroup.freeze"), "1")
+        except (OSError, ValueError):
+            return None
+        return cls(path)
+
+    @staticmethod
+    def _cgroup_of(pid) -> str:
+        with open(f"/proc/{pid}/cgroup", "r") as f:
+            for line in f:
+                if line.startswith("0::"):
+                    return line[3:].strip()
+        raise ValueError("no cgroup v2 entry")
+
+    @staticmethod
+    def _write(path: str, value: str):
+        with open(path, "w") as f:
+            f.write(value)
+
+    def freeze(self, pid: int) -> bool:
+        try:
+            origin = self._cgroup_of(pid)
+            self._write(os.path.join(self.path, "cgroup.procs"), str(pid))
+        except (OSError, ValueError):
+            return False
+        self.origin[pid] = origin
+        return True
+
+    def thaw(self, pid: int):
+        # Leaving the frozen group thaws the process
+        origin = self.origin.pop(pid, None)
+        if origin is not None:
+            self._write(os.path.join(self.ROOT + origin, "cgroup.procs"), str(pid))
+
+    def close(self):
+        # Thaw whatever could not be moved back, then drop the group
+        try:
+            self._write(os.path.join(self.path, "cgroup.freeze"), "0")
+            os.rmdir(self.path)
+        except OSError:
+            pass
+
+
+class _NameIndex:
+    """Name globs bucketed by their literal prefix, so a process is only tried against globs that could match.
+
+    *word* globs become keywords of one Aho-Corasick automaton instead of a bucket every name hits."""
+    PREFIX = 3
+
+    def __init__(self, rules: Iterable[_Rule]):
+        self.exact: Dict[str, _Rule] = {}
+        self.buckets: Dict[str, List[_Rule]] = {}
+        self.contains: Dict[str, _Rule] = {}
+        for r in rules:
+            wild = next((i for i, c in enumerate(r.lower) if c in "*?["), None)
+            inner = r.lower[1:-1]
+            if wild is None:
+                self.exact.setdefault(r.lower, r)
+            elif len(r.lower) > 2 and r.lower[0] == r.lower[-1] == "*" and not any(c in inner for c in "*?["):
+                self.contains.setdefault(inner, r)
+            else:
+                self.buckets.setdefault(r.lower[:min(wild, self.PREFIX)], []).append(r)
+        self.keywords = KeywordAutomaton(self.contains) if self.contains else None
+
+    def match(self, name: str) -> Optional[_Rule]:
+        rule = self.exact.get(name)
+        if rule is not None:
+            return rule
+        if self.keywords is not None:
+            word = self.keywords.find(name)
+            if word is not None:
+                return self.contains[word]
+        for n in range(min(self.PREFIX, len(name)) + 1):
+            for rule in self.buckets.get(name[:n], ()):
+                if rule.match_name(name):
+                    return rule
+        return None
+
+
+class ProcessSource:
+    """Where AppBlocker reads the process table from: psutil here, SyntheticProcesses for benchmarks.
+
+    Entries behave like psutil.Process: pid, info (pid/name/exe), terminate, kill, wait, suspend,
+    resume, children and is_running, raising psutil's exceptions."""
+    def processes(self) -> Iterable["psutil.Process"]:
+        return psutil.process_iter(attrs=["pid", "name", "exe"])
+
+
 class AppBlocker:
-    """Periodically scans running processes and terminates those matching block patterns."""
+    """Periodically scans running processes and terminates (or freezes) those matching block patterns."""
     def __init__(
         self,
         patterns: Iterable[str],
@@ -30,15 +230,14 @@ class AppBlocker:
         scan_interval: float = 2.0,
         logger=None,
         dry_run: bool = False,
+        source: Optional[ProcessSource] = None,
     ) -> None:
-        self.rules: List[_Rule] = []
-        for p in patterns or []:
-            p = (p or "").strip()
-            if not p:
-                continue
-            self.rules.append(_Rule(pattern=p, lower=p.lower()))
+        _load_psutil()
+        self.source = source or ProcessSource()
+        self.hashes = ExeHashCache()
+        self.set_rules(self._compile(patterns))
         self.mode = mode.lower().strip() if mode else "polite"
-        if self.mode not in ("polite", "strict"):
+        if self.mode not in ("polite", "strict", "freeze"):
             self.mode = "polite"
         self.grace = max(0.0, float(grace_seconds))
         self.interval = max(0.5, float(scan_interval))
@@ -46,12 +245,43 @@ class AppBlocker:
         self.dry = bool(dry_run)
         self._stop = asyncio.Event()
         self._self_pid = os.getpid()
+        # Freeze mode: suspended pids are skipped by later scans and resumed when the blocker stops
+        self.frozen: Dict[int, _Frozen] = {}
+        self._cgroup = CgroupFreezer.create() if self.mode == "freeze" and not self.dry else None
 
         self._never = {
             "system", "idle", "init", "launchd", "systemd", "wininit.exe", "services.exe",
             "csrss.exe", "lsass.exe", "smss.exe"
         }
 
+    @staticmethod
+    def _compile(patterns: Iterable[str]) -> List[_Rule]:
+        rules = []
+        for p in patterns or []:
+            p = (p or "").strip()
+            if not p:
+                continue
+            kind, sep, rest = p.partition(":")
+            kind = kind.lower()
+            if sep and kind == "path" and rest.strip():
+                rules.append(_Rule(pattern=p, lower=os.path.normcase(rest.strip()), kind="path"))
+            elif sep and kind == "sha256" and rest.strip():
+                rules.append(_Rule(pattern=p, lower=rest.strip().lower(), kind="sha256"))
+            else:
+                rules.append(_Rule(pattern=p, lower=p.lower()))
+        return rules
+
+    def set_rules(self, rules: List[_Rule]) -> None:
+        self.rules = rules
+        self._names = _NameIndex(r for r in rules if r.kind == "name")
+        self._paths = [r for r in rules if r.kind == "path"]
+        self._digests = {r.lower: r.pattern for r in rules if r.kind == "sha256"}
+
+    def set_patterns(self, patterns: Iterable[str]) -> None:
+        """Replace the rule set; the next scan uses it. Frozen trees no rule matches any more are resumed."""
+        self.set_rules(self._compile(patterns))
+        self._thaw([pid for pid, f in self.frozen.items() if not self._matches_any(f.ident)[0]])
+
     async def run(self) -> None:
         """Main periodic scan loop."""
         try:
@@ -63,6 +293,18 @@ class AppBlocker:
                     pass
         except asyncio.CancelledError:
             return
+        finally:
+            self.resume_all()
+            self.hashes.close()
+
+    def resume_all(self) -> None:
+        """Resume every process this blocker froze."""
+        if self.frozen:
+            print(f"[APP BLOCK]  resuming {len(self.frozen)} frozen processes")
+        self._thaw(list(self.frozen))
+        if self._cgroup:
+            self._cgroup.close()
+            self._cgroup = None
 
     def stop(self) -> None:
         # Signal to stop scanning
@@ -70,10 +312,13 @@ class AppBlocker:
 
     async def _scan_once(self) -> None:
         # Scan all processes and apply blocking rules
-        for proc in psutil.process_iter(attrs=["pid", "name", "exe"]):
+        seen = set()
+        hashing = []  # Processes waiting for their executable's digest
+        for proc in self.source.processes():
             try:
                 pid = proc.info.get("pid") or proc.pid
-                if pid == self._self_pid:
+                seen.add(pid)
+                if pid == self._self_pid or pid in self.frozen:
                     continue
                 name = (proc.info.get("name") or "") or ""
                 exe = (proc.info.get("exe") or "") or ""
@@ -84,18 +329,19 @@ class AppBlocker:
                 if lname in self._never or lbase in self._never:
                     continue
 
-                matched, rule = self._matches_any(lname, lbase)
+                ident = _Identity(lname, lbase, os.path.normcase(exe) if exe else "")
+                matched, rule = self._matches_any(ident)
+                if not matched and self._digests and exe:
+                    # Renamed copies are still caught by content; unchanged binaries hit the cache
+                    digest = self.hashes.lookup(exe)
+                    if digest is None:
+                        hashing.append((proc, base or name, ident, exe))
+                        continue
+                    ident = ident._replace(digest=digest)
+                    matched, rule = self._matches_any(ident)
                 if not matched:
                     continue
-
-                if self.dry:
-                    await self._log("APP", f"{base or name}", 0, "MATCH-DRYRUN", rule)
-                    continue
-
-                if self.mode == "polite":
-                    await self._terminate(proc, base or name, rule, escalate=False)
-                else:
-                    await self._terminate(proc, base or name, rule, escalate=True)
+                await self._act(proc, base or name, rule, ident)
 
             except (psutil.NoSuchProcess, psutil.ZombieProcess):
                 continue
@@ -104,14 +350,49 @@ class AppBlocker:
             except Exception as e:
                 await self._log("APP", "scan", 0, f"ERROR {type(e).__name__}", str(e))
 
-    def _matches_any(self, lname: str, lbase: str) -> Tuple[bool, str]:
-        # Check if process name matches any rule
-        for r in self.rules:
-            if r.match_name(lname) or r.match_name(lbase):
-                return True, r.pattern
-        return False, ""
+        # Forget frozen pids that exited (killed by the user, say) so a reused pid is scanned again
+        for pid in [pid for pid in self.frozen if pid not in seen]:
+            del self.frozen[pid]
+            if self._cgroup:
+                self._cgroup.origin.pop(pid, None)
+
+        if hashing:
+            # First sight of these binaries: finish their hashes off the event loop, then decide
+            await self.hashes.wait()
+            for proc, display, ident, exe in hashing:
+                try:
+                    ident = ident._replace(digest=self.hashes.lookup(exe) or "")
+                    matched, rule = self._matches_any(ident)
+                    if matched:
+                        await self._act(proc, display, rule, ident)
+                except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                    continue
+                except psutil.AccessDenied:
+                    await self._log("APP", str(proc.pid), 0, "SKIP-ACCESSDENIED", "")
+
+    def _matches_any(self, ident: _Identity) -> Tuple[bool, str]:
+        # Check if process name, executable path or executable digest matches any rule
+        r = self._names.match(ident.lname) or (self._names.match(ident.lbase) if ident.lbase != ident.lname else None)
+        if r is not None:
+            return True, r.pattern
+        if ident.path:
+            for r in self._paths:
+                if r.match_path(ident.path):
+                    return True, r.pattern
+        rule = self._digests.get(ident.digest) if ident.digest else None
+        return (True, rule) if rule else (False, "")
 
-    async def _terminate(self, proc: psutil.Process, display: str, rule: str, escalate: bool) -> None:
+    async def _act(self, proc: "psutil.Process", display: str, rule: str, ident: _Identity) -> None:
+        if self.dry:
+            await self._log("APP", display, 0, "MATCH-DRYRUN", rule)
+        elif self.mode == "freeze":
+            await self._freeze(proc, display, rule, ident)
+        elif self.mode == "polite":
+            await self._terminate(proc, display, rule, escalate=False)
+        else:
+            await self._terminate(proc, display, rule, escalate=True)
+
+    async def _terminate(self, proc: "psutil.Process", display: str, rule: str, escalate: bool) -> None:
         # Attempt to terminate (and possibly kill) a process
         pid = proc.pid
         try:
@@ -133,6 +414,46 @@ class AppBlocker:
         except Exception as e:
             await self._log("APP", display, pid, f"ERROR {type(e).__name__}", f"rule={rule} {e}")
 
+    async def _freeze(self, proc: "psutil.Process", display: str, rule: str, ident: _Identity) -> None:
+        # Suspend the whole tree; a launcher sees its child still alive and does not respawn it
+        pid = proc.pid
+        try:
+            tree = [proc] + proc.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return
+        count = 0
+        for p in tree:
+            if p.pid in self.frozen or p.pid == self._self_pid:
+                continue
+            try:
+                cgroup = bool(self._cgroup and self._cgroup.freeze(p.pid))
+                if not cgroup:
+                    p.suspend()
+                self.frozen[p.pid] = _Frozen(p, ident, cgroup)
+                count += 1
+            except psutil.NoSuchProcess:
+                continue
+            except psutil.AccessDenied:
+                await self._log("APP", display, p.pid, "SKIP-ACCESSDENIED", f"rule={rule}")
+        if count:
+            await self._log("APP", display, pid, "FREEZE", f"rule={rule} procs={count}")
+
+    def _thaw(self, pids: Iterable[int]) -> None:
+        for pid in pids:
+            entry = self.frozen.pop(pid, None)
+            if entry is None:
+                continue
+            try:
+                # is_running() compares create times, so a reused pid is never touched
+                if not entry.proc.is_running():
+                    continue
+                if entry.cgroup:
+                    self._cgroup.thaw(pid)
+                else:
+                    entry.proc.resume()
+            except (psutil.Error, OSError) as e:
+                print(f"[WARN] Could not resume pid {pid}: {e}")
+
     async def _log(self, kind: str, host: str, port: int, decision: str, rule: str) -> None:
         # Log blocking actions
         if self.logger:
@@ -143,20 +464,364 @@ class AppBlocker:
                 pass
         print(f"[{kind}] {host}:{port} {decision} {rule}")
 
+class _FakeProcess:
+    """One synthetic process; signals act on the owning SyntheticProcesses table."""
+    __slots__ = ("pid", "info", "table", "denied")
+
+    def __init__(self, table: "SyntheticProcesses", pid: int, name: str, exe: str, denied: bool):
+        self.table, self.pid, self.denied = table, pid, denied
+        # Like process_iter(attrs=...), fields that cannot be read come back as None
+        self.info = {"pid": pid, "name": name, "exe": None if denied else exe}
+
+    def _check(self):
+        if not self.is_running():
+            raise psutil.NoSuchProcess(self.pid)
+        if self.denied:
+            raise psutil.AccessDenied(self.pid)
+
+    def is_running(self) -> bool:
+        return self.table.procs.get(self.pid) is self
+
+    def terminate(self):
+        self._check()
+        self.table.exit(self)
+
+    kill = terminate
+
+    def wait(self, timeout=None):
+        if self.is_running():
+            raise psutil.TimeoutExpired(timeout, self.pid)
+
+    def suspend(self):
+        self._check()
+
+    resume = suspend
+
+    def children(self, recursive: bool = False) -> list:
+        self._check()
+        return []
+
+
+class SyntheticProcesses(ProcessSource):
+    """Fake process table for benchmarking AppBlocker without real processes.
+
+    Every snapshot replaces a churn fraction of the table with new pids and renames a few processes;
+    a denied fraction hides its exe and refuses signals. Terminated matches are restarted with a
+    new pid by the next snapshot when respawn is set, like a launcher would."""
+    def __init__(self, count: int = 20000, hot_names: Iterable[str] = (), hot: float = 0.01,
+                 churn: float = 0.02, rename: float = 0.005, denied: float = 0.01,
+                 respawn: bool = True, seed: int = 0):
+        _load_psutil()
+        self.rand = random.Random(seed)
+        self.hot_names = list(hot_names)
+        self.hot, self.churn, self.rename, self.denied, self.respawn = hot, churn, rename, denied, respawn
+        self.procs: Dict[int, _FakeProcess] = {}
+        self.killed = 0
+        self._next_pid = 1000
+        self._restart: List[str] = []
+        for _ in range(count):
+            self._spawn()
+
+    def _spawn(self, name: Optional[str] = None):
+        if name is None:
+            if self.hot_names and self.rand.random() < self.hot:
+                name = self.rand.choice(self.hot_names)
+            else:
+                name = f"proc{self.rand.randrange(5000)}.exe"
+        self._next_pid += 1
+        proc = _FakeProcess(self, self._next_pid, name, f"/opt/apps/{name}", self.rand.random() < self.denied)
+        self.procs[proc.pid] = proc
+
+    def exit(self, proc: _FakeProcess):
+        del self.procs[proc.pid]
+        self.killed += 1
+        if self.respawn:
+            self._restart.append(proc.info["name"])
+
+    def processes(self) -> List[_FakeProcess]:
+        pids = list(self.procs)
+        for pid in self.rand.sample(pids, min(len(pids), int(len(pids) * self.churn))):
+            del self.procs[pid]
+            self._spawn()
+        for pid in self.rand.sample(pids, min(len(pids), int(len(pids) * self.rename))):
+            proc = self.procs.get(pid)
+            if proc is not None:
+                proc.info["name"] = f"renamed{self.rand.randrange(5000)}.exe"
+        for name in self._restart:
+            self._spawn(name)
+        self._restart = []
+        return list(self.procs.values())
+
+
+def bench_rules(count: int) -> Tuple[List[str], List[str]]:
+    """count app patterns in the shapes blocklists use, plus process names that hit some of them."""
+    patterns, hits = [], []
+    for i in range(count):
+        if i % 10 == 0:
+            patterns.append(f"*tool{i}*")          # Unanchored: checked against every process
+            hits.append(f"my-tool{i}-helper.exe")
+        elif i % 3 == 0:
+            patterns.append(f"game{i}.exe")         # Literal name
+            hits.append(f"game{i}.exe")
+        else:
+            patterns.append(f"app{i}*")             # Prefix glob
+            hits.append(f"app{i}-beta.exe")
+    return patterns, hits
+
+
+def run_app_benchmark(args) -> None:
+    """--bench-apps: scan latency, matcher cost and kill throughput of AppBlocker on a synthetic table."""
+    counts = [int(c) for c in args.bench_rules.split(",") if c.strip()]
+    print(f"[BENCH] {args.bench_procs} synthetic processes, rule counts {counts}")
+    print(f"{'rules':>7}  {'match us/proc':>13}  {'scan ms':>9}  {'kills/s':>9}")
+
+    async def one(count: int):
+        patterns, hits = bench_rules(count)
+        with tempfile.TemporaryDirectory() as tmp:
+            logger = Logger(os.path.join(tmp, "bench.log"), max_bytes=0, max_age=0, compress="none", keep=0)
+
+            # Matcher cost: identities as the scan builds them, hits included
+            blocker = AppBlocker(patterns, mode="strict", grace_seconds=0, logger=logger, dry_run=True,
+                                 source=SyntheticProcesses(0))
+            sample = [_Identity(n, n, f"/opt/apps/{n}") for n in
+                      ([f"proc{i}.exe" for i in range(5000)] + hits[:500])]
+            t0 = time.perf_counter()
+            for ident in sample:
+                blocker._matches_any(ident)
+            match_us = (time.perf_counter() - t0) / len(sample) * 1e6
+
+            # Scan latency: matches are only logged, the table churns between scans
+            blocker.source = SyntheticProcesses(args.bench_procs, hits, respawn=False)
+            await blocker._scan_once()
+            t0 = time.perf_counter()
+            for _ in range(3):
+                await blocker._scan_once()
+            scan_ms = (time.perf_counter() - t0) / 3 * 1000
+
+            # Kill throughput: a table where one in twenty processes matches and launchers respawn them
+            source = SyntheticProcesses(args.bench_procs, hits, hot=0.05)
+            blocker = AppBlocker(patterns, mode="strict", grace_seconds=0, logger=logger, source=source)
+            t0 = time.perf_counter()
+            for _ in range(3):
+                await blocker._scan_once()
+            kills = source.killed / (time.perf_counter() - t0)
+            await logger.close()
+        print(f"{count:>7}  {match_us:>13.2f}  {scan_ms:>9.1f}  {kills:>9.0f}")
+
+    async def main():
+        for count in counts:
+            await one(count)
+
+    asyncio.run(main())
+
 # ---------- Domain Blocklist ----------
+class _TrieNode:
+    __slots__ = ("prefix", "length", "terminal", "children")
+
+    def __init__(self, prefix: int, length: int, terminal: bool = False):
+        self.prefix, self.length, self.terminal = prefix, length, terminal
+        self.children = [None, None]
+
+
+class IpTrie:
+    """Path-compressed binary (Patricia) trie of IPv4/IPv6 networks; answers "is this address covered?"."""
+    def __init__(self, networks: Iterable[str] = ()):
+        self.roots = {4: _TrieNode(0, 0), 6: _TrieNode(0, 0)}
+        self.networks: List[str] = []
+        for net in networks:
+            self.add(net)
+
+    def __len__(self):
+        return len(self.networks)
+
+    @staticmethod
+    def parse_network(text: str):
+        """ipaddress network for "1.2.3.4", "10.0.0.0/8", "2001:db8::/32"; None if text is not an IP rule."""
+        text = text.strip().strip("[]")
+        if not text or not (text[0].isdigit() or ":" in text):
+            return None
+        import ipaddress
+        try:
+            return ipaddress.ip_network(text, strict=False)
+        except ValueError:
+            return None
+
+    def add(self, text: str) -> bool:
+        net = self.parse_network(text)
+        if net is None:
+            return False
+        self.networks.append(str(net))
+        self._insert(self.roots[net.version], int(net.network_address), net.prefixlen, net.max_prefixlen)
+        return True
+
+    @staticmethod
+    def _insert(node: _TrieNode, value: int, length: int, width: int):
+        while True:
+            if node.terminal:
+                return  # Already covered by a shorter prefix
+            if node.length == length:
+                node.terminal, node.children = True, [None, None]
+                return
+            bit = (value >> (width - 1 - node.length)) & 1
+            child = node.children[bit]
+            if child is None:
+                node.children[bit] = _TrieNode(value, length, True)
+                return
+            diff = value ^ child.prefix
+            common = min(width - diff.bit_length(), length, child.length)
+            if common == child.length:
+                node = child
+                continue
+            # Split the edge at the first differing bit
+            mid = _TrieNode(value >> (width - common) << (width - common) if common else 0, common)
+            mid.children[(child.prefix >> (width - 1 - common)) & 1] = child
+            if common == length:
+                mid.terminal, mid.children = True, [None, None]
+            else:
+                mid.children[(value >> (width - 1 - common)) & 1] = _TrieNode(value, length, True)
+            node.children[bit] = mid
+            return
+
+    def contains(self, host: str) -> bool:
+        return self.covers(parse_ip(host))
+
+    def covers(self, addr: Optional[Tuple[int, int]]) -> bool:
+        # addr as returned by parse_ip
+        if addr is None:
+            return False
+        version, value = addr
+        width = 32 if version == 4 else 128
+        node = self.roots[version]
+        while True:
+            if node.terminal:
+                return True
+            if node.length == width:
+                return False
+            child = node.children[(value >> (width - 1 - node.length)) & 1]
+            if child is None or (value ^ child.prefix) >> (width - child.length):
+                return False
+            node = child
+
+
+def parse_ip(host: str) -> Optional[Tuple[int, int]]:
+    """(4 or 6, integer) for an IP literal, IPv4-mapped IPv6 folded to IPv4; None for names."""
+    if not host or not (host[0].isdigit() or ":" in host):
+        return None
+    host = host.strip("[]").partition("%")[0]
+    try:
+        return 4, int.from_bytes(socket.inet_pton(socket.AF_INET, host), "big")
+    except OSError:
+        pass
+    try:
+        value = int.from_bytes(socket.inet_pton(socket.AF_INET6, host), "big")
+    except OSError:
+        return None
+    if value >> 32 == 0xFFFF:
+        return 4, value & 0xFFFFFFFF
+    return 6, value
+
+
+class ResolverMap:
+    """Recently resolved address -> name, fed by the DNS cache; lets IP-literal connections inherit domain rules."""
+    def __init__(self, size: int = 65536):
+        self.size = size
+        self.names: "OrderedDict[Tuple[int, int], Tuple[str, float]]" = OrderedDict()
+
+    def add(self, host: str, ip: str, ttl: float):
+        addr = parse_ip(ip)
+        if addr is None:
+            return
+        self.names[addr] = (host, time.monotonic() + ttl)
+        self.names.move_to_end(addr)
+        while len(self.names) > self.size:
+            self.names.popitem(last=False)
+
+    def lookup(self, addr: Optional[Tuple[int, int]]) -> Optional[str]:
+        entry = self.names.get(addr) if addr else None
+        if entry is None:
+            return None
+        if entry[1] < time.monotonic():
+            del self.names[addr]
+            return None
+        return entry[0]
+
+class KeywordAutomaton:
+    """Aho-Corasick automaton over host keywords: one pass per host, whatever the number of keywords."""
+    def __init__(self, keywords: Iterable[str] = ()):
+        self.keywords = sorted({k for k in keywords if k})
+        # Trie first: goto[state][char] -> state, out[state] = keyword ending here (or via fail links)
+        goto: List[Dict[str, int]] = [{}]
+        out: List[Optional[str]] = [None]
+        for kw in self.keywords:
+            state = 0
+            for ch in kw:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = goto[state][ch] = len(goto)
+                    goto.append({})
+                    out.append(None)
+                state = nxt
+            out[state] = kw
+
+        # Breadth-first fail links, folded into a full transition table so matching never backtracks
+        alphabet = {ch for kw in self.keywords for ch in kw}
+        delta: List[Dict[str, int]] = [dict() for _ in goto]
+        fail = [0] * len(goto)
+        queue = []
+        for ch in alphabet:
+            nxt = goto[0].get(ch, 0)
+            delta[0][ch] = nxt
+            if nxt:
+                queue.append(nxt)
+        for state in queue:  # queue grows while iterating (BFS)
+            if out[state] is None:
+                out[state] = out[fail[state]]
+            for ch in alphabet:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    delta[state][ch] = delta[fail[state]][ch]
+                else:
+                    fail[nxt] = delta[fail[state]][ch]
+                    delta[state][ch] = nxt
+                    queue.append(nxt)
+        self._delta, self._out = delta, out
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def find(self, text: str) -> Optional[str]:
+        """First keyword found in text, or None."""
+        if not self.keywords:
+            return None
+        delta, out, state = self._delta, self._out, 0
+        for ch in text:
+            state = delta[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+
 class DomainMatcher:
     """Checks if a domain is blocked or explicitly allowed."""
     def __init__(self, blocked_domains, unblocked_domains=None):
         unblocked_domains = unblocked_domains or []
         self.blocked_exact, self.blocked_suffixes = set(), []
         self.unblocked_exact, self.unblocked_suffixes = set(), []
+        # IP/CIDR rules, and optionally recent DNS answers to map addresses back to names
+        self.blocked_nets, self.unblocked_nets = IpTrie(), IpTrie()
+        self.reverse: Optional[ResolverMap] = None
+        self.limited: List[Tuple["DomainMatcher", "CategoryMeter"]] = []
+        # "*word*" rules: substrings anywhere in the host
+        blocked_keywords, unblocked_keywords = [], []
 
         # Prepare blocked
         for d in blocked_domains:
             d = d.strip().lower().rstrip(".")
-            if not d:
+            if not d or self.blocked_nets.add(d):
                 continue
-            if d.startswith("*."):
+            if len(d) > 2 and d[0] == "*" and d[-1] == "*":
+                blocked_keywords.append(d.strip("*"))
+            elif d.startswith("*."):
                 self.blocked_suffixes.append("." + d[2:])
             else:
                 self.blocked_exact.add(d)
@@ -165,115 +830,1334 @@ class DomainMatcher:
         # Prepare unblocked
         for d in unblocked_domains:
             d = d.strip().lower().rstrip(".")
-            if not d:
+            if not d or self.unblocked_nets.add(d):
                 continue
-            if d.startswith("*."):
+            if len(d) > 2 and d[0] == "*" and d[-1] == "*":
+                unblocked_keywords.append(d.strip("*"))
+            elif d.startswith("*."):
                 self.unblocked_suffixes.append("." + d[2:])
             else:
                 self.unblocked_exact.add(d)
                 self.unblocked_suffixes.append("." + d)
 
+        self.blocked_keywords = KeywordAutomaton(blocked_keywords)
+        self.unblocked_keywords = KeywordAutomaton(unblocked_keywords)
+
     def is_blocked(self, host: str) -> bool:
         # Determine if a host should be blocked
+        return self.verdict(host) is True
+
+    def verdict(self, host: str) -> Optional[bool]:
+        """True if blocked, False if explicitly allowed, None if not listed."""
         h = host.lower().rstrip(".")
+        addr = parse_ip(h)
+        if addr is not None:
+            return self._ip_verdict(addr)
 
         # Explicitly allowed — if in unblocked list, never block
         if h in self.unblocked_exact or any(h.endswith(s) for s in self.unblocked_suffixes):
             return False
+        if self.unblocked_keywords.find(h) is not None:
+            return False
 
         # Explicitly blocked — only if found in blocked lists
         if h in self.blocked_exact or any(h.endswith(s) for s in self.blocked_suffixes):
             return True
+        if self.blocked_keywords.find(h) is not None:
+            return True
 
         # Not listed anywhere → not blocked
-        return False
+        return None
+
+    def _ip_verdict(self, addr: Tuple[int, int]) -> Optional[bool]:
+        # IP literals: network rules first, then the name it was recently resolved from
+        if self.unblocked_nets.covers(addr):
+            return False
+        if self.blocked_nets.covers(addr):
+            return True
+        name = self.reverse.lookup(addr) if self.reverse else None
+        return self.verdict(name) if name is not None else None
+
+    def add_limited(self, domains: Iterable[str], meter: "CategoryMeter"):
+        """Hosts of a quota/throttle category: allowed, but their traffic is metered."""
+        self.limited.append((DomainMatcher(domains), meter))
+
+    def decide(self, host: str) -> Tuple[str, Optional["CategoryMeter"]]:
+        """("BLOCK" | "QUOTA" | "LIMIT" | "ALLOW", meter for LIMIT)."""
+        verdict = self.verdict(host)
+        if verdict is not None or not self.limited:
+            return ("BLOCK" if verdict else "ALLOW"), None
+        for sub, meter in self.limited:
+            if sub.verdict(host):
+                return ("QUOTA", None) if meter.exhausted() else ("LIMIT", meter)
+        return "ALLOW", None
+
+
+# Decisions that refuse the connection
+DENIED = frozenset(("BLOCK", "QUOTA"))
+
+
+class CategoryMeter:
+    """Shared throttle (token bucket) and daily time accounting for one limited category."""
+    __slots__ = ("name", "quota", "rate", "tokens", "last", "used", "book")
+    ACTIVE_GAP = 10.0  # Seconds between chunks still counted as continuous use
+
+    def __init__(self, name: str, book: "QuotaBook", quota: float = 0.0, rate: float = 0.0, used: float = 0.0):
+        self.name, self.book = name, book
+        self.quota = quota      # Seconds of use per day, 0 = unlimited
+        self.rate = rate        # Bytes per second, 0 = unthrottled
+        self.tokens = rate      # Bucket holds at most one second of traffic
+        self.last = 0.0
+        self.used = used
+
+    def exhausted(self) -> bool:
+        return 0 < self.quota <= self.used
+
+    def allows(self, n: int, now: float) -> bool:
+        """Whether n bytes may go out at loop time now without waiting; charges nothing."""
+        if self.exhausted():
+            return False
+        if self.rate <= 0:
+            return True
+        tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        return tokens >= min(n, self.rate)  # A datagram larger than the bucket needs a full one
+
+    def account(self, n: int, now: float) -> float:
+        """Charge n bytes at loop time now; returns how long the caller should wait before sending."""
+        gap = now - self.last
+        self.last = now
+        if gap < self.ACTIVE_GAP:
+            was = self.exhausted()
+            self.used += gap
+            if not was and self.exhausted():
+                self.book.exhausted(self)
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.rate, self.tokens + gap * self.rate) - n
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class QuotaBook:
+    """Meters of all limited categories; daily usage survives restarts in a small JSON file."""
+    def __init__(self, path: str, on_change=None):
+        self.path = path
+        self.on_change = on_change  # Called when a category runs out or the day rolls over
+        self.meters: Dict[str, CategoryMeter] = {}
+        self.day = time.strftime("%Y-%m-%d")
+        self._restored: Dict[str, float] = {}
+        self._saved: Dict[str, float] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("day") == self.day:
+                self._restored = {k: float(v) for k, v in state.get("used", {}).items()}
+                self._saved = dict(self._restored)
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def configure(self, limits: Dict[str, Tuple[float, float]]):
+        """limits: category -> (daily quota seconds, bytes per second); usage so far is kept."""
+        meters = {}
+        for name, (quota, rate) in limits.items():
+            meter = self.meters.get(name)
+            if meter is None:
+                meter = CategoryMeter(name, self, quota, rate, self._restored.get(name, 0.0))
+            else:
+                meter.quota, meter.rate = quota, rate
+            meters[name] = meter
+        self.meters = meters
+
+    def exhausted(self, meter: CategoryMeter):
+        print(f"[QUOTA]      {meter.name}: daily quota used up")
+        self.save(force=True)
+        if self.on_change:
+            self.on_change()
+
+    def exhausted_names(self) -> Set[str]:
+        return {name for name, meter in self.meters.items() if meter.exhausted()}
+
+    def save(self, force: bool = False):
+        # Only rewrite the file when a counter moved by at least a second
+        used = {name: round(m.used, 1) for name, m in self.meters.items() if m.used}
+        if not force and all(abs(used.get(k, 0) - self._saved.get(k, 0)) < 1 for k in set(used) | set(self._saved)):
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"day": self.day, "used": used}, f)
+            os.replace(self.path + ".tmp", self.path)
+            self._saved = used
+        except OSError as e:
+            print(f"[WARN] Could not save quota usage: {e}")
+
+    async def run(self, interval: float = 30.0):
+        # Periodic save, and reset of all counters at local midnight
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                today = time.strftime("%Y-%m-%d")
+                if today != self.day:
+                    self.day, self._restored = today, {}
+                    for meter in self.meters.values():
+                        meter.used = 0.0
+                    if self.on_change:
+                        self.on_change()
+                self.save()
+        except asyncio.CancelledError:
+            return
+
+    def status(self) -> dict:
+        return {name: {"used_minutes": round(m.used / 60, 1), "quota_minutes": round(m.quota / 60, 1),
+                       "rate_kbps": round(m.rate * 8 / 1000)} for name, m in self.meters.items()}
 
 # ---------- Logging ----------
+LOG_FIELDS = ("ts", "mono", "kind", "host", "port", "decision", "rule")
+
+
+def _compress_segment(path: str, method: str) -> str:
+    """Compress a closed log segment next to itself and remove the original."""
+    if method == "zstd":
+        import zstandard
+        out = path + ".zst"
+        with open(path, "rb") as src, open(out + ".tmp", "wb") as dst:
+            zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+    else:
+        import gzip, shutil
+        out = path + ".gz"
+        with open(path, "rb") as src, gzip.open(out + ".tmp", "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst, 1 << 20)
+    os.replace(out + ".tmp", out)
+    os.remove(path)
+    return out
+
+
+def log_segments(path: str) -> List[str]:
+    """All segments of a log, oldest first; the active file (if any) comes last."""
+    folder, base = os.path.split(path)
+    folder = folder or "."
+    segments = {}
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        names = []
+    for name in names:
+        if not name.startswith(base + ".") or name.endswith(".tmp"):
+            continue
+        stem = name[len(base) + 1:]
+        key = stem.rsplit(".", 1)[0] if stem.endswith((".gz", ".zst")) else stem
+        # Prefer the compressed copy if compression finished but the original was not removed yet
+        if key not in segments or name.endswith((".gz", ".zst")):
+            segments[key] = os.path.join(folder, name)
+    ordered = [segments[k] for k in sorted(segments)]
+    if os.path.exists(path):
+        ordered.append(path)
+    return ordered
+
+
+def _open_segment(path: str, binary: bool = False):
+    if path.endswith(".gz"):
+        import gzip
+        return gzip.open(path, "rb") if binary else gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    if path.endswith(".zst"):
+        import io, zstandard
+        raw = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+        return raw if binary else io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+    return open(path, "rb") if binary else open(path, "r", encoding="utf-8", errors="replace")
+
+
+def _parse_legacy_line(line: str) -> Optional[dict]:
+    # "2025-11-09 14:30:15 CONNECT facebook.com:443 BLOCK [rule]" from older versions
+    parts = line.split(" ", 5)
+    if len(parts) < 5:
+        return None
+    try:
+        ts = time.mktime(time.strptime(f"{parts[0]} {parts[1]}", "%Y-%m-%d %H:%M:%S"))
+    except ValueError:
+        return None
+    host, _, port = parts[3].rpartition(":")
+    return {"ts": ts, "mono": None, "kind": parts[2], "host": host, "port": int(port) if port.isdigit() else 0,
+            "decision": parts[4], "rule": parts[5] if len(parts) > 5 else ""}
+
+
+def _parse_log_line(line: str) -> Optional[dict]:
+    line = line.strip()
+    if not line:
+        return None
+    if line[0] == "{":
+        try:
+            return json.loads(line)
+        except ValueError:
+            return None
+    return _parse_legacy_line(line)
+
+
+def read_log(path: str, segments: Optional[List[str]] = None):
+    """Lazily yield log records (dicts with LOG_FIELDS) from every segment, oldest first."""
+    for seg in segments if segments is not None else log_segments(path):
+        try:
+            f = _open_segment(seg)
+        except (OSError, ImportError):
+            continue
+        with f:
+            for line in f:
+                rec = _parse_log_line(line)
+                if rec: yield rec
+
+
 class Logger:
-    """Async file logger for traffic and blocking events."""
-    def __init__(self, path):
+    """Async traffic logger: newline-delimited JSON records, rotated by size/age, old segments compressed."""
+    def __init__(self, path, max_bytes: int = 16 * 1024 * 1024, max_age: float = 24 * 3600,
+                 compress: str = "gzip", keep: int = 30, policy: Optional["LogPolicy"] = None):
         self.path = path
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        self._lock = asyncio.Lock()
+        self.policy = policy
+        self._counter_timer: Optional[asyncio.TimerHandle] = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes, self.max_age, self.keep = max_bytes, max_age, keep
+        self.compress = compress
+        if compress == "zstd":
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                print("[WARN] zstandard not installed, compressing logs with gzip")
+                self.compress = "gzip"
+        self._pending: List[asyncio.Future] = []
+        self._open()
+
+    def _open(self):
+        self._f = open(self.path, "a", encoding="utf-8")
+        self._size = self._f.tell()
+        try:
+            self._opened = os.path.getmtime(self.path) if self._size else time.time()
+        except OSError:
+            self._opened = time.time()
+
+    def _rotate(self):
+        # Close the active file, give it a timestamped name and compress it off the event loop
+        self._f.close()
+        seg = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        n = 1
+        while any(os.path.exists(seg + ext) for ext in ("", ".gz", ".zst")):
+            seg = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}-{n:03d}"; n += 1
+        os.replace(self.path, seg)
+        self._open()
+        if self.compress != "none":
+            try:
+                loop = asyncio.get_running_loop()
+                self._pending.append(loop.run_in_executor(None, _compress_segment, seg, self.compress))
+            except RuntimeError:
+                _compress_segment(seg, self.compress)
+        self._pending = [f for f in self._pending if not f.done()]
+        self._prune()
+
+    def _prune(self):
+        # Drop the oldest closed segments beyond `keep`
+        closed = log_segments(self.path)[:-1]
+        for old in closed[:max(0, len(closed) - self.keep)]:
+            try: os.remove(old)
+            except OSError: pass
 
     async def write(self, kind, host, port, decision, rule=""):
-        # Write a log entry to file
-        line = f'{time.strftime("%Y-%m-%d %H:%M:%S")} {kind} {host}:{port} {decision}'
+        # Write a log entry to file, unless the policy folds it into a counter
+        sampled = False
+        if self.policy:
+            verdict = self.policy.admit(kind, host, port, decision)
+            if verdict is None:
+                self._schedule_counters()
+                return
+            sampled = verdict == LogPolicy.SAMPLED
+        rec = {"ts": round(time.time(), 3), "mono": round(time.monotonic(), 3), "kind": kind,
+               "host": host, "port": port, "decision": decision}
         if rule:
-            line += f' {rule}'
-        line += '\n'
-        async with self._lock:
-            with open(self.path, "a", encoding="utf-8") as f:
-                f.write(line)
+            rec["rule"] = rule
+        if sampled:
+            rec["sampled"] = True
+        self._append(rec)
+
+    def _append(self, rec: dict):
+        line = json.dumps(rec, separators=(",", ":"), ensure_ascii=False) + "\n"
+        if self._size and (self._size + len(line) > self.max_bytes > 0 or
+                           (self.max_age > 0 and time.time() - self._opened > self.max_age)):
+            self._rotate()
+        self._f.write(line)
+        self._f.flush()
+        self._size += len(line)
+
+    def _schedule_counters(self):
+        if self._counter_timer is None:
+            loop = asyncio.get_running_loop()
+            self._counter_timer = loop.call_later(self.policy.interval, self.flush_counters)
+
+    def flush_counters(self):
+        """Write one record per aggregated (kind, host, port) with its repeat count."""
+        self._counter_timer = None
+        since, counts = self.policy.drain()
+        now, mono = round(time.time(), 3), round(time.monotonic(), 3)
+        for (kind, host, port), n in counts.items():
+            self._append({"ts": now, "mono": mono, "kind": kind, "host": host, "port": port,
+                          "decision": "ALLOW", "count": n, "since": round(since, 3)})
+
+    async def close(self):
+        """Flush the active file and wait for background compression to finish."""
+        if self._counter_timer is not None:
+            self._counter_timer.cancel()
+        if self.policy:
+            self.flush_counters()
+        self._f.flush()
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+            self._pending = []
+        self._f.close()
+
+
+class LogPolicy:
+    """Decides which records are written individually.
+
+    BLOCKs and other non-ALLOW decisions are always written, as is the first ALLOW for a host.
+    Repeat ALLOWs are counted per (kind, host, port) and written as one record per interval;
+    `sample` is the fraction of them that is still written individually.
+    """
+    LOGGED, SAMPLED = 1, 2
+
+    def __init__(self, interval: float = 60.0, sample: float = 0.0, max_hosts: int = 100000):
+        self.interval, self.sample, self.max_hosts = interval, sample, max_hosts
+        self.seen: Set[str] = set()
+        self.counts: Dict[Tuple[str, str, int], int] = {}
+        self.since = time.time()
+
+    def admit(self, kind, host, port, decision) -> Optional[int]:
+        # LOGGED / SAMPLED to write the record, None when it was folded into a counter
+        if decision != "ALLOW":
+            return self.LOGGED
+        if host not in self.seen:
+            if len(self.seen) >= self.max_hosts:
+                self.seen.clear()
+            self.seen.add(host)
+            return self.LOGGED
+        if self.sample and random.random() < self.sample:
+            return self.SAMPLED
+        key = (kind, host, port)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return None
+
+    def drain(self) -> Tuple[float, Dict[Tuple[str, str, int], int]]:
+        since, counts = self.since, self.counts
+        self.since, self.counts = time.time(), {}
+        return since, counts
+
+
+# ---------- Log analytics ----------
+def _segment_key(seg: str) -> str:
+    name = os.path.basename(seg)
+    return name.rsplit(".", 1)[0] if name.endswith((".gz", ".zst")) else name
+
+
+class LogStats:
+    """Streaming per-host/category/decision/hour counters over the traffic log, resumable from a checkpoint."""
+    VERSION = 1
+
+    def __init__(self, websites: Optional[dict] = None, max_hosts: int = 50000):
+        self.max_hosts = max_hosts
+        self.records = 0
+        self.hosts_dropped = 0                       # records whose host fell out of the bounded table
+        self.decisions: Dict[str, int] = {}
+        self.hosts: Dict[str, Dict[str, int]] = {}   # host -> decision -> count
+        self.categories: Dict[str, Dict[str, int]] = {}
+        self.hours: Dict[str, Dict[str, int]] = {}   # "YYYY-mm-dd HH" -> decision -> count
+        # Checkpoint: closed segments already counted, and how far into the active file we got
+        self.done: Set[str] = set()
+        self.active_head: Optional[str] = None
+        self.active_offset = 0
+
+        self._domains: Dict[str, str] = {}
+        self._apps: List[Tuple[str, str]] = []
+        for name, info in (websites or {}).items():
+            for url in info.get("urls", []):
+                d = url.strip().lower().rstrip(".")
+                if d.startswith("*."):
+                    d = d[2:]
+                if d:
+                    self._domains.setdefault(d, name)
+            if info.get("apps", "").strip():
+                self._apps.append((info["apps"].strip().lower(), name))
+        self._cat_cache: Dict[Tuple[str, str], str] = {}
+
+    def category_of(self, kind: str, host: str) -> str:
+        key = (kind, host)
+        cat = self._cat_cache.get(key)
+        if cat is not None:
+            return cat
+        cat = "-"
+        h = host.lower().rstrip(".")
+        if kind == "APP":
+            for pattern, name in self._apps:
+                if fnmatch.fnmatch(h, pattern):
+                    cat = name
+                    break
+        else:
+            # Longest listed suffix wins: a.b.example.com -> b.example.com -> example.com
+            while h:
+                if h in self._domains:
+                    cat = self._domains[h]
+                    break
+                h = h.partition(".")[2]
+        if len(self._cat_cache) > 4 * self.max_hosts:
+            self._cat_cache.clear()
+        self._cat_cache[key] = cat
+        return cat
+
+    @staticmethod
+    def _bump(table: Dict[str, Dict[str, int]], key: str, decision: str, n: int = 1):
+        row = table.get(key)
+        if row is None:
+            row = table[key] = {}
+        row[decision] = row.get(decision, 0) + n
+
+    def add(self, rec: dict):
+        decision = str(rec.get("decision", "?"))
+        host = str(rec.get("host", "?"))
+        kind = str(rec.get("kind", "?"))
+        n = int(rec.get("count", 1))
+        self.records += n
+        self.decisions[decision] = self.decisions.get(decision, 0) + n
+        self._bump(self.categories, self.category_of(kind, host), decision, n)
+        if rec.get("ts"):
+            self._bump(self.hours, time.strftime("%Y-%m-%d %H", time.localtime(rec["ts"])), decision, n)
+        self._bump(self.hosts, host, decision, n)
+        if len(self.hosts) > self.max_hosts:
+            self._shrink_hosts()
+
+    def _shrink_hosts(self):
+        # Keep memory bounded: drop the least frequent half of the host table
+        ranked = sorted(self.hosts.items(), key=lambda kv: sum(kv[1].values()), reverse=True)
+        keep = self.max_hosts // 2
+        self.hosts_dropped += sum(sum(row.values()) for _, row in ranked[keep:])
+        self.hosts = dict(ranked[:keep])
+
+    def update(self, path: str) -> int:
+        """Count every record not seen by a previous run; returns the number of new records."""
+        before = self.records
+        segments = log_segments(path)
+        for seg in segments:
+            active = seg == path
+            key = _segment_key(seg)
+            if not active and key in self.done:
+                continue
+            try:
+                f = _open_segment(seg, binary=True)
+            except (OSError, ImportError) as e:
+                print(f"[WARN] Skipping {seg}: {e}")
+                continue
+            head, skip, offset = None, 0, 0
+            with f:
+                for line in f:
+                    if not line.endswith(b"\n") and active:
+                        break  # Record still being written
+                    if head is None:
+                        head = hashlib.sha1(line).hexdigest()
+                        # Same first line as the active file last time: resume where we stopped
+                        if head == self.active_head:
+                            skip = self.active_offset
+                    offset += len(line)
+                    if offset <= skip:
+                        continue
+                    rec = _parse_log_line(line.decode("utf-8", "replace"))
+                    if rec:
+                        self.add(rec)
+            if active:
+                self.active_head, self.active_offset = head, offset
+            else:
+                if head is not None and head == self.active_head:
+                    self.active_head, self.active_offset = None, 0
+                self.done.add(key)
+        self.done &= {_segment_key(seg) for seg in segments}
+        return self.records - before
+
+    def top_hosts(self, n: int, decision: Optional[str] = None) -> List[Tuple[str, int]]:
+        if decision:
+            rows = ((h, row.get(decision, 0)) for h, row in self.hosts.items())
+        else:
+            rows = ((h, sum(row.values())) for h, row in self.hosts.items())
+        return heapq.nlargest(n, (r for r in rows if r[1]), key=lambda r: r[1])
+
+    def summary(self, top: int = 20) -> dict:
+        """JSON-friendly report for the UI."""
+        return {
+            "generated": time.time(),
+            "records": self.records,
+            "decisions": self.decisions,
+            "categories": self.categories,
+            "hours": dict(sorted(self.hours.items())),
+            "top_hosts": [{"host": h, "count": c, "decisions": self.hosts[h]} for h, c in self.top_hosts(top)],
+            "top_blocked": [{"host": h, "count": c} for h, c in self.top_hosts(top, "BLOCK")],
+            "top_allowed": [{"host": h, "count": c} for h, c in self.top_hosts(top, "ALLOW")],
+            "hosts_dropped": self.hosts_dropped,
+        }
+
+    def to_checkpoint(self) -> dict:
+        return {"version": self.VERSION, "records": self.records, "hosts_dropped": self.hosts_dropped,
+                "decisions": self.decisions, "hosts": self.hosts, "categories": self.categories,
+                "hours": self.hours, "done": sorted(self.done),
+                "active_head": self.active_head, "active_offset": self.active_offset}
+
+    def load_checkpoint(self, path: str) -> bool:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("version") != self.VERSION:
+            return False
+        self.records, self.hosts_dropped = data["records"], data["hosts_dropped"]
+        self.decisions, self.hosts = data["decisions"], data["hosts"]
+        self.categories, self.hours = data["categories"], data["hours"]
+        self.done = set(data["done"])
+        self.active_head, self.active_offset = data["active_head"], data["active_offset"]
+        return True
+
+    def save_checkpoint(self, path: str):
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.to_checkpoint(), f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+
+
+def _print_table(title: str, rows: Iterable[Tuple[str, int]]):
+    rows = list(rows)
+    print(f"\n{title}")
+    if not rows:
+        print("  (none)")
+        return
+    width = max(len(str(k)) for k, _ in rows)
+    for key, count in rows:
+        print(f"  {str(key):<{width}}  {count:>10,}")
+
+
+def run_analytics(args) -> None:
+    """--analyze: fold new log records into the checkpoint and print/export the summary."""
+    websites = {}
+    try:
+        with open(args.blocklist, "r", encoding="utf-8") as f:
+            websites = json.load(f).get("websites", {})
+    except (OSError, ValueError) as e:
+        print(f"[WARN] No categories ({e})")
+
+    checkpoint = args.analyze_checkpoint or os.path.splitext(args.log)[0] + ".stats.json"
+    stats = LogStats(websites)
+    if not args.analyze_reset and stats.load_checkpoint(checkpoint):
+        print(f"[ANALYZE] Resuming from {checkpoint} ({stats.records:,} records)")
+    started = time.perf_counter()
+    added = stats.update(args.log)
+    print(f"[ANALYZE] {added:,} new records in {time.perf_counter() - started:.2f}s")
+    os.makedirs(os.path.dirname(checkpoint) or ".", exist_ok=True)
+    stats.save_checkpoint(checkpoint)
+
+    top = args.top
+    _print_table("Decisions", sorted(stats.decisions.items(), key=lambda kv: -kv[1]))
+    _print_table("Categories (blocked)", heapq.nlargest(top, (
+        (name, row.get("BLOCK", 0)) for name, row in stats.categories.items() if row.get("BLOCK")), key=lambda r: r[1]))
+    _print_table(f"Top {top} blocked hosts", stats.top_hosts(top, "BLOCK"))
+    _print_table(f"Top {top} allowed hosts", stats.top_hosts(top, "ALLOW"))
+    _print_table("Last 24 hours", [(hour, sum(row.values())) for hour, row in sorted(stats.hours.items())[-24:]])
+
+    if args.analyze_json:
+        with open(args.analyze_json, "w", encoding="utf-8") as f:
+            json.dump(stats.summary(top), f, indent=2)
+        print(f"\n[ANALYZE] Summary written to {args.analyze_json}")
+
+# ---------- Connection limits & timeouts ----------
+class _Conn:
+    """Per-connection bookkeeping shared by the guard and the relay loops; also a row of the connection table."""
+    __slots__ = ("id", "peer", "started", "last", "established", "deadline", "slot", "writers", "meter",
+                 "kind", "host", "port", "bytes_in", "bytes_out", "state")
+
+    def __init__(self, id, peer, now, writer):
+        self.id = id
+        self.peer = peer
+        self.started = self.last = now
+        self.established = False
+        self.deadline = 0.0
+        self.slot = -1
+        self.writers = [writer]
+        self.meter: Optional[CategoryMeter] = None  # Quota/throttle of the destination's category
+        self.kind = ""          # Log kind of the request (CONNECT, HTTP, SOCKS5, ...) once known
+        self.host = ""
+        self.port = 0
+        self.bytes_in = 0       # Destination -> client
+        self.bytes_out = 0      # Client -> destination
+        self.state = "handshake"  # -> "open" -> "half-closed" once one direction has ended
+
+    def row(self, now: float, wall_offset: float) -> dict:
+        # Status view; wall_offset turns loop time into epoch seconds
+        return {"id": self.id, "kind": self.kind, "peer": self.peer, "host": self.host, "port": self.port,
+                "started": round(self.started + wall_offset, 3), "duration": round(now - self.started, 3),
+                "idle": round(now - self.last, 3), "bytes_in": self.bytes_in, "bytes_out": self.bytes_out,
+                "state": self.state}
+
+    def abort(self):
+        for w in self.writers:
+            try: w.transport.abort()
+            except Exception: pass
+
+
+# Connection record of the handler running in the current task (set by ConnectionGuard)
+_current_conn: contextvars.ContextVar = contextvars.ContextVar("conn", default=None)
+
+
+def conn_established(*upstream_writers, meter: Optional[CategoryMeter] = None,
+                     kind: str = "", host: str = "", port: int = 0):
+    """Mark the current connection's handshake as done and tie upstream writers to its lifetime."""
+    for w in upstream_writers:
+        NetTuning.apply(w)
+    conn = _current_conn.get()
+    if conn is not None:
+        conn.established = True
+        conn.writers.extend(upstream_writers)
+        conn.meter = meter
+        conn.kind, conn.host, conn.port, conn.state = kind, host, port, "open"
+
+
+def conn_sent(n: int):
+    """Count client bytes forwarded outside relay() (request heads and bodies)."""
+    conn = _current_conn.get()
+    if conn is not None:
+        conn.bytes_out += n
+
+
+async def relay(r, w):
+    # Copy r -> w until EOF, then half-close w so the peer sees the end of this direction
+    conn = _current_conn.get()
+    meter = conn.meter if conn is not None else None
+    inbound = conn is not None and w is conn.writers[0]  # Writing to the client
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            # Smaller reads keep a throttled stream smooth instead of bursty
+            chunk = await r.read(16384 if meter is not None and meter.rate else 65536)
+            if not chunk: break
+            if meter is not None:
+                delay = meter.account(len(chunk), loop.time())
+                if meter.exhausted():
+                    conn.abort(); return
+                if delay:
+                    await asyncio.sleep(delay)
+            w.write(chunk); await w.drain()
+            if conn is not None:
+                conn.last = loop.time()
+                if inbound: conn.bytes_in += len(chunk)
+                else: conn.bytes_out += len(chunk)
+        if conn is not None:
+            conn.state = "half-closed"
+        if w.can_write_eof():
+            w.write_eof()
+    except: pass
+
+
+class NetTuning:
+    """Listener backlog and TCP socket options shared by all proxies (set once from the command line)."""
+    backlog = 1024
+    nodelay = True
+    keepalive = 0.0     # idle seconds before TCP keepalive probes, 0 = off
+
+    @classmethod
+    def apply(cls, w):
+        # Tune one connected TCP socket
+        sock = w.get_extra_info("socket")
+        if sock is None or sock.type != socket.SOCK_STREAM or sock.family not in (socket.AF_INET, socket.AF_INET6):
+            return
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 if cls.nodelay else 0)
+            if cls.keepalive > 0:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                idle = max(1, int(cls.keepalive))
+                if hasattr(socket, "TCP_KEEPIDLE"):
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, idle)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, max(1, idle // 3))
+                elif hasattr(socket, "SIO_KEEPALIVE_VALS"):
+                    sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, idle * 1000, max(1000, idle * 333)))
+        except OSError:
+            pass
+
+    @classmethod
+    def describe(cls) -> str:
+        keepalive = f"{cls.keepalive:g}s" if cls.keepalive > 0 else "off"
+        return f"backlog={cls.backlog}, nodelay={'on' if cls.nodelay else 'off'}, keepalive={keepalive}"
+
+
+def install_event_loop(name: str) -> str:
+    """Select the event loop implementation ("auto", "uvloop" or "asyncio"); returns the engine in use."""
+    if name in ("auto", "uvloop"):
+        try:
+            import uvloop
+            asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+            return f"uvloop {uvloop.__version__}"
+        except ImportError:
+            if name == "uvloop":
+                print("[WARN] uvloop not installed, using asyncio")
+    if sys.platform == "win32":
+        return "asyncio (proactor)"
+    return "asyncio (selector)"
+
+
+class Handover:
+    """Listening sockets by name, so a restart can pass them to a successor process without a gap.
+
+    The successor is started with FOCUSDOCK_HANDOVER set and reads one JSON line from stdin: the
+    inherited sockets (fd numbers on POSIX, socket.share() blobs on Windows), the session state and
+    a loopback port to report on once it is accepting."""
+    ENV = "FOCUSDOCK_HANDOVER"
+    READY_TIMEOUT = 15.0
+    inherited: Dict[str, socket.socket] = {}   # From our predecessor, until a listener takes them
+    listeners: Dict[str, object] = {}          # Servers / datagram transports we accept on
+    state: Optional[dict] = None               # Session state passed by our predecessor
+    _ready_port = 0
+
+    @classmethod
+    def load(cls):
+        # In a successor: adopt the predecessor's sockets before any listener starts
+        if not os.environ.pop(cls.ENV, None):
+            return
+        try:
+            msg = json.loads(sys.stdin.readline())
+            for name, ref in msg["sockets"].items():
+                if sys.platform == "win32":
+                    import base64
+                    cls.inherited[name] = socket.fromshare(base64.b64decode(ref))
+                else:
+                    cls.inherited[name] = socket.socket(fileno=ref)
+            cls.state, cls._ready_port = msg.get("state", {}), msg.get("ready", 0)
+            print(f"[HANDOVER]   adopted {', '.join(sorted(cls.inherited))}")
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            print(f"[WARN] Handover data unusable, binding fresh sockets: {e}")
+            cls.inherited = {}
+
+    @classmethod
+    def take(cls, name: str) -> Optional[socket.socket]:
+        return cls.inherited.pop(name, None)
+
+    @classmethod
+    def register(cls, name: str, listener):
+        cls.listeners[name] = listener
+
+    @classmethod
+    async def serve(cls, name: str, handler, host=None, port=None, *, path: Optional[str] = None,
+                    sock_factory=None, backlog: int = 100):
+        """start_server / start_unix_server on the inherited socket if there is one, else bind anew."""
+        sock = cls.take(name)
+        if path:
+            # Python 3.13+ unlinks the path on close(), which would pull it from under a successor
+            extra = {"cleanup_socket": False} if sys.version_info >= (3, 13) else {}
+            if sock is None:
+                if os.path.exists(path):
+                    os.remove(path)  # Stale socket from a previous run
+                srv = await asyncio.start_unix_server(handler, path, backlog=backlog, **extra)
+                os.chmod(path, 0o600)
+            else:
+                srv = await asyncio.start_unix_server(handler, sock=sock, backlog=backlog, **extra)
+        elif sock is None and sock_factory is not None:
+            srv = await asyncio.start_server(handler, sock=sock_factory(), backlog=backlog)
+        elif sock is None:
+            srv = await asyncio.start_server(handler, host, port, backlog=backlog)
+        else:
+            srv = await asyncio.start_server(handler, sock=sock, backlog=backlog)
+        cls.register(name, srv)
+        return srv
+
+    @classmethod
+    def close_listeners(cls):
+        """Stop accepting; established connections are left alone."""
+        for listener in cls.listeners.values():
+            listener.close()
+        cls.listeners = {}
+
+    @classmethod
+    def _socket_of(cls, listener):
+        if hasattr(listener, "sockets"):
+            return listener.sockets[0] if listener.sockets else None
+        return listener.get_extra_info("socket")  # Datagram transport
+
+    @classmethod
+    async def spawn(cls, state: dict) -> bool:
+        """Start a successor on our listening sockets and wait until it accepts; False on failure."""
+        import subprocess
+        ready = asyncio.get_running_loop().create_future()
+
+        async def on_ready(r, w):
+            if await r.readline() == b"ready\n" and not ready.done():
+                ready.set_result(True)
+            w.close()
+
+        waiter = await asyncio.start_server(on_ready, "127.0.0.1", 0)
+        socks = {name: s for name, s in ((name, cls._socket_of(l)) for name, l in cls.listeners.items()) if s}
+        program = [sys.executable] + (sys.argv[1:] if getattr(sys, "frozen", False)
+                                      else [os.path.abspath(sys.argv[0])] + sys.argv[1:])
+        kwargs = {"env": dict(os.environ, **{cls.ENV: "1"}), "stdin": subprocess.PIPE}
+        if sys.platform == "win32":
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP | subprocess.CREATE_NO_WINDOW
+        else:
+            kwargs["pass_fds"] = [s.fileno() for s in socks.values()]
+        proc = None
+        try:
+            proc = subprocess.Popen(program, **kwargs)
+            if sys.platform == "win32":
+                import base64
+                refs = {}
+                for name, s in socks.items():
+                    dup = socket.fromfd(s.fileno(), s.family, s.type)
+                    refs[name] = base64.b64encode(dup.share(proc.pid)).decode()
+                    dup.close()
+            else:
+                refs = {name: s.fileno() for name, s in socks.items()}
+            msg = {"sockets": refs, "state": state, "ready": waiter.sockets[0].getsockname()[1]}
+            proc.stdin.write(json.dumps(msg).encode() + b"\n")
+            proc.stdin.close()
+            await asyncio.wait_for(ready, cls.READY_TIMEOUT)
+            print(f"[HANDOVER]   successor pid {proc.pid} is accepting")
+            return True
+        except (OSError, asyncio.TimeoutError) as e:
+            print(f"[WARN] Handover failed, keeping this process: {e or 'successor not ready in time'}")
+            if proc is not None and proc.poll() is None:
+                proc.kill()
+            return False
+        finally:
+            waiter.close()
+
+    @classmethod
+    async def ready(cls):
+        # In a successor: once every inherited socket is being served, tell the predecessor to step back
+        if not cls._ready_port:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + cls.READY_TIMEOUT
+        while cls.inherited and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        for name, sock in cls.inherited.items():
+            print(f"[WARN] Inherited {name} socket unused")
+            sock.close()
+        cls.inherited = {}
+        try:
+            _, w = await asyncio.open_connection("127.0.0.1", cls._ready_port)
+            w.write(b"ready\n"); await w.drain(); w.close()
+        except OSError as e:
+            print(f"[WARN] Could not reach the previous process: {e}")
+        cls._ready_port = 0
+
+
+class ConnectionGuard:
+    """Global / per-client connection caps plus handshake, idle and lifetime timeouts.
+
+    Deadlines live in a hashed timer wheel: activity only bumps conn.last, and a single
+    tick callback re-checks the connections filed under the current slot.
+    """
+    def __init__(self, max_conns: int = 4096, max_per_client: int = 1024, handshake_timeout: float = 15.0,
+                 idle_timeout: float = 600.0, max_lifetime: float = 0.0, tick: float = 1.0, slots: int = 64):
+        self.max_conns, self.max_per_client = max_conns, max_per_client
+        self.handshake_timeout, self.idle_timeout, self.max_lifetime = handshake_timeout, idle_timeout, max_lifetime
+        self.tick, self.wheel = tick, [set() for _ in range(slots)]
+        self.count = 0
+        self.per_client = {}
+        self.expired = 0
+        self.rejected = 0
+        self.table: Dict[int, _Conn] = {}  # Live connections by id
+        self._ids = 0
+        self._pos = 0
+        self._handle = None
+
+    def _deadline(self, conn: _Conn) -> float:
+        # Earliest moment this connection may be expired
+        if conn.established:
+            d = conn.last + self.idle_timeout if self.idle_timeout > 0 else float("inf")
+        else:
+            d = conn.started + self.handshake_timeout if self.handshake_timeout > 0 else float("inf")
+        if self.max_lifetime > 0:
+            d = min(d, conn.started + self.max_lifetime)
+        return d
+
+    def _file(self, conn: _Conn, now: float):
+        # Put conn in the slot of its deadline (capped at one wheel turn; it is re-filed if early)
+        conn.deadline = self._deadline(conn)
+        ticks = max(1, min(len(self.wheel) - 1, int((conn.deadline - now) / self.tick) + 1))
+        conn.slot = (self._pos + ticks) % len(self.wheel)
+        self.wheel[conn.slot].add(conn)
+
+    def admit(self, w) -> Optional[_Conn]:
+        """Register a new client connection; None if a cap is reached."""
+        peer = w.get_extra_info("peername")
+        client = peer[0] if peer else None
+        if self.count >= self.max_conns > 0 or self.per_client.get(client, 0) >= self.max_per_client > 0:
+            self.rejected += 1
+            return None
+        loop = asyncio.get_running_loop()
+        self._ids += 1
+        conn = _Conn(self._ids, client, loop.time(), w)
+        self.table[conn.id] = conn
+        self.count += 1
+        self.per_client[client] = self.per_client.get(client, 0) + 1
+        self._file(conn, conn.started)
+        if self._handle is None:
+            self._handle = loop.call_later(self.tick, self._on_tick)
+        return conn
+
+    def release(self, conn: _Conn):
+        if conn.slot >= 0:
+            self.wheel[conn.slot].discard(conn)
+            conn.slot = -1
+        self.table.pop(conn.id, None)
+        self.count -= 1
+        left = self.per_client.get(conn.peer, 1) - 1
+        if left: self.per_client[conn.peer] = left
+        else: self.per_client.pop(conn.peer, None)
+
+    def _on_tick(self):
+        self._pos = (self._pos + 1) % len(self.wheel)
+        bucket, self.wheel[self._pos] = self.wheel[self._pos], set()
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        for conn in bucket:
+            if self._deadline(conn) <= now:
+                conn.slot = -1
+                self.expired += 1
+                conn.abort()
+            else:
+                self._file(conn, now)
+        self._handle = loop.call_later(self.tick, self._on_tick) if self.count else None
+
+    async def drain(self, timeout: float, idle: float = 5.0) -> int:
+        """Wait up to timeout for live connections to end; returns how many had to be cut.
+
+        Connections still in their handshake or idle for idle seconds are cut right away: the
+        client has nothing in flight and reconnects (to the successor, on a handover)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max(0.0, timeout)
+        cut = 0
+        while self.table:
+            now = loop.time()
+            for conn in list(self.table.values()):
+                if conn.state == "closing":
+                    continue
+                if now >= deadline or conn.state == "handshake" or now - conn.last >= idle:
+                    conn.state = "closing"
+                    conn.abort()
+                    cut += 1
+            await asyncio.sleep(0.05)
+            if loop.time() >= deadline + 1.0:
+                break  # Handlers that ignore the abort are cancelled with the tasks
+        return cut
+
+    def connections(self, limit: int = 200) -> List[dict]:
+        """Live connections, heaviest (bytes in + out) first."""
+        now = asyncio.get_running_loop().time()
+        offset = time.time() - now
+        rows = heapq.nlargest(limit, self.table.values(), key=lambda c: c.bytes_in + c.bytes_out)
+        return [c.row(now, offset) for c in rows]
+
+    def wrap(self, handler):
+        """Wrap a start_server handler so every connection is admitted, timed and released."""
+        async def guarded(r, w):
+            conn = self.admit(w)
+            if conn is None:
+                w.close(); return
+            NetTuning.apply(w)
+            _current_conn.set(conn)
+            try:
+                await handler(r, w)
+            finally:
+                self.release(conn)
+        return guarded
 
 # ---------- PAC server ----------
-PAC_TEMPLATE = """function FindProxyForURL(url, host) {
-  if (isPlainHostName(host) ||
-      shExpMatch(host, "localhost") ||
-      isInNet(host, "10.0.0.0",  "255.0.0.0") ||
-      isInNet(host, "172.16.0.0","255.240.0.0") ||
-      isInNet(host, "192.168.0.0","255.255.0.0"))
+# Only listed hosts are sent to the proxy; everything else goes DIRECT without touching Python.
+PAC_TEMPLATE = """var BLOCK_EXACT = %(block_exact)s;
+var BLOCK_SUFFIX = %(block_suffix)s;
+var ALLOW_EXACT = %(allow_exact)s;
+var ALLOW_SUFFIX = %(allow_suffix)s;
+var BLOCK_KEYWORDS = %(block_keywords)s;
+var ALLOW_KEYWORDS = %(allow_keywords)s;
+var BLOCK_NETS = %(block_nets)s;
+var ALLOW_NETS = %(allow_nets)s;
+var PROXY_V4 = %(proxy_v4)s, PROXY_V6 = %(proxy_v6)s;
+function inNets(h, nets) {
+  for (var i = 0; i < nets.length; i++)
+    if (isInNet(h, nets[i][0], nets[i][1])) return true;
+  return false;
+}
+function listed(h, exact, suffix) {
+  if (exact.hasOwnProperty(h)) return true;
+  for (var i = h.indexOf("."); i >= 0; i = h.indexOf(".", i + 1))
+    if (suffix.hasOwnProperty(h.substring(i))) return true;
+  return false;
+}
+function FindProxyForURL(url, host) {
+  host = host.toLowerCase();
+  if (isPlainHostName(host) || host == "localhost")
     return "DIRECT";
-  return "PROXY 127.0.0.1:%(proxy_port)s; SOCKS5 127.0.0.1:%(socks_port)s";
+  if (/^\\d+\\.\\d+\\.\\d+\\.\\d+$/.test(host)) {
+    if (inNets(host, ALLOW_NETS)) return "DIRECT";
+    return PROXY_V4 || inNets(host, BLOCK_NETS) ? "%(proxy)s" : "DIRECT";
+  }
+  if (host.indexOf(":") >= 0)
+    return PROXY_V6 ? "%(proxy)s" : "DIRECT";
+  if (listed(host, ALLOW_EXACT, ALLOW_SUFFIX) || (ALLOW_KEYWORDS && ALLOW_KEYWORDS.test(host)))
+    return "DIRECT";
+  if (listed(host, BLOCK_EXACT, BLOCK_SUFFIX) || (BLOCK_KEYWORDS && BLOCK_KEYWORDS.test(host)))
+    return "%(proxy)s";
+  return "DIRECT";
 }"""
 
-class PacHandler(BaseHTTPRequestHandler):
-    """Serves a PAC file for proxy auto-configuration."""
-    proxy_port = 3128
-    socks_port = 1080
-    def do_GET(self):
-        # Serve PAC file or 404
-        if self.path.startswith("/proxy.pac"):
-            body = PAC_TEMPLATE % {"proxy_port": self.proxy_port, "socks_port": self.socks_port}
-            self.send_response(200)
-            self.send_header("Content-Type", "application/x-ns-proxy-autoconfig")
-            self.send_header("Content-Length", str(len(body)))
-            self.end_headers()
-            self.wfile.write(body.encode("utf-8"))
-        else:
-            self.send_response(404); self.end_headers()
-    def log_message(self, *_): pass
 
-def start_pac_server(port: int, proxy_port: int, socks_port:int):
-    """Start PAC HTTP server in a background thread."""
-    PacHandler.proxy_port = proxy_port
-    PacHandler.socks_port = socks_port
-    httpd = HTTPServer(("127.0.0.1", port), PacHandler)
-    threading.Thread(target=httpd.serve_forever, daemon=True).start()
-    return httpd
+def render_pac(matcher: "DomainMatcher", proxy_port: int, socks_port: int) -> bytes:
+    """Render the PAC file for one rule set."""
+    def js_set(items):
+        return json.dumps(dict.fromkeys(sorted(items), 1), separators=(",", ":"))
+
+    def js_nets(networks):
+        # isInNet() only understands IPv4 address/mask pairs
+        import ipaddress
+        nets = [ipaddress.ip_network(n) for n in networks]
+        return json.dumps([[str(n.network_address), str(n.netmask)] for n in nets if n.version == 4],
+                          separators=(",", ":"))
+
+    def js_keywords(keywords):
+        # One alternation regex; the browser's engine compiles it once per PAC load
+        if not keywords:
+            return "null"
+        return "new RegExp(" + json.dumps("|".join(re.escape(k) for k in keywords)) + ")"
+
+    # Metered categories must reach the proxy too, so they go on the proxied side of the PAC
+    exact, suffixes = set(matcher.blocked_exact), set(matcher.blocked_suffixes)
+    keywords, nets = list(matcher.blocked_keywords.keywords), list(matcher.blocked_nets.networks)
+    for sub, _ in matcher.limited:
+        exact.update(sub.blocked_exact)
+        suffixes.update(sub.blocked_suffixes)
+        keywords.extend(sub.blocked_keywords.keywords)
+        nets.extend(sub.blocked_nets.networks)
+
+    v6_rules = any(":" in n for n in nets)
+    return (PAC_TEMPLATE % {
+        "block_exact": js_set(exact),
+        "block_suffix": js_set(suffixes),
+        "allow_exact": js_set(matcher.unblocked_exact),
+        "allow_suffix": js_set(matcher.unblocked_suffixes),
+        "block_keywords": js_keywords(keywords),
+        "allow_keywords": js_keywords(matcher.unblocked_keywords.keywords),
+        "block_nets": js_nets(nets),
+        "allow_nets": js_nets(matcher.unblocked_nets.networks),
+        # With the reverse map any address may belong to a blocked name, so the proxy has to decide
+        "proxy_v4": json.dumps(matcher.reverse is not None),
+        "proxy_v6": json.dumps(matcher.reverse is not None or v6_rules),
+        "proxy": f"PROXY 127.0.0.1:{proxy_port}; SOCKS5 127.0.0.1:{socks_port}",
+    }).encode("utf-8")
+
+
+class PacServer:
+    """Serves the PAC file from asyncio; rendered once per rule set and revalidated with ETag."""
+    def __init__(self, host, port, proxy_port: int, socks_port: int, matcher: "DomainMatcher"):
+        self.host, self.port = host, port
+        self.proxy_port, self.socks_port = proxy_port, socks_port
+        self.set_matcher(matcher)
+
+    def set_matcher(self, matcher: "DomainMatcher"):
+        # New rules: render now so requests only ever copy bytes
+        self.body = render_pac(matcher, self.proxy_port, self.socks_port)
+        self.version = hashlib.sha1(self.body).hexdigest()[:16]
+        self.etag = b'"' + self.version.encode() + b'"'
+        self._headers = (b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ns-proxy-autoconfig\r\n"
+                         b"Cache-Control: no-cache\r\nETag: " + self.etag +
+                         b"\r\nContent-Length: " + str(len(self.body)).encode() + b"\r\n")
+
+    def _response(self, parser: "HttpRequestParser") -> bytes:
+        if parser.method not in (b"GET", b"HEAD") or not parser.target.startswith(b"/proxy.pac"):
+            return b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\n\r\n"
+        if parser.header(b"if-none-match") == self.etag:
+            return b"HTTP/1.1 304 Not Modified\r\nETag: " + self.etag + b"\r\nCache-Control: no-cache\r\n\r\n"
+        return self._headers + b"\r\n" + (self.body if parser.method == b"GET" else b"")
+
+    async def handle(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
+        # Serve PAC requests on one keep-alive connection
+        rest = b""
+        try:
+            while True:
+                parser = HttpRequestParser(max_line=2048, max_head=16384, initial=rest)
+                while parser.head_end < 0:
+                    chunk = await asyncio.wait_for(r.read(16384), timeout=30)
+                    if not chunk: return
+                    parser.feed(chunk)
+                w.write(self._response(parser)); await w.drain()
+                if (parser.header(b"connection") or b"").lower() == b"close":
+                    return
+                rest = parser.rest
+        except (HttpParseError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            w.close()
+
+    async def run(self):
+        # Start PAC server
+        srv = await Handover.serve("pac", self.handle, self.host, self.port)
+        startup_trace("PAC listening")
+        async with srv: await srv.serve_forever()
+
+# ---------- HTTP request parsing ----------
+class HttpParseError(Exception):
+    """Malformed or oversized request head; carries the HTTP status to answer with."""
+    def __init__(self, code: int, text: str):
+        super().__init__(f"{code} {text}")
+        self.code, self.text = code, text
+
+
+class HttpRequestParser:
+    """Incremental, bytes-level parser for one proxy request head.
+
+    feed() returns NEED_MORE, LINE (request line parsed, headers pending) or HEAD (headers
+    complete). Only the request line and the framing headers are decoded.
+    """
+    NEED_MORE, LINE, HEAD = 0, 1, 2
+    __slots__ = ("max_line", "max_head", "buf", "_scan", "line_end", "head_end",
+                 "method", "target", "version", "content_length", "chunked")
+
+    def __init__(self, max_line: int = 8192, max_head: int = 65536, initial: bytes = b""):
+        self.max_line, self.max_head = max_line, max_head
+        self.buf = bytearray()
+        self._scan = 0              # where the next terminator search starts
+        self.line_end = -1          # offset just past the request line CRLF
+        self.head_end = -1          # offset just past the blank line
+        self.method = self.target = self.version = b""
+        self.content_length = 0
+        self.chunked = False
+        if initial:
+            self.feed(initial)
+
+    def feed(self, data: bytes) -> int:
+        self.buf += data
+        if self.line_end < 0:
+            i = self.buf.find(b"\r\n", self._scan)
+            if i < 0:
+                # A trailing CR may be the start of the terminator, not part of the line
+                if len(self.buf) - self.buf.endswith(b"\r") > self.max_line:
+                    raise HttpParseError(414, "URI Too Long")
+                self._scan = max(0, len(self.buf) - 1)
+                return self.NEED_MORE
+            if i > self.max_line:
+                raise HttpParseError(414, "URI Too Long")
+            parts = bytes(self.buf[:i]).split()
+            if len(parts) < 2:
+                raise HttpParseError(400, "Bad Request")
+            self.method, self.target = parts[0].upper(), parts[1]
+            self.version = parts[2] if len(parts) > 2 else b"HTTP/1.0"
+            self.line_end = i + 2
+            self._scan = i  # the line's CRLF may start the blank-line terminator
+
+        if self.head_end < 0:
+            i = self.buf.find(b"\r\n\r\n", self._scan)
+            if i < 0:
+                if len(self.buf) > self.max_head:
+                    raise HttpParseError(431, "Request Header Fields Too Large")
+                self._scan = max(self.line_end - 2, len(self.buf) - 3)
+                return self.LINE
+            if i + 4 > self.max_head:
+                raise HttpParseError(431, "Request Header Fields Too Large")
+            self._finish_head(i + 4)
+        return self.HEAD
+
+    def _finish_head(self, end: int):
+        # Pull out only the headers that decide request framing
+        self.head_end = end
+        for line in bytes(self.buf[self.line_end:end]).split(b"\r\n"):
+            name, sep, value = line.partition(b":")
+            if not sep:
+                continue
+            name = name.strip().lower()
+            if name == b"content-length":
+                try:
+                    self.content_length = int(value.strip())
+                except ValueError:
+                    raise HttpParseError(400, "Bad Content-Length")
+                if self.content_length < 0:
+                    raise HttpParseError(400, "Bad Content-Length")
+            elif name == b"transfer-encoding" and b"chunked" in value.lower():
+                self.chunked = True
+
+    def header(self, name: bytes) -> Optional[bytes]:
+        """Value of one header (lowercase name), looked up on demand."""
+        for line in bytes(self.buf[self.line_end:self.head_end]).split(b"\r\n"):
+            key, sep, value = line.partition(b":")
+            if sep and key.strip().lower() == name:
+                return value.strip()
+        return None
+
+    @property
+    def head(self) -> bytes:
+        return bytes(self.buf[:self.head_end])
+
+    @property
+    def rest(self) -> bytes:
+        """Bytes received after the head (body or the next pipelined request)."""
+        return bytes(self.buf[self.head_end:])
+
+
+def split_authority(authority: bytes, default_port: int) -> Tuple[str, int]:
+    """Split b"host[:port]" (IPv6 in brackets) into (host, port)."""
+    authority = authority.rpartition(b"@")[2]
+    if authority.startswith(b"["):
+        host, _, tail = authority[1:].partition(b"]")
+        port = tail[1:] if tail.startswith(b":") else b""
+    else:
+        host, _, port = authority.partition(b":")
+    if port and not port.isdigit():
+        raise HttpParseError(400, "Bad Port")
+    return host.decode("ascii", "ignore").lower(), int(port) if port else default_port
+
+
+def split_absolute_uri(target: bytes) -> Tuple[str, int]:
+    """Host and port of an absolute-form request target (http://host:port/path)."""
+    scheme, sep, rest = target.partition(b"://")
+    if not sep or not rest:
+        raise HttpParseError(400, "Proxy Requires Absolute-URI")
+    authority = rest.split(b"/", 1)[0].split(b"?", 1)[0]
+    if not authority:
+        raise HttpParseError(400, "Proxy Requires Absolute-URI")
+    return split_authority(authority, 80 if scheme.lower() == b"http" else 443)
 
 # ---------- HTTP/HTTPS (CONNECT) proxy ----------
 class HttpProxy:
     """Minimal HTTP/HTTPS proxy with domain blocking."""
-    def __init__(self, host, port, matcher: DomainMatcher, logger: Logger):
+    HTTP_METHODS = (b"GET", b"POST", b"HEAD", b"PUT", b"DELETE", b"OPTIONS", b"PATCH")
+
+    def __init__(self, host, port, matcher: DomainMatcher, logger: Logger,
+                 max_line: int = 8192, max_head: int = 65536, guard: Optional[ConnectionGuard] = None):
         self.host, self.port, self.matcher, self.logger = host, port, matcher, logger
+        self.max_line, self.max_head = max_line, max_head
+        self.guard = guard or ConnectionGuard()
 
     async def _write_resp(self, w, code, text):
         # Send HTTP response and close connection
         body = f"{code} {text}\n"
         resp = f"HTTP/1.1 {code} {text}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}"
         w.write(resp.encode()); await w.drain(); w.close(); 
-        try: await w.wait_closed()
-        except: pass
-
-    async def _pipe(self, r, w):
-        # Pipe data between two streams
-        try:
-            while True:
-                chunk = await r.read(65536)
-                if not chunk: break
-                w.write(chunk); await w.drain()
+        try: await w.wait_closed()
         except: pass
 
-    async def _tunnel(self, cr, cw, host, port):
+    async def _read_head(self, r, parser: HttpRequestParser, want: int) -> int:
+        # Feed the parser until it reaches `want` (LINE or HEAD); NEED_MORE means EOF
+        state = parser.feed(b"") if parser.buf else HttpRequestParser.NEED_MORE
+        while state < want:
+            chunk = await r.read(65536)
+            if not chunk:
+                return HttpRequestParser.NEED_MORE
+            state = parser.feed(chunk)
+        return state
+
+    async def _tunnel(self, cr, cw, host, port, early: bytes = b"", meter=None):
         # Handle HTTPS CONNECT tunneling
         try:
             ur, uw = await asyncio.open_connection(host, port)
         except:
             await self._write_resp(cw, 502, "Bad Gateway"); return
+        conn_established(uw, meter=meter, kind="CONNECT", host=host, port=port)
         cw.write(b"HTTP/1.1 200 Connection Established\r\nProxy-Agent: PyMVP\r\n\r\n"); await cw.drain()
         try:
-            await asyncio.gather(self._pipe(cr, uw), self._pipe(ur, cw))
+            if early:
+                uw.write(early)  # client bytes that arrived with the CONNECT head
+                conn_sent(len(early))
+            await asyncio.gather(relay(cr, uw), relay(ur, cw))
         finally:
             uw.close(); 
             try: await uw.wait_closed()
@@ -282,16 +2166,63 @@ class HttpProxy:
             try: await cw.wait_closed()
             except: pass
 
-    async def _forward_http(self, cr, cw, first_chunk, host, port):
-        # Forward HTTP request and response
+    async def _send_body(self, cr, uw, parser: HttpRequestParser) -> Optional[bytes]:
+        # Forward one request body; returns the bytes that follow it, None if framing is lost
+        rest = parser.rest
+        if parser.chunked:
+            return None  # relay the rest of the connection raw
+        n = parser.content_length
+        uw.write(rest[:n])
+        if len(rest) < n:
+            remaining = n - len(rest)
+            while remaining:
+                chunk = await cr.read(min(65536, remaining))
+                if not chunk:
+                    raise ConnectionError("client closed mid-body")
+                uw.write(chunk); remaining -= len(chunk)
+            rest = b""
+        else:
+            rest = rest[n:]
+        await uw.drain()
+        conn_sent(len(parser.head) + n)
+        return rest
+
+    async def _forward_http(self, cr, cw, parser: HttpRequestParser, host, port, meter=None):
+        # Forward requests to one origin; pipelined requests are parsed and checked one by one
         try:
             ur, uw = await asyncio.open_connection(host, port)
         except:
             await self._write_resp(cw, 502, "Bad Gateway"); return
+        conn_established(uw, meter=meter, kind="HTTP", host=host, port=port)
+        responses = asyncio.ensure_future(relay(ur, cw))
         try:
-            uw.write(first_chunk); await uw.drain()
-            await asyncio.gather(self._pipe(ur, cw), self._pipe(cr, uw))
+            while True:
+                uw.write(parser.head)
+                rest = await self._send_body(cr, uw, parser)
+                if rest is None:
+                    uw.write(parser.rest)
+                    conn_sent(len(parser.head) + len(parser.rest))
+                    await relay(cr, uw)
+                    break
+
+                parser = HttpRequestParser(self.max_line, self.max_head, rest)
+                if await self._read_head(cr, parser, HttpRequestParser.HEAD) != HttpRequestParser.HEAD:
+                    break
+                if parser.method not in self.HTTP_METHODS:
+                    break
+                next_host, next_port = split_absolute_uri(parser.target)
+                decision, _ = self.matcher.decide(next_host)
+                await self.logger.write("HTTP", next_host, next_port, decision)
+                # A different origin or a blocked request ends this connection; the client reconnects
+                if decision in DENIED or (next_host, next_port) != (host, port):
+                    break
+            if uw.can_write_eof() and not uw.transport.is_closing():
+                uw.write_eof()
+            await responses
+        except (HttpParseError, ConnectionError):
+            pass
         finally:
+            responses.cancel()
             uw.close(); 
             try: await uw.wait_closed()
             except: pass
@@ -301,49 +2232,53 @@ class HttpProxy:
 
     async def handle(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
         # Handle incoming proxy connection
+        parser = HttpRequestParser(self.max_line, self.max_head)
         try:
-            data = await r.readuntil(b"\r\n\r\n")
-        except asyncio.IncompleteReadError:
-            w.close(); return
-        header = data.decode("utf-8", "ignore")
-        first = header.split("\r\n",1)[0]
-        parts = first.split()
-        if len(parts) < 2: 
-            await self._write_resp(w, 400, "Bad Request"); return
-        method, target = parts[0].upper(), parts[1]
-
-        if method == "CONNECT":
-            host, port = target.split(":")[0], int(target.split(":")[1])
-            decision = "BLOCK" if self.matcher.is_blocked(host) else "ALLOW"
-            await self.logger.write("CONNECT", host, port, decision)
-            if decision == "BLOCK":
-                await self._write_resp(w, 403, "Forbidden"); return
-            await self._tunnel(r, w, host, port); return
-
-        if method in ("GET","POST","HEAD","PUT","DELETE","OPTIONS","PATCH"):
-            u = urllib.parse.urlsplit(target)
-            if not u.hostname:
-                await self._write_resp(w, 400, "Proxy Requires Absolute-URI"); return
-            host, port = u.hostname, u.port or (80 if u.scheme=="http" else 443)
-            decision = "BLOCK" if self.matcher.is_blocked(host) else "ALLOW"
-            await self.logger.write("HTTP", host, port, decision)
-            if decision == "BLOCK":
-                await self._write_resp(w, 403, "Forbidden"); return
-            await self._forward_http(r, w, data, host, port); return
-
-        await self._write_resp(w, 405, "Method Not Allowed")
+            if await self._read_head(r, parser, HttpRequestParser.LINE) == HttpRequestParser.NEED_MORE:
+                w.close(); return
+
+            # CONNECT fast path: decide from the request line alone
+            if parser.method == b"CONNECT":
+                host, port = split_authority(parser.target, 443)
+                decision, meter = self.matcher.decide(host)
+                await self.logger.write("CONNECT", host, port, decision)
+                if decision in DENIED:
+                    await self._write_resp(w, 403, "Forbidden"); return
+                if await self._read_head(r, parser, HttpRequestParser.HEAD) != HttpRequestParser.HEAD:
+                    w.close(); return
+                await self._tunnel(r, w, host, port, parser.rest, meter); return
+
+            if parser.method in self.HTTP_METHODS:
+                host, port = split_absolute_uri(parser.target)
+                decision, meter = self.matcher.decide(host)
+                await self.logger.write("HTTP", host, port, decision)
+                if decision in DENIED:
+                    await self._write_resp(w, 403, "Forbidden"); return
+                if await self._read_head(r, parser, HttpRequestParser.HEAD) != HttpRequestParser.HEAD:
+                    w.close(); return
+                await self._forward_http(r, w, parser, host, port, meter); return
+
+            await self._write_resp(w, 405, "Method Not Allowed")
+        except HttpParseError as e:
+            await self._write_resp(w, e.code, e.text)
+        except ConnectionError:
+            w.close()
 
     async def run(self):
         # Start proxy server
-        srv = await asyncio.start_server(self.handle, self.host, self.port)
+        srv = await Handover.serve("http", self.guard.wrap(self.handle), self.host, self.port, backlog=NetTuning.backlog)
         print(f"[HTTP proxy] 127.0.0.1:{self.port}")
+        startup_trace("HTTP proxy listening")
         async with srv: await srv.serve_forever()
 
-# ---------- Minimal SOCKS5 (TCP only) ----------
+# ---------- Minimal SOCKS5 (TCP CONNECT + UDP ASSOCIATE) ----------
 class Socks5Proxy:
     """Minimal SOCKS5 proxy with domain blocking."""
-    def __init__(self, host, port, matcher: DomainMatcher, logger: Logger):
+    def __init__(self, host, port, matcher: DomainMatcher, logger: Logger, udp_idle: float = 60.0,
+                 guard: Optional[ConnectionGuard] = None):
         self.host, self.port, self.matcher, self.logger = host, port, matcher, logger
+        self.udp_idle = udp_idle
+        self.guard = guard or ConnectionGuard()
 
     async def handle(self, r, w):
         # Handle SOCKS5 connection and block as needed
@@ -355,7 +2290,7 @@ class Socks5Proxy:
             w.write(b"\x05\x00"); await w.drain()
 
             head = await r.readexactly(4)
-            if head[0] != 5 or head[1] not in (1,):
+            if head[0] != 5 or head[1] not in (1, 3):
                 w.write(b"\x05\x07\x00\x01\x00\x00\x00\x00\x00\x00"); await w.drain(); w.close(); return
 
             atyp = head[3]
@@ -372,26 +2307,22 @@ class Socks5Proxy:
                 w.close(); return
             port = int.from_bytes(await r.readexactly(2), "big")
 
-            decision = "BLOCK" if self.matcher.is_blocked(host) else "ALLOW"
+            if head[1] == 3:
+                await self._udp_associate(r, w); return
+
+            decision, meter = self.matcher.decide(host)
             await self.logger.write("SOCKS5", host, port, decision)
-            if decision == "BLOCK":
+            if decision in DENIED:
                 w.write(b"\x05\x02\x00\x01\x00\x00\x00\x00\x00\x00"); await w.drain(); w.close(); return
 
             try:
                 ur, uw = await asyncio.open_connection(host, port)
             except:
                 w.write(b"\x05\x05\x00\x01\x00\x00\x00\x00\x00\x00"); await w.drain(); w.close(); return
+            conn_established(uw, meter=meter, kind="SOCKS5", host=host, port=port)
             w.write(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00"); await w.drain()
 
-            async def pipe(a, b):
-                try:
-                    while True:
-                        chunk = await a.read(65536)
-                        if not chunk: break
-                        b.write(chunk); await b.drain()
-                except: pass
-
-            await asyncio.gather(pipe(r, uw), pipe(ur, w))
+            await asyncio.gather(relay(r, uw), relay(ur, w))
             uw.close(); 
             try: await uw.wait_closed()
             except: pass
@@ -402,12 +2333,778 @@ class Socks5Proxy:
             try: w.close()
             except: pass
 
+    async def _udp_associate(self, r, w):
+        # Relay UDP for as long as the TCP control connection stays open
+        peer = w.get_extra_info("peername")
+        assoc = UdpAssociation(self, peer[0] if peer else None, self.udp_idle)
+        try:
+            bind_host, bind_port = await assoc.open()
+        except OSError:
+            w.write(b"\x05\x01\x00\x01\x00\x00\x00\x00\x00\x00"); await w.drain(); w.close(); return
+        conn_established(kind="SOCKS5-UDP", host=bind_host, port=bind_port)
+        w.write(b"\x05\x00\x00\x01" + socket.inet_aton(bind_host) + bind_port.to_bytes(2, "big")); await w.drain()
+        try:
+            while await r.read(4096):
+                pass
+        except: pass
+        finally:
+            assoc.close()
+            w.close()
+
     async def run(self):
         # Start SOCKS5 server
-        srv = await asyncio.start_server(self.handle, self.host, self.port)
+        srv = await Handover.serve("socks", self.guard.wrap(self.handle), self.host, self.port, backlog=NetTuning.backlog)
         print(f"[SOCKS5]     127.0.0.1:{self.port}")
+        startup_trace("SOCKS5 listening")
+        async with srv: await srv.serve_forever()
+
+# ---------- SOCKS5 UDP relay ----------
+class _UdpFlow:
+    """One destination inside a UDP association."""
+    __slots__ = ("host", "port", "addr", "blocked", "last", "pending", "meter")
+
+    def __init__(self, host, port, blocked, now, meter=None):
+        self.host, self.port, self.blocked, self.last = host, port, blocked, now
+        self.meter = meter      # datagrams over the category's rate are dropped
+        self.addr = None        # resolved (ip, port), None while resolving
+        self.pending = []       # payloads queued during resolution
+
+
+class _UdpEndpoint(asyncio.DatagramProtocol):
+    """Forwards datagrams from one socket into a UdpAssociation callback."""
+    def __init__(self, callback):
+        self.callback = callback
+
+    def datagram_received(self, data, addr):
+        self.callback(data, addr)
+
+    def error_received(self, exc):
+        pass
+
+
+def _socks_udp_header(addr) -> bytes:
+    # RSV RSV FRAG ATYP ADDR PORT for a reply datagram
+    try:
+        return b"\x00\x00\x00\x01" + socket.inet_aton(addr[0]) + addr[1].to_bytes(2, "big")
+    except OSError:
+        return b"\x00\x00\x00\x04" + socket.inet_pton(socket.AF_INET6, addr[0]) + addr[1].to_bytes(2, "big")
+
+
+def _parse_socks_udp(data: bytes):
+    """Split a client datagram into (host, port, payload); None if malformed or fragmented."""
+    if len(data) < 10 or data[0] or data[1] or data[2]:
+        return None
+    atyp = data[3]
+    if atyp == 1:
+        host, i = socket.inet_ntoa(data[4:8]), 8
+    elif atyp == 3:
+        n = data[4]
+        host, i = data[5:5 + n].decode("ascii", "ignore"), 5 + n
+    elif atyp == 4 and len(data) >= 22:
+        host, i = socket.inet_ntop(socket.AF_INET6, data[4:20]), 20
+    else:
+        return None
+    if len(data) < i + 2:
+        return None
+    return host, int.from_bytes(data[i:i + 2], "big"), data[i + 2:]
+
+
+class UdpAssociation:
+    """UDP ASSOCIATE relay: per-destination flow table, idle expiry and batched sends."""
+    MAX_PENDING = 16
+
+    def __init__(self, proxy: "Socks5Proxy", client_host: Optional[str], idle: float):
+        self.proxy = proxy
+        self.client_host = client_host
+        self.client_addr = None                 # locked to the first datagram's source
+        self.idle = max(1.0, idle)
+        self.flows = {}                         # (host, port) -> _UdpFlow
+        self.by_addr = {}                       # resolved (ip, port) -> _UdpFlow
+        self._client_t = self._remote_t = self._remote6_t = None
+        self._out_client, self._out_remote, self._out_remote6 = [], [], []
+        self._flush_scheduled = False
+        self._sweeper = None
+        self._loop = None
+        self._conn = _current_conn.get()  # datagrams keep the TCP control connection alive
+
+    async def open(self) -> Tuple[str, int]:
+        """Bind the client-facing and upstream sockets; returns the address to tell the client."""
+        self._loop = asyncio.get_running_loop()
+        self._client_t, _ = await self._loop.create_datagram_endpoint(
+            lambda: _UdpEndpoint(self.from_client), local_addr=(self.proxy.host, 0))
+        try:
+            self._remote_t, _ = await self._loop.create_datagram_endpoint(
+                lambda: _UdpEndpoint(self.from_remote), local_addr=("0.0.0.0", 0))
+        except OSError:
+            self._client_t.close(); raise
+        try:  # IPv6 destinations get their own upstream socket where the host has IPv6
+            self._remote6_t, _ = await self._loop.create_datagram_endpoint(
+                lambda: _UdpEndpoint(self.from_remote), local_addr=("::", 0), family=socket.AF_INET6)
+        except OSError:
+            self._remote6_t = None
+        self._sweeper = self._loop.call_later(self.idle / 2, self._sweep)
+        return self._client_t.get_extra_info("sockname")[:2]
+
+    def close(self):
+        if self._sweeper: self._sweeper.cancel()
+        for t in (self._client_t, self._remote_t, self._remote6_t):
+            if t: t.close()
+        self.flows.clear(); self.by_addr.clear()
+
+    def from_client(self, data: bytes, addr):
+        # Datagram from the SOCKS client: check, then forward to its destination
+        if self.client_addr is None:
+            if self.client_host and addr[0] != self.client_host:
+                return
+            self.client_addr = addr
+        elif addr != self.client_addr:
+            return
+        parsed = _parse_socks_udp(data)
+        if parsed is None:
+            return
+        host, port, payload = parsed
+        now = self._loop.time()
+        if self._conn is not None:
+            self._conn.last = now
+        flow = self.flows.get((host, port))
+        if flow is None:
+            flow = self._new_flow(host, port, now)
+        flow.last = now
+        if flow.blocked:
+            return
+        # Datagrams can't wait for tokens: over the rate they are dropped, and only what is sent is charged
+        if flow.meter is not None and not flow.meter.allows(len(payload), now):
+            return
+        if flow.addr is None and len(flow.pending) >= self.MAX_PENDING:
+            return
+        if flow.meter is not None:
+            flow.meter.account(len(payload), now)
+        if self._conn is not None:
+            self._conn.bytes_out += len(payload)
+        if flow.addr is None:
+            flow.pending.append(payload)
+            return
+        self._queue(self._upstream(flow.addr), payload, flow.addr)
+
+    def _upstream(self, addr) -> list:
+        # Outgoing queue of the socket matching the destination's address family
+        return self._out_remote6 if ":" in addr[0] else self._out_remote
+
+    def _new_flow(self, host, port, now) -> _UdpFlow:
+        decision, meter = self.proxy.matcher.decide(host)
+        blocked = decision in DENIED
+        flow = _UdpFlow(host, port, blocked, now, meter)
+        self.flows[(host, port)] = flow
+        asyncio.ensure_future(self.proxy.logger.write("SOCKS5-UDP", host, port, decision))
+        if not blocked:
+            asyncio.ensure_future(self._resolve(flow))
+        return flow
+
+    async def _resolve(self, flow: _UdpFlow):
+        # Resolve once per flow; queued payloads go out as soon as the address is known
+        try:
+            infos = await self._loop.getaddrinfo(flow.host, flow.port, type=socket.SOCK_DGRAM)
+        except OSError:
+            self.flows.pop((flow.host, flow.port), None); return
+        if not infos or (flow.host, flow.port) not in self.flows:
+            return
+        # Prefer IPv4; IPv6 only when the destination has nothing else
+        infos.sort(key=lambda info: info[0] != socket.AF_INET)
+        if infos[0][0] == socket.AF_INET6 and self._remote6_t is None:
+            print(f"[WARN] SOCKS5-UDP {flow.host}:{flow.port} is IPv6-only and IPv6 is unavailable; dropping")
+            flow.blocked, flow.pending = True, []  # rejected until the flow idles out
+            return
+        flow.addr = infos[0][4][:2]
+        self.by_addr[flow.addr] = flow
+        for payload in flow.pending:
+            self._queue(self._upstream(flow.addr), payload, flow.addr)
+        flow.pending = []
+
+    def from_remote(self, data: bytes, addr):
+        # Reply from a destination: only known flows get relayed back
+        flow = self.by_addr.get(addr[:2])
+        if flow is None or self.client_addr is None:
+            return
+        flow.last = self._loop.time()
+        if self._conn is not None:
+            self._conn.last = flow.last
+        if flow.meter is not None:
+            if not flow.meter.allows(len(data), flow.last):
+                return
+            flow.meter.account(len(data), flow.last)
+        if self._conn is not None:
+            self._conn.bytes_in += len(data)
+        self._queue(self._out_client, _socks_udp_header(addr) + data, self.client_addr)
+
+    def _queue(self, out: list, payload: bytes, addr):
+        # Batch sends made in one loop iteration into a single flush callback
+        out.append((payload, addr))
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        for transport, out in ((self._remote_t, self._out_remote), (self._remote6_t, self._out_remote6),
+                               (self._client_t, self._out_client)):
+            if out and transport and not transport.is_closing():
+                for payload, addr in out:
+                    transport.sendto(payload, addr)
+            out.clear()
+
+    def _sweep(self):
+        # Drop flows idle for longer than the timeout
+        cutoff = self._loop.time() - self.idle
+        for key, flow in list(self.flows.items()):
+            if flow.last < cutoff:
+                del self.flows[key]
+                if flow.addr is not None:
+                    self.by_addr.pop(flow.addr, None)
+        self._sweeper = self._loop.call_later(self.idle / 2, self._sweep)
+
+# ---------- Transparent proxy (SNI / Host peeking) ----------
+class HostPeeker:
+    """Incrementally finds the target host in the first bytes of a connection (TLS SNI or HTTP Host)."""
+    __slots__ = ("buf", "kind", "host", "port", "done")
+
+    MAX_TLS = 5 + 16384     # one full TLS record
+    MAX_HTTP = 8192         # request line + headers
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.kind = None    # "tls" | "http" | None (unknown protocol)
+        self.host = None
+        self.port = None
+        self.done = False
+
+    def feed(self, data: bytes) -> bool:
+        """Add bytes; returns True once a decision is possible (host may still be None)."""
+        self.buf += data
+        if self.kind is None:
+            b0 = self.buf[0]
+            if b0 == 0x16:
+                self.kind = "tls"
+            elif 0x41 <= b0 <= 0x5A:
+                self.kind = "http"
+            else:
+                self.done = True
+                return True
+        if self.kind == "tls":
+            self._feed_tls()
+        else:
+            self._feed_http()
+        return self.done
+
+    def _feed_tls(self):
+        # Wait for the whole first record, then walk the ClientHello in place
+        buf = self.buf
+        if len(buf) < 5:
+            return
+        need = 5 + int.from_bytes(buf[3:5], "big")
+        if len(buf) < need and len(buf) < self.MAX_TLS:
+            return
+        self.done = True
+        self.port = 443
+        self.host = self.parse_sni(memoryview(buf)[5:need])
+
+    @staticmethod
+    def parse_sni(hs: memoryview) -> Optional[str]:
+        """Extract server_name from a ClientHello handshake message; None if absent or malformed."""
+        try:
+            if hs[0] != 0x01:  # ClientHello
+                return None
+            end = min(len(hs), 4 + int.from_bytes(hs[1:4], "big"))
+            i = 4 + 2 + 32                       # version + random
+            i += 1 + hs[i]                       # session id
+            i += 2 + int.from_bytes(hs[i:i + 2], "big")  # cipher suites
+            i += 1 + hs[i]                       # compression methods
+            ext_end = min(end, i + 2 + int.from_bytes(hs[i:i + 2], "big"))
+            i += 2
+            while i + 4 <= ext_end:
+                etype = int.from_bytes(hs[i:i + 2], "big")
+                elen = int.from_bytes(hs[i + 2:i + 4], "big")
+                i += 4
+                if etype == 0:  # server_name
+                    # Every bound is clipped to the bytes we have, so a cut-off name is never returned
+                    j, list_end = i + 2, min(ext_end, i + elen, i + 2 + int.from_bytes(hs[i:i + 2], "big"))
+                    while j + 3 <= list_end:
+                        nlen = int.from_bytes(hs[j + 1:j + 3], "big")
+                        if hs[j] == 0 and j + 3 + nlen <= list_end:
+                            return bytes(hs[j + 3:j + 3 + nlen]).decode("ascii", "ignore").lower() or None
+                        j += 3 + nlen
+                    return None
+                i += elen
+        except IndexError:
+            pass
+        return None
+
+    def _feed_http(self):
+        # Wait for the end of headers, then pull the Host header out of the raw bytes
+        buf = self.buf
+        end = buf.find(b"\r\n\r\n")
+        if end < 0 and len(buf) < self.MAX_HTTP:
+            return
+        self.done = True
+        head = bytes(buf[:end if end >= 0 else self.MAX_HTTP])
+        for line in head.split(b"\r\n")[1:]:
+            if line[:5].lower() == b"host:":
+                value = line[5:].strip().decode("ascii", "ignore").lower()
+                host, _, port = value.rpartition(":") if not value.endswith("]") else (value, "", "")
+                if host and port.isdigit():
+                    self.host, self.port = host.strip("[]"), int(port)
+                else:
+                    self.host, self.port = value.strip("[]"), 80
+                return
+
+
+class TransparentProxy:
+    """Accepts redirected connections (iptables REDIRECT/TPROXY), peeks at SNI/Host, then relays or resets."""
+    SO_ORIGINAL_DST = 80
+    IP_TRANSPARENT = 19
+
+    def __init__(self, host, port, matcher: DomainMatcher, logger: Logger, tproxy: bool = False, peek_timeout: float = 5.0,
+                 guard: Optional[ConnectionGuard] = None):
+        self.host, self.port, self.matcher, self.logger = host, port, matcher, logger
+        self.tproxy = tproxy
+        self.peek_timeout = peek_timeout
+        self.guard = guard or ConnectionGuard()
+
+    def _original_dst(self, w) -> Optional[Tuple[str, int]]:
+        # Where the client was really going, or None for a direct (non-redirected) connection
+        sock = w.get_extra_info("socket")
+        if sock is None or sock.family != socket.AF_INET:
+            return None
+        if not self.tproxy and sys.platform.startswith("linux"):
+            try:
+                raw = sock.getsockopt(socket.SOL_IP, self.SO_ORIGINAL_DST, 16)
+                port = int.from_bytes(raw[2:4], "big")
+                addr = socket.inet_ntoa(raw[4:8])
+                if (addr, port) != sock.getsockname()[:2]:
+                    return addr, port
+            except OSError:
+                pass
+            return None
+        # TPROXY keeps the original destination as the local address
+        local = sock.getsockname()[:2]
+        return None if local[1] == self.port else local
+
+    def _reset(self, w):
+        # Abort with RST instead of a clean FIN
+        sock = w.get_extra_info("socket")
+        try:
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        except OSError:
+            pass
+        w.transport.abort()
+
+    async def _peek(self, r, peeker: HostPeeker):
+        # Read until the peeker can name the host (bytes are kept for replay)
+        while not peeker.done:
+            chunk = await r.read(4096)
+            if not chunk: break
+            peeker.feed(chunk)
+
+    async def handle(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
+        # Handle one redirected connection
+        peeker = HostPeeker()
+        try:
+            await asyncio.wait_for(self._peek(r, peeker), timeout=self.peek_timeout)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        if not peeker.buf:
+            w.close(); return
+
+        dst = self._original_dst(w)
+        host = peeker.host or (dst[0] if dst else None)
+        port = dst[1] if dst else peeker.port
+        if not host or not port:
+            await self.logger.write("TPROXY", host or "?", port or 0, "RESET", "no-host")
+            self._reset(w); return
+
+        decision, meter = self.matcher.decide(host)
+        await self.logger.write("TPROXY", host, port, decision)
+        if decision in DENIED:
+            self._reset(w); return
+
+        try:
+            ur, uw = await asyncio.open_connection(dst[0] if dst else host, port)
+        except OSError:
+            self._reset(w); return
+        conn_established(uw, meter=meter, kind="TPROXY", host=host, port=port)
+        try:
+            uw.write(bytes(peeker.buf)); await uw.drain()  # replay the peeked bytes
+            conn_sent(len(peeker.buf))
+            await asyncio.gather(relay(r, uw), relay(ur, w))
+        finally:
+            uw.close()
+            try: await uw.wait_closed()
+            except: pass
+            w.close()
+            try: await w.wait_closed()
+            except: pass
+
+    def _listen_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.tproxy:
+            sock.setsockopt(socket.SOL_IP, self.IP_TRANSPARENT, 1)  # needs CAP_NET_ADMIN
+        sock.bind((self.host, self.port))
+        return sock
+
+    async def run(self):
+        # Start transparent listener
+        srv = await Handover.serve("transparent", self.guard.wrap(self.handle), sock_factory=self._listen_socket,
+                                   backlog=NetTuning.backlog)
+        print(f"[TRANSPARENT] {self.host}:{self.port}{' (tproxy)' if self.tproxy else ''}")
+        startup_trace("transparent listening")
         async with srv: await srv.serve_forever()
 
+# ---------- DNS sinkhole ----------
+DNS_A, DNS_AAAA, DNS_OPT = 1, 28, 41
+DNS_NOERROR, DNS_FORMERR, DNS_SERVFAIL, DNS_NXDOMAIN = 0, 1, 2, 3
+DNS_UDP_LIMIT = 512  # Largest UDP reply for clients that did not advertise EDNS
+
+
+class DnsError(Exception):
+    """Malformed DNS message."""
+
+
+def _dns_skip_name(msg: bytes, pos: int) -> int:
+    # Offset just past a (possibly compressed) domain name
+    while True:
+        if pos >= len(msg):
+            raise DnsError("truncated name")
+        length = msg[pos]
+        if length == 0:
+            return pos + 1
+        if length & 0xC0 == 0xC0:
+            return pos + 2
+        if length & 0xC0:
+            raise DnsError("bad label")
+        pos += 1 + length
+
+
+def parse_dns_question(msg: bytes) -> Tuple[int, int, str, int, int, int]:
+    """(id, flags, qname, qtype, qclass, end of question) for a single-question query."""
+    if len(msg) < 12:
+        raise DnsError("short header")
+    qid, flags, qdcount = struct.unpack_from("!HHH", msg)
+    if qdcount != 1 or flags & 0x8000:
+        raise DnsError("not a single-question query")
+    labels, pos = [], 12
+    while True:
+        if pos >= len(msg):
+            raise DnsError("truncated name")
+        length = msg[pos]
+        pos += 1
+        if length == 0:
+            break
+        if length & 0xC0 or pos + length > len(msg):
+            raise DnsError("bad label")
+        labels.append(msg[pos:pos + length])
+        pos += length
+    if pos + 4 > len(msg):
+        raise DnsError("truncated question")
+    qtype, qclass = struct.unpack_from("!HH", msg, pos)
+    return qid, flags, b".".join(labels).decode("ascii", "ignore").lower(), qtype, qclass, pos + 4
+
+
+def dns_record_ttls(msg: bytes) -> Tuple[List[int], int]:
+    """Offsets of every TTL field in a reply (OPT excluded) and the smallest TTL, -1 if there are none."""
+    if len(msg) < 12:
+        raise DnsError("short header")
+    qdcount, ancount, nscount, arcount = struct.unpack_from("!HHHH", msg, 4)
+    pos = 12
+    for _ in range(qdcount):
+        pos = _dns_skip_name(msg, pos) + 4
+    offsets, low = [], -1
+    for _ in range(ancount + nscount + arcount):
+        pos = _dns_skip_name(msg, pos)
+        if pos + 10 > len(msg):
+            raise DnsError("truncated record")
+        rtype, _, ttl, rdlen = struct.unpack_from("!HHIH", msg, pos)
+        if rtype != DNS_OPT:
+            offsets.append(pos + 4)
+            low = ttl if low < 0 else min(low, ttl)
+        pos += 10 + rdlen
+    if pos > len(msg):
+        raise DnsError("truncated record")
+    return offsets, low
+
+
+def dns_answer_addresses(msg: bytes) -> List[Tuple[str, int]]:
+    """(address, TTL) of every A/AAAA record in the answer section."""
+    qdcount, ancount = struct.unpack_from("!HH", msg, 4)
+    pos = 12
+    for _ in range(qdcount):
+        pos = _dns_skip_name(msg, pos) + 4
+    out = []
+    for _ in range(ancount):
+        pos = _dns_skip_name(msg, pos)
+        rtype, rclass, ttl, rdlen = struct.unpack_from("!HHIH", msg, pos)
+        rdata = msg[pos + 10:pos + 10 + rdlen]
+        if rclass == 1 and ((rtype == DNS_A and rdlen == 4) or (rtype == DNS_AAAA and rdlen == 16)):
+            out.append((socket.inet_ntop(socket.AF_INET if rdlen == 4 else socket.AF_INET6, rdata), ttl))
+        pos += 10 + rdlen
+    return out
+
+
+def _dns_reply_flags(query_flags: int, rcode: int) -> int:
+    # QR + RA, opcode and RD copied from the query
+    return 0x8080 | (query_flags & 0x7900) | rcode
+
+
+def dns_error_reply(query: bytes, rcode: int, q_end: int = 12) -> bytes:
+    """Header-only (plus question, if parsed) reply carrying rcode."""
+    if len(query) < 4:
+        return b""
+    qid, flags = struct.unpack_from("!HH", query)
+    return struct.pack("!HHHHHH", qid, _dns_reply_flags(flags, rcode), 1 if q_end > 12 else 0, 0, 0, 0) + query[12:q_end]
+
+
+def dns_sinkhole_reply(query: bytes, q_end: int, qtype: int, mode: str, ttl: int) -> bytes:
+    """NXDOMAIN, or an unroutable address (0.0.0.0 / ::) for A/AAAA and NODATA for other types."""
+    if mode == "nxdomain":
+        return dns_error_reply(query, DNS_NXDOMAIN, q_end)
+    qid, flags = struct.unpack_from("!HH", query)
+    rdata = bytes(4) if qtype == DNS_A else bytes(16) if qtype == DNS_AAAA else b""
+    answer = b"\xc0\x0c" + struct.pack("!HHIH", qtype, 1, ttl, len(rdata)) + rdata if rdata else b""
+    return (struct.pack("!HHHHHH", qid, _dns_reply_flags(flags, DNS_NOERROR), 1, 1 if answer else 0, 0, 0)
+            + query[12:q_end] + answer)
+
+
+class DnsUpstream(asyncio.DatagramProtocol):
+    """Forwards queries to one upstream resolver over UDP, retrying over TCP when the reply is truncated."""
+    def __init__(self, host: str, port: int, timeout: float = 3.0):
+        self.addr, self.timeout = (host, port), timeout
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+
+    async def open(self):
+        loop = asyncio.get_running_loop()
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: self, remote_addr=self.addr)
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+
+    def datagram_received(self, data, addr):
+        if len(data) >= 12:
+            fut = self._pending.pop(int.from_bytes(data[:2], "big"), None)
+            if fut and not fut.done():
+                fut.set_result(data)
+
+    def error_received(self, exc):
+        pass  # ICMP errors surface as a timeout on the pending query
+
+    async def query(self, msg: bytes) -> bytes:
+        """Send msg upstream under a fresh id; the reply keeps that id."""
+        # Unpredictable ids, so an off-path attacker cannot guess one and spoof the answer
+        qid = secrets.randbits(16)
+        while qid in self._pending:
+            qid = secrets.randbits(16)
+        out = qid.to_bytes(2, "big") + msg[2:]
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[qid] = fut
+        try:
+            self.transport.sendto(out)
+            reply = await asyncio.wait_for(fut, self.timeout)
+        finally:
+            self._pending.pop(qid, None)
+        if reply[2] & 0x02:  # TC: the answer did not fit, ask again over TCP
+            reply = await asyncio.wait_for(self._query_tcp(out), self.timeout)
+        return reply
+
+    async def _query_tcp(self, out: bytes) -> bytes:
+        r, w = await asyncio.open_connection(*self.addr)
+        try:
+            w.write(len(out).to_bytes(2, "big") + out)
+            n = int.from_bytes(await r.readexactly(2), "big")
+            return await r.readexactly(n)
+        finally:
+            w.close()
+
+
+class _DnsUdp(asyncio.DatagramProtocol):
+    """UDP listener: local answers go out immediately, cache misses become upstream tasks."""
+    def __init__(self, server: "DnsServer"):
+        self.server = server
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        reply, pending = self.server.answer_local(data)
+        if reply:
+            self.transport.sendto(self.server.fit_udp(data, reply), addr)
+        elif pending:
+            self.server.spawn(self._forward(data, pending, addr))
+
+    async def _forward(self, data, pending, addr):
+        reply = await self.server.resolve(data, *pending)
+        if not self.transport.is_closing():
+            self.transport.sendto(self.server.fit_udp(data, reply), addr)
+
+    def error_received(self, exc):
+        pass
+
+
+class DnsServer:
+    """DNS sinkhole: blocked names are answered locally, everything else is forwarded upstream and cached."""
+    def __init__(self, host, port, matcher, logger, upstream: Tuple[str, int] = ("1.1.1.1", 53),
+                 mode: str = "nxdomain", cache_size: int = 4096, timeout: float = 3.0,
+                 block_ttl: int = 60, neg_ttl: int = 30, max_ttl: int = 3600,
+                 reverse: Optional[ResolverMap] = None):
+        self.host, self.port = host, port
+        self.reverse = reverse
+        self.matcher, self.logger = matcher, logger
+        self.upstream = DnsUpstream(upstream[0], upstream[1], timeout)
+        self.mode = mode
+        self.cache_size, self.block_ttl, self.neg_ttl, self.max_ttl = cache_size, block_ttl, neg_ttl, max_ttl
+        # (qname, qtype, qclass) -> (stored at, expires at, reply, TTL offsets); least recently used first
+        self.cache: "OrderedDict[Tuple[str, int, int], Tuple[float, float, bytes, List[int]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[str, int, int], asyncio.Future] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.queries = self.blocked = self.cache_hits = self.coalesced = self.upstream_errors = 0
+
+    def spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _log(self, host, decision):
+        self.spawn(self.logger.write("DNS", host, 53, decision))
+
+    def answer_local(self, query: bytes):
+        """(reply, None) when the blocklist or cache can answer, (None, (key, qname)) when upstream is needed."""
+        self.queries += 1
+        try:
+            _, _, name, qtype, qclass, q_end = parse_dns_question(query)
+        except DnsError:
+            return dns_error_reply(query, DNS_FORMERR), None
+        if self.matcher.is_blocked(name):
+            self.blocked += 1
+            self._log(name, "BLOCK")
+            return dns_sinkhole_reply(query, q_end, qtype, self.mode, self.block_ttl), None
+        key = (name, qtype, qclass)
+        hit = self.cache.get(key)
+        if hit:
+            stored, expires, reply, offsets = hit
+            now = time.monotonic()
+            if now < expires:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+                return self._from_cache(query, reply, offsets, int(now - stored)), None
+            del self.cache[key]
+        return None, (key, name)
+
+    async def resolve(self, query: bytes, key, name: str) -> bytes:
+        """Forward a cache miss; identical concurrent queries share one upstream round trip."""
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            reply = await asyncio.shield(fut)
+            return query[:2] + reply[2:]
+        fut = self._inflight[key] = asyncio.get_running_loop().create_future()
+        reply = None
+        try:
+            reply = await self.upstream.query(query)
+            self._store(key, reply)
+            self._log(name, "ALLOW")
+        except (asyncio.TimeoutError, OSError, EOFError, DnsError):
+            self.upstream_errors += 1
+            reply = dns_error_reply(query, DNS_SERVFAIL)
+        finally:
+            if not fut.done():
+                fut.set_result(reply or dns_error_reply(query, DNS_SERVFAIL))
+            del self._inflight[key]
+        return query[:2] + reply[2:]
+
+    def _store(self, key, reply: bytes):
+        if reply[2] & 0x02 or reply[3] & 0x0F not in (DNS_NOERROR, DNS_NXDOMAIN):
+            return  # Never cache truncated replies or server failures
+        try:
+            offsets, low = dns_record_ttls(reply)
+            if self.reverse is not None:
+                for ip, ttl in dns_answer_addresses(reply):
+                    self.reverse.add(key[0], ip, min(ttl, self.max_ttl))
+        except (DnsError, struct.error):
+            return
+        ttl = min(low if low >= 0 else self.neg_ttl, self.max_ttl)
+        if ttl <= 0 or self.cache_size <= 0:
+            return
+        now = time.monotonic()
+        self.cache[key] = (now, now + ttl, reply, offsets)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    @staticmethod
+    def _from_cache(query: bytes, reply: bytes, offsets: List[int], age: int) -> bytes:
+        # Cached reply under the new query id, TTLs aged by the time spent in the cache
+        out = bytearray(reply)
+        out[0:2] = query[0:2]
+        for off in offsets:
+            ttl = int.from_bytes(out[off:off + 4], "big")
+            out[off:off + 4] = max(0, ttl - age).to_bytes(4, "big")
+        return bytes(out)
+
+    @staticmethod
+    def fit_udp(query: bytes, reply: bytes) -> bytes:
+        # Clients without EDNS (no additional records) only accept 512 bytes over UDP
+        if len(reply) <= DNS_UDP_LIMIT or (len(query) >= 12 and query[11]):
+            return reply
+        try:
+            q_end = _dns_skip_name(reply, 12) + 4
+        except DnsError:
+            q_end = 12
+        header = bytearray(reply[:12])
+        header[2] |= 0x02
+        header[4:12] = struct.pack("!HHHH", 1 if q_end > 12 else 0, 0, 0, 0)
+        return bytes(header) + reply[12:q_end]
+
+    async def handle_tcp(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
+        # DNS over TCP: 2-byte length prefix per message, several queries per connection
+        try:
+            while True:
+                n = int.from_bytes(await asyncio.wait_for(r.readexactly(2), 30.0), "big")
+                query = await asyncio.wait_for(r.readexactly(n), 30.0)
+                reply, pending = self.answer_local(query)
+                if pending:
+                    reply = await self.resolve(query, *pending)
+                if reply:
+                    w.write(len(reply).to_bytes(2, "big") + reply)
+                    await w.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            w.close()
+
+    def stats(self) -> dict:
+        return {"dns_queries": self.queries, "dns_blocked": self.blocked, "dns_cache_hits": self.cache_hits,
+                "dns_coalesced": self.coalesced, "dns_upstream_errors": self.upstream_errors,
+                "dns_cached": len(self.cache)}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        await self.upstream.open()
+        sock = Handover.take("dns-udp")
+        if sock is None:
+            udp, _ = await loop.create_datagram_endpoint(lambda: _DnsUdp(self), local_addr=(self.host, self.port))
+        else:
+            udp, _ = await loop.create_datagram_endpoint(lambda: _DnsUdp(self), sock=sock)
+        Handover.register("dns-udp", udp)
+        try:
+            srv = await Handover.serve("dns-tcp", self.handle_tcp, self.host, self.port, backlog=NetTuning.backlog)
+            print(f"[DNS]        {self.host}:{self.port} -> {self.upstream.addr[0]}:{self.upstream.addr[1]}")
+            startup_trace("DNS listening")
+            async with srv: await srv.serve_forever()
+        finally:
+            udp.close()
+            self.upstream.close()
+
 # ---------- Windows per-user PAC toggle (HKCU) ----------
 def set_user_pac(url: str):
     """Set PAC URL for current Windows user."""
@@ -415,7 +3112,7 @@ def set_user_pac(url: str):
     if sys.platform != "win32": 
         print("[INFO] PAC toggle only on Windows."); return
     try:
-        import winreg
+        import ctypes, winreg
         key = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
         with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key, 0, winreg.KEY_SET_VALUE) as k:
             winreg.SetValueEx(k, "AutoConfigURL", 0, winreg.REG_SZ, url)
@@ -450,9 +3147,10 @@ def set_user_pac(url: str):
 
 def clear_user_pac():
     """Clear PAC URL for current Windows user."""
+    global _pac_enabled
     if sys.platform != "win32": return
     try:
-        import winreg
+        import ctypes, winreg
         key = r"Software\Microsoft\Windows\CurrentVersion\Internet Settings"
         with winreg.OpenKey(winreg.HKEY_CURRENT_USER, key, 0, winreg.KEY_SET_VALUE) as k:
             try: 
@@ -463,32 +3161,55 @@ def clear_user_pac():
         INTERNET_OPTION_REFRESH = 37
         ctypes.windll.Wininet.InternetSetOptionW(0, INTERNET_OPTION_SETTINGS_CHANGED, 0, 0)
         ctypes.windll.Wininet.InternetSetOptionW(0, INTERNET_OPTION_REFRESH, 0, 0)
+        _pac_enabled = False
         print(f"[OK] Disabled per-user PAC")
     except Exception as e:
         print(f"[WARN] Could not clear PAC automatically: {e}")
 
 # ---------- Config Loading ----------
-def load_config(blocklist_path):
-    """Load blocklist config from JSON file."""
-    # Load domain blocklist
+def load_websites(blocklist_path) -> Dict[str, dict]:
+    """The "websites" categories of the blocklist JSON."""
     if not blocklist_path or not os.path.exists(blocklist_path):
         raise FileNotFoundError(f"Blocklist file not found: {blocklist_path}")
 
     with open(blocklist_path, "r", encoding="utf-8") as f:
         data = json.load(f)
+    return data.get("websites", {})
+
+
+def category_domains(info: dict) -> List[str]:
+    """Host rules of one category: urls, ips and keywords (as *keyword* entries)."""
+    return (info.get("urls", []) + info.get("ips", [])
+            + [f"*{k.strip('*')}*" for k in info.get("keywords", []) if k.strip("*")])
+
 
+def category_limits(info: dict) -> Optional[Tuple[float, float]]:
+    """(daily quota seconds, bytes per second) for a category with a time or bandwidth limit."""
+    minutes = float(info.get("daily_minutes") or 0)
+    kbps = float(info.get("rate_kbps") or 0)
+    if minutes <= 0 and kbps <= 0:
+        return None
+    return max(minutes, 0) * 60, max(kbps, 0) * 1000 / 8
+
+
+def rules_for(websites: Dict[str, dict], blocked: Iterable[str], limited: Iterable[str] = ()):
+    """Domain and app rules with the named categories blocked and every other category allowed.
+
+    Limited categories are left out of both lists; the caller meters them instead."""
+    blocked = set(blocked)
+    limited = set(limited)
     blocked_domains = []
     unblocked_domains = []
     blocked_apps = []
     unblocked_apps = []
 
-    websites = data.get("websites", {})
     for name, info in websites.items():
-        blocked_flag = info.get("blocked", False)
-        urls = info.get("urls", [])
+        if name in limited:
+            continue
+        urls = category_domains(info)
         app_pattern = info.get("apps", "").strip()
 
-        if blocked_flag:
+        if name in blocked:
             blocked_domains.extend(urls)
             if app_pattern:
                 blocked_apps.append(app_pattern)
@@ -499,48 +3220,537 @@ def load_config(blocklist_path):
 
     return blocked_domains, unblocked_domains, blocked_apps, unblocked_apps
 
+
+def load_config(blocklist_path):
+    """Load blocklist config from JSON file."""
+    websites = load_websites(blocklist_path)
+    return rules_for(websites, [name for name, info in websites.items() if info.get("blocked", False)])
+
+# ---------- Schedules ----------
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+
+def parse_days(spec) -> List[int]:
+    """Weekday numbers (Monday = 0) for "mon-fri", "sat,sun", ["mon", "wed"], "daily" or ""."""
+    if not spec or spec in ("daily", "*"):
+        return list(range(7))
+    parts = spec if isinstance(spec, list) else str(spec).split(",")
+    days = []
+    for part in parts:
+        first, _, last = str(part).strip().lower().partition("-")
+        try:
+            lo = DAY_NAMES.index(first[:3])
+            hi = DAY_NAMES.index(last[:3]) if last else lo
+        except ValueError:
+            raise ValueError(f"unknown day in schedule: {part!r}")
+        days.extend((lo + i) % 7 for i in range((hi - lo) % 7 + 1))
+    return sorted(set(days))
+
+
+def parse_hhmm(text: str) -> int:
+    # "23:30" -> minutes after midnight; "24:00" is allowed as an end time
+    hours, _, minutes = str(text).strip().partition(":")
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= DAY_MINUTES:
+        raise ValueError(f"bad time in schedule: {text!r}")
+    return value
+
+
+class Schedule:
+    """Weekly block windows of every category compiled into a sorted interval index.
+
+    bounds[i] is the minute of the week (local time, Monday 00:00 = 0) where segment i starts,
+    active[i] the categories blocked during it. Adjacent segments never share the same set,
+    so every boundary is a real change.
+    """
+    def __init__(self, windows: Dict[str, List[dict]]):
+        events: Dict[int, Dict[str, int]] = {0: {}}
+        def add(start, end, name):
+            events.setdefault(start, {})[name] = events.get(start, {}).get(name, 0) + 1
+            events.setdefault(end, {})[name] = events.get(end, {}).get(name, 0) - 1
+
+        for name, specs in windows.items():
+            if isinstance(specs, dict):
+                specs = [specs]
+            if not isinstance(specs, list):
+                raise ValueError(f"schedule of {name!r} must be a list of windows, got {specs!r}")
+            for spec in specs:
+                try:
+                    start, end, days = self._window(spec)
+                except (TypeError, ValueError) as e:
+                    raise ValueError(f"bad schedule entry in {name!r}: {spec!r} ({e})") from None
+                length = (end - start) % DAY_MINUTES or DAY_MINUTES  # end <= start runs past midnight
+                for day in days:
+                    lo = day * DAY_MINUTES + start
+                    hi = lo + length
+                    if hi > WEEK_MINUTES:  # Sunday night into Monday morning
+                        add(lo, WEEK_MINUTES, name)
+                        add(0, hi - WEEK_MINUTES, name)
+                    else:
+                        add(lo, hi, name)
+
+        self.bounds: List[int] = []
+        self.active: List[frozenset] = []
+        counts: Dict[str, int] = {}
+        for point in sorted(events):
+            if point >= WEEK_MINUTES:
+                break
+            for name, delta in events[point].items():
+                counts[name] = counts.get(name, 0) + delta
+            names = frozenset(n for n, c in counts.items() if c > 0)
+            if not self.active or names != self.active[-1]:
+                self.bounds.append(point)
+                self.active.append(names)
+        self.categories = frozenset(windows)
+
+    @staticmethod
+    def _window(spec) -> Tuple[int, int, List[int]]:
+        # {"days": ..., "start": "HH:MM", "end": "HH:MM"} -> (start, end, weekdays)
+        if not isinstance(spec, dict):
+            raise TypeError("expected an object with days/start/end")
+        days = spec.get("days")
+        if days is not None and not isinstance(days, (str, list)):
+            raise TypeError("days must be a string or a list")
+        return parse_hhmm(spec.get("start", "00:00")), parse_hhmm(spec.get("end", "24:00")), parse_days(days)
+
+    def __bool__(self):
+        return bool(self.categories)
+
+    @staticmethod
+    def minute_of_week(now: float) -> float:
+        t = time.localtime(now)
+        return t.tm_wday * DAY_MINUTES + t.tm_hour * 60 + t.tm_min + t.tm_sec / 60
+
+    def state(self, now: float) -> Tuple[frozenset, float]:
+        """Categories blocked at wall-clock time now, and seconds until the next change."""
+        minute = self.minute_of_week(now)
+        i = bisect.bisect_right(self.bounds, minute) - 1
+        if len(self.bounds) == 1:
+            return self.active[0], float("inf")
+        nxt = self.bounds[i + 1] if i + 1 < len(self.bounds) else self.bounds[0] + WEEK_MINUTES
+        return self.active[i], (nxt - minute) * 60
+
+# ---------- Blocker service ----------
+class BlockerService:
+    """Long-lived proxies + app blocker; sessions switch blocking on and off without respawning."""
+    def __init__(self, args):
+        self.args = args
+        self.logger = Logger(args.log, max_bytes=args.log_max_bytes, max_age=args.log_max_age,
+                             compress=args.log_compress, keep=args.log_keep,
+                             policy=LogPolicy(args.log_allow_interval, args.log_sample)
+                             if args.log_allow_interval > 0 else None)
+        self.matcher = DomainMatcher([])
+        self.guard = ConnectionGuard(max_conns=args.max_conns, max_per_client=args.max_conns_per_client,
+                                     handshake_timeout=args.handshake_timeout, idle_timeout=args.idle_timeout,
+                                     max_lifetime=args.max_lifetime)
+        self.http = HttpProxy("127.0.0.1", args.proxy_port, self.matcher, self.logger,
+                              max_line=args.max_request_line, max_head=args.max_request_head, guard=self.guard)
+        self.socks = Socks5Proxy("127.0.0.1", args.socks_port, self.matcher, self.logger, udp_idle=args.udp_idle,
+                                 guard=self.guard)
+        self.transparent = None
+        if args.transparent_port:
+            self.transparent = TransparentProxy(args.transparent_host, args.transparent_port,
+                                                self.matcher, self.logger, tproxy=args.tproxy, guard=self.guard)
+        self.dns = None
+        self.resolved = ResolverMap() if args.block_resolved_ips and args.dns_port else None
+        if args.block_resolved_ips and not args.dns_port:
+            print("[WARN] --block-resolved-ips needs --dns-port, ignoring")
+        if args.dns_port:
+            self.dns = DnsServer(args.dns_host, args.dns_port, self.matcher, self.logger,
+                                 upstream=split_authority(args.dns_upstream.encode(), 53),
+                                 mode=args.dns_block_mode, cache_size=args.dns_cache, reverse=self.resolved)
+        self.pac = PacServer("127.0.0.1", args.pac_port, args.proxy_port, args.socks_port, self.matcher)
+        self.quota = QuotaBook(args.quota_state or os.path.join(os.path.dirname(args.log) or ".", "quota.json"),
+                               on_change=lambda: asyncio.ensure_future(self._apply()))
+        self.pac_url = f"http://127.0.0.1:{args.pac_port}/proxy.pac"
+        self.pac_registered = ""  # Versioned PAC URL last handed to the system settings
+        self.active = False
+        self.started_at = time.time()
+        self.session_started_at = 0.0
+        self.app_patterns: List[str] = []
+        self.app_blocker: Optional[AppBlocker] = None
+        self._app_task: Optional[asyncio.Task] = None
+        self._tasks: List[asyncio.Task] = []
+        self._closed = asyncio.Event()
+        self.websites: Dict[str, dict] = {}
+        self.schedule = Schedule({})
+        self.scheduled: frozenset = frozenset()  # Categories blocked by their schedule right now
+        self.next_change: Optional[float] = None
+        self._schedule_task: Optional[asyncio.Task] = None
+        self._quota_task: Optional[asyncio.Task] = None
+        self._apply_lock = asyncio.Lock()
+        self.closing = False
+
+    async def start(self):
+        # Bind PAC server and proxies once; they stay up between sessions
+        print(f"[PAC]        {self.pac_url}")
+        self._tasks = [asyncio.create_task(self.pac.run()),
+                       asyncio.create_task(self.http.run()), asyncio.create_task(self.socks.run())]
+        if self.transparent:
+            self._tasks.append(asyncio.create_task(self.transparent.run()))
+        if self.dns:
+            self._tasks.append(asyncio.create_task(self.dns.run()))
+        self._quota_task = asyncio.create_task(self.quota.run())
+        try:
+            self._load()  # Scheduled windows are enforced even without a session
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Schedules not loaded: {e}")
+        if self.scheduled:
+            print(f"[SCHEDULE]   blocking: {', '.join(sorted(self.scheduled))}")
+            await self._apply()
+
+    def _set_matcher(self, matcher: DomainMatcher):
+        # Swap the active rules; in-flight handlers keep the matcher they started with
+        matcher.reverse = self.resolved
+        self.matcher = matcher
+        self.http.matcher = matcher
+        self.socks.matcher = matcher
+        self.pac.set_matcher(matcher)
+        if self.transparent:
+            self.transparent.matcher = matcher
+        if self.dns:
+            self.dns.matcher = matcher
+
+    def _start_apps(self, patterns: List[str]):
+        self.app_patterns = patterns
+        if not patterns:
+            return
+        self.app_blocker = AppBlocker(
+            patterns=patterns,
+            mode=self.args.app_mode,
+            grace_seconds=self.args.app_grace,
+            scan_interval=self.args.app_scan,
+            logger=self.logger,
+            dry_run=self.args.app_dry_run
+        )
+        self._app_task = asyncio.create_task(self.app_blocker.run())
+        print(f"[APP BLOCK]  {len(patterns)} patterns, mode={self.args.app_mode}")
+
+    async def _stop_apps(self):
+        if self.app_blocker:
+            self.app_blocker.stop()
+        if self._app_task:
+            try: await self._app_task
+            except Exception: pass
+        self.app_blocker, self._app_task, self.app_patterns = None, None, []
+
+    async def _set_apps(self, patterns: List[str]):
+        # Keep a running scanner and just swap its rules
+        if not patterns:
+            await self._stop_apps()
+        elif self.app_blocker:
+            self.app_blocker.set_patterns(patterns)
+            self.app_patterns = patterns
+        else:
+            self._start_apps(patterns)
+
+    def _load(self):
+        # Re-read the blocklist and recompile the schedule index; everything is parsed before any
+        # state changes, so a bad file leaves the previous rules in force
+        websites = load_websites(self.args.blocklist)
+        schedule = Schedule({name: info["schedule"] for name, info in websites.items()
+                             if info.get("schedule")})
+        limits = {name: category_limits(info) for name, info in websites.items()}
+        self.websites, self.schedule = websites, schedule
+        self.quota.configure({name: limit for name, limit in limits.items() if limit})
+        if self._schedule_task:
+            self._schedule_task.cancel()
+            self._schedule_task = None
+        # Current windows right away, so the apply that follows never drops them even briefly
+        self.scheduled = self.schedule.state(time.time())[0] if self.schedule else frozenset()
+        if self.schedule:
+            self._schedule_task = asyncio.create_task(self._run_schedule())
+
+    async def _run_schedule(self):
+        # Sleep until the next boundary of the interval index; never polls in between
+        try:
+            while True:
+                names, delay = self.schedule.state(time.time())
+                if names != self.scheduled:
+                    self.scheduled = names
+                    print(f"[SCHEDULE]   blocking: {', '.join(sorted(names)) or 'nothing'}")
+                    await self._apply()
+                # Wake at least hourly so clock changes (DST, NTP steps) are picked up
+                self.next_change = time.time() + delay if delay != float("inf") else None
+                await asyncio.sleep(min(delay, 3600.0) + 0.01)
+        except asyncio.CancelledError:
+            return
+
+    async def _apply(self):
+        """Switch matcher, app rules and PAC to the session + schedule state in one step."""
+        async with self._apply_lock:  # Session commands and schedule boundaries may race
+            await self._apply_locked()
+
+    async def _apply_locked(self):
+        names = set(self.scheduled)
+        if self.active:
+            names.update(name for name, info in self.websites.items() if info.get("blocked", False))
+        if names:
+            # Limited categories stay reachable, metered, until their quota runs out; then they are blocked
+            limited = {name for name in names if name in self.quota.meters} - self.quota.exhausted_names()
+            blocked_domains, unblocked_domains, blocked_apps, _ = rules_for(self.websites, names, limited)
+            matcher = DomainMatcher(blocked_domains, unblocked_domains)
+            for name in sorted(limited):
+                matcher.add_limited(category_domains(self.websites[name]), self.quota.meters[name])
+            self._set_matcher(matcher)
+        else:
+            blocked_apps = []
+            self._set_matcher(DomainMatcher([]))
+        await self._set_apps(blocked_apps)
+        if names and self.args.enable_pac:
+            # Browsers cache the PAC by URL, so every new rule set is registered under a new one
+            url = f"{self.pac_url}?v={self.pac.version}"
+            if url != self.pac_registered:
+                set_user_pac(url)
+                self.pac_registered = url
+        elif not names:
+            if _pac_enabled:
+                clear_user_pac()
+            self.pac_registered = ""
+
+    async def start_session(self):
+        """Load the blocklist and start blocking."""
+        self._load()
+        self.active = True
+        self.session_started_at = time.time()
+        await self._apply()
+        print("[INFO] Blocking is active")
+
+    async def stop_session(self):
+        """Stop blocking; proxies keep listening but allow everything (scheduled windows still apply)."""
+        self.active = False
+        await self._apply()
+        print("[INFO] Blocking is inactive")
+
+    async def reload(self):
+        """Re-read the blocklist and schedules; applies immediately."""
+        self._load()
+        await self._apply()
+
+    def status(self) -> dict:
+        status = {
+            "active": self.active,
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self.started_at, 1),
+            "session_seconds": round(time.time() - self.session_started_at, 1) if self.active else 0,
+            "blocked_exact": len(self.matcher.blocked_exact),
+            "blocked_suffixes": len(self.matcher.blocked_suffixes),
+            "blocked_nets": len(self.matcher.blocked_nets),
+            "blocked_keywords": len(self.matcher.blocked_keywords),
+            "app_patterns": len(self.app_patterns),
+            "apps_frozen": len(self.app_blocker.frozen) if self.app_blocker else 0,
+            "pac_enabled": _pac_enabled,
+            "connections": self.guard.count,
+            "connections_expired": self.guard.expired,
+            "connections_rejected": self.guard.rejected,
+        }
+        if self.schedule:
+            status["scheduled"] = sorted(self.scheduled)
+            status["next_schedule_change"] = self.next_change
+        if self.quota.meters:
+            status["limits"] = self.quota.status()
+        if self.dns:
+            status.update(self.dns.stats())
+        return status
+
+    async def close(self, handover: bool = False):
+        """Stop the session and the schedule, stop accepting, then drain connections and flush the log.
+
+        On a handover the successor owns the listeners and the session, so PAC and rules are left as they are."""
+        if self.closing:
+            # Asked again while draining: cut whatever is left now
+            for conn in list(self.guard.table.values()):
+                conn.abort()
+            return
+        self.closing = True
+        if self._schedule_task:
+            self._schedule_task.cancel()
+        if self._quota_task:
+            self._quota_task.cancel()
+        self.quota.save()
+        if not handover and (self.active or self.scheduled):
+            self.active, self.scheduled = False, frozenset()
+            await self._apply()
+        Handover.close_listeners()
+        if self.guard.count:
+            print(f"[DRAIN]      waiting up to {self.args.drain_timeout:g}s for {self.guard.count} connections")
+            cut = await self.guard.drain(self.args.drain_timeout)
+            if cut:
+                print(f"[DRAIN]      cut {cut} idle or unfinished connections")
+        await self._stop_apps()
+        for t in self._tasks:
+            t.cancel()
+        await self.logger.close()
+        self._closed.set()
+
+    async def handover(self) -> bool:
+        """Restart in place: a fresh process takes over the listening sockets and the session, this one drains."""
+        if self.closing:
+            return False
+        if self._schedule_task:
+            self._schedule_task.cancel()
+            self._schedule_task = None
+        async with self._apply_lock:
+            # Resume frozen apps now; the successor's first scan deals with them again
+            await self._stop_apps()
+        self.quota.save(force=True)
+        state = {"active": self.active, "session_started_at": self.session_started_at, "pac_enabled": _pac_enabled}
+        if not await Handover.spawn(state):
+            self._load()
+            await self._apply()
+            return False
+        await self.close(handover=True)
+        return True
+
+    async def wait_closed(self):
+        # Run until close() or until a listener fails; listeners stopped by close() end quietly
+        closed = asyncio.create_task(self._closed.wait())
+        pending = {closed, *self._tasks}
+        while closed in pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t is not closed and not t.cancelled() and t.exception():
+                    closed.cancel()
+                    raise t.exception()
+
+# ---------- Control API (daemon mode) ----------
+def write_private(path: str, text: str):
+    """Replace path with text, readable by the current user only."""
+    tmp = path + ".tmp"
+    try:
+        os.unlink(tmp)  # A leftover file would keep its old permissions
+    except FileNotFoundError:
+        pass
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class ControlServer:
+    """Line-delimited JSON control API:
+    {"cmd": "start" | "stop" | "reload" | "status" | "connections" | "handover" | "shutdown"}.
+
+    On the TCP endpoint every request also carries "token", the secret written to token_path at startup.
+    A line that is not a JSON object, or has the wrong token, ends the connection."""
+    def __init__(self, service: BlockerService, path: Optional[str] = None, port: int = CONTROL_PORT,
+                 token_path: str = CONTROL_TOKEN_PATH):
+        self.service, self.path, self.port = service, path, port
+        self.token_path = token_path
+        self.token = None if path else secrets.token_hex(16)
+        self._closing: Optional[asyncio.Task] = None
+        self._clients: Set[asyncio.StreamWriter] = set()
+
+    async def dispatch(self, cmd) -> dict:
+        # Run one control command and build its reply; shutdown and handover start once the reply is out
+        if cmd == "start":
+            await self.service.start_session()
+        elif cmd == "stop":
+            await self.service.stop_session()
+        elif cmd == "reload":
+            await self.service.reload()
+        elif cmd == "connections":
+            return {"ok": True, "connections": self.service.guard.connections()}
+        elif cmd not in ("status", "shutdown", "handover"):
+            return {"ok": False, "error": f"unknown command {cmd!r}"}
+        return {"ok": True, **self.service.status()}
+
+    async def handle(self, r: asyncio.StreamReader, w: asyncio.StreamWriter):
+        # One JSON request per line, one JSON reply per line
+        self._clients.add(w)
+        cmd = None
+        try:
+            while cmd not in ("shutdown", "handover"):
+                line = await r.readline()
+                if not line: break
+                try:
+                    req = json.loads(line)
+                except ValueError:
+                    req = None
+                if not isinstance(req, dict):
+                    # Not our protocol (e.g. an HTTP request from a browser): answer once and hang up
+                    w.write(b'{"ok": false, "error": "bad request"}\n'); await w.drain()
+                    break
+                if self.token and not hmac.compare_digest(str(req.get("token", "")), self.token):
+                    w.write(b'{"ok": false, "error": "bad token"}\n'); await w.drain()
+                    break
+                cmd = req.get("cmd")
+                try:
+                    resp = await self.dispatch(cmd)
+                except Exception as e:
+                    resp = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                w.write(json.dumps(resp).encode() + b"\n"); await w.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._clients.discard(w)
+            w.close()
+            try: await w.wait_closed()
+            except (ConnectionError, OSError): pass
+        if cmd in ("shutdown", "handover") and self._closing is None:
+            # Hang up on every client first, so no handler is still reading when the loop is torn down
+            for client in list(self._clients):
+                client.close()
+            self._closing = asyncio.create_task(
+                self.service.close() if cmd == "shutdown" else self._handover())
+
+    async def _handover(self):
+        if not await self.service.handover():
+            self._closing = None  # Successor failed to start; this process keeps serving
+
+    async def run(self):
+        # Start control server
+        if self.path:
+            srv = await Handover.serve("control", self.handle, path=self.path)
+            print(f"[CONTROL]    {self.path}")
+        else:
+            write_private(self.token_path, self.token)
+            srv = await Handover.serve("control", self.handle, "127.0.0.1", self.port)
+            print(f"[CONTROL]    127.0.0.1:{self.port} (token in {self.token_path})")
+        startup_trace("control listening")
+        async with srv: await srv.serve_forever()
+
 # ---------- Main ----------
 async def main_async(args):
     """Main async entrypoint: start proxies, PAC, and app blocker."""
-    blocked_domains, unblocked_domains, blocked_apps, unblocked_apps = load_config(args.blocklist)
-    matcher = DomainMatcher(blocked_domains, unblocked_domains)
-    logger = Logger(args.log)
-
-    # PAC server
-    start_pac_server(args.pac_port, args.proxy_port, args.socks_port)
-    pac_url = f"http://127.0.0.1:{args.pac_port}/proxy.pac"
-    print(f"[PAC]        {pac_url}")
-    if args.enable_pac:
-        set_user_pac(pac_url)
+    global _pac_enabled
+    print(f"[ENGINE]     {args.engine}, {NetTuning.describe()}")
+    Handover.load()
+    service = BlockerService(args)
+    startup_trace("service init")
+    await service.start()
     if args.disable_pac:
         clear_user_pac()
 
-    # Proxies
-    http = HttpProxy("127.0.0.1", args.proxy_port, matcher, logger)
-    socks = Socks5Proxy("127.0.0.1", args.socks_port, matcher, logger)
-    
-    tasks = [http.run(), socks.run()]
-    
-    # App Blocker
-    app_patterns = blocked_apps
-    if psutil and app_patterns:
-        app_blocker = AppBlocker(
-            patterns=app_patterns,
-            mode=args.app_mode,
-            grace_seconds=args.app_grace,
-            scan_interval=args.app_scan,
-            logger=logger,
-            dry_run=args.app_dry_run
-        )
-        tasks.append(app_blocker.run())
-        print(f"[APP BLOCK]  {len(app_patterns)} patterns, mode={args.app_mode}")
-    elif app_patterns:
-        print("[WARN] App blocking disabled (psutil not installed)")
-    
-    print("\n[INFO] Press Ctrl+C to stop")
-    print("[INFO] Blocking is active\n")
-    
-    await asyncio.gather(*tasks)
+    if sys.platform != "win32":
+        # SIGTERM / Ctrl+C drain before exiting; SIGHUP restarts in place without closing the listeners
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, lambda: asyncio.ensure_future(service.close()))
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(service.handover()))
+
+    if args.daemon:
+        path = None if sys.platform == "win32" else args.control_path
+        control = ControlServer(service, path=path, port=args.control_port, token_path=args.control_token)
+        service._tasks.append(asyncio.create_task(control.run()))
+        print("\n[INFO] Waiting for control commands")
+
+    state = Handover.state
+    if state is not None:
+        # Pick up the predecessor's session where it left off
+        _pac_enabled = bool(state.get("pac_enabled"))
+        if state.get("active") or not args.daemon:
+            await service.start_session()
+            service.session_started_at = state.get("session_started_at") or service.session_started_at
+    elif not args.daemon:
+        await service.start_session()
+        startup_trace("session started")
+        print("\n[INFO] Press Ctrl+C to stop\n")
+    await Handover.ready()
+
+    await service.wait_closed()
 
 def main():
     """Parse arguments and run main logic."""
@@ -555,16 +3765,78 @@ def main():
     p.add_argument("--blocklist",  type=str, default="blocklist.json")
     p.add_argument("--apps",       type=str, default="apps.json")
     p.add_argument("--log",        type=str, default=os.path.join("logs","traffic.log"))
-    p.add_argument("--app-mode",   type=str, default="strict", choices=["polite", "strict"])
+    p.add_argument("--log-max-bytes", type=int, default=16 * 1024 * 1024, help="rotate the log at this size")
+    p.add_argument("--log-max-age", type=float, default=24 * 3600, help="rotate the log after this many seconds")
+    p.add_argument("--log-compress", type=str, default="gzip", choices=["gzip", "zstd", "none"])
+    p.add_argument("--log-keep",   type=int, default=30, help="closed log segments to keep")
+    p.add_argument("--log-allow-interval", type=float, default=60.0,
+                   help="seconds between aggregated ALLOW counters (0 = log every ALLOW)")
+    p.add_argument("--log-sample", type=float, default=0.0, help="fraction of repeat ALLOWs still logged individually")
+    p.add_argument("--analyze",    action="store_true", help="summarize the traffic log and exit")
+    p.add_argument("--analyze-json", type=str, default="", help="also write the summary as JSON here")
+    p.add_argument("--analyze-checkpoint", type=str, default="", help="incremental state (default: <log>.stats.json)")
+    p.add_argument("--analyze-reset", action="store_true", help="ignore the checkpoint and rescan everything")
+    p.add_argument("--top",        type=int, default=20, help="rows per table in --analyze output")
+    p.add_argument("--bench-apps", action="store_true", help="benchmark the app blocker on a synthetic process table and exit")
+    p.add_argument("--bench-procs", type=int, default=20000, help="synthetic processes for --bench-apps")
+    p.add_argument("--bench-rules", type=str, default="10,100,1000,10000", help="comma-separated rule counts for --bench-apps")
+    p.add_argument("--app-mode",   type=str, default="strict", choices=["polite", "strict", "freeze"])
     p.add_argument("--app-grace",  type=float, default=2.0)
     p.add_argument("--app-scan",   type=float, default=2.0)
     p.add_argument("--app-dry-run", action="store_true")
+    p.add_argument("--max-request-line", type=int, default=8192, help="HTTP proxy request line limit (bytes)")
+    p.add_argument("--max-request-head", type=int, default=65536, help="HTTP proxy request head limit (bytes)")
+    p.add_argument("--max-conns",  type=int, default=4096, help="concurrent proxy connections (0 = unlimited)")
+    p.add_argument("--max-conns-per-client", type=int, default=1024, help="concurrent connections per client IP (0 = unlimited)")
+    p.add_argument("--handshake-timeout", type=float, default=15.0, help="seconds to finish the proxy handshake")
+    p.add_argument("--idle-timeout", type=float, default=600.0, help="seconds without traffic before a tunnel is closed")
+    p.add_argument("--max-lifetime", type=float, default=0.0, help="hard cap on connection age in seconds (0 = none)")
+    p.add_argument("--udp-idle",   type=float, default=60.0, help="idle seconds before a SOCKS5 UDP flow expires")
+    p.add_argument("--transparent-port", type=int, default=0, help="listen for iptables-redirected connections")
+    p.add_argument("--transparent-host", type=str, default="0.0.0.0")
+    p.add_argument("--tproxy", action="store_true", help="transparent listener uses TPROXY (IP_TRANSPARENT)")
+    p.add_argument("--dns-port",   type=int, default=0, help="serve DNS (UDP+TCP) on this port, sinkholing blocked names")
+    p.add_argument("--dns-host",   type=str, default="127.0.0.1")
+    p.add_argument("--dns-upstream", type=str, default="1.1.1.1:53", help="resolver for names that are not blocked")
+    p.add_argument("--dns-block-mode", type=str, default="nxdomain", choices=["nxdomain", "zero"],
+                   help="answer blocked names with NXDOMAIN or 0.0.0.0 / ::")
+    p.add_argument("--block-resolved-ips", action="store_true",
+                   help="deny IP-literal connections to addresses the DNS listener resolved for blocked names")
+    p.add_argument("--dns-cache",  type=int, default=4096, help="cached DNS answers (0 = no cache)")
+    p.add_argument("--quota-state", type=str, default="",
+                   help="file with today's usage of limited categories (default: quota.json next to the log)")
+    p.add_argument("--loop",       type=str, default="auto", choices=["auto", "uvloop", "asyncio"],
+                   help="event loop: uvloop when available (auto), or force one")
+    p.add_argument("--backlog",    type=int, default=1024, help="listen backlog for the proxies")
+    p.add_argument("--no-tcp-nodelay", action="store_true", help="leave Nagle's algorithm on for proxied sockets")
+    p.add_argument("--tcp-keepalive", type=float, default=0.0, help="TCP keepalive idle seconds (0 = off)")
+    p.add_argument("--daemon", action="store_true", help="stay idle and wait for control commands")
+    p.add_argument("--drain-timeout", type=float, default=10.0,
+                   help="seconds open connections get to finish on shutdown or handover")
+    p.add_argument("--control-port", type=int, default=CONTROL_PORT)
+    p.add_argument("--control-path", type=str, default=CONTROL_PATH)
+    p.add_argument("--control-token", type=str, default=CONTROL_TOKEN_PATH,
+                   help="file the TCP control endpoint's per-run token is written to (owner-only)")
+    p.add_argument("--trace-startup", action="store_true", help="print timings for import, init and listen phases")
     args = p.parse_args()
 
     if args.disable_pac_only:
         clear_user_pac()
         print("[INFO] PAC disabled, exiting")
         return  # Exit immediately
+
+    if args.analyze:
+        run_analytics(args)
+        return
+    if args.bench_apps:
+        run_app_benchmark(args)
+        return
+
+    NetTuning.backlog = max(1, args.backlog)
+    NetTuning.nodelay = not args.no_tcp_nodelay
+    NetTuning.keepalive = max(0.0, args.tcp_keepalive)
+    args.engine = install_event_loop(args.loop)
+    startup_trace(f"arguments parsed, event loop: {args.engine}")
     
     try:
         asyncio.run(main_async(args))
@@ -577,4 +3849,5 @@ def main():
 
 if __name__ == "__main__" and len(sys.argv) == 1:
     sys.argv += ["--enable-pac", "--app-mode", "strict", "--app-scan", "1.0"]
-main()
+if __name__ == "__main__":
+    main()
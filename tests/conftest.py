@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The blocker and the UI helpers are plain modules at the top of the repo, not an installed package
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,98 @@
+import asyncio
+import fnmatch
+import random
+import re
+import time
+
+import pytest
+
+pytest.importorskip("psutil")
+
+from mvp_blocker import AppBlocker, Logger, SyntheticProcesses, _Identity, bench_rules
+
+PROCS, RULES = 20000, 5000
+# Stated bounds, about five times what the indexed matcher needs here (~10 us per process);
+# trying every glob on every process would take close to a minute at these sizes
+MATCH_BOUND_S = 1.0     # 20,000 identities against 5,000 rules
+SCAN_BOUND_S = 1.5      # one dry-run scan of the 20,000-process table
+
+
+def extra_globs(rng, count):
+    # Shapes bench_rules does not produce: ?, character classes, suffix and mid-name wildcards
+    shapes = ["proc{}?.exe", "[pq]roc{}*", "*{}.exe", "game{}*.exe", "*tool{}*", "renamed{}.exe", "app*{}"]
+    return [rng.choice(shapes).format(rng.randrange(5000)) for _ in range(count)]
+
+
+def brute_force(globs):
+    # Every glob tried on every name, as one alternation so the reference itself stays quick
+    regex = re.compile("|".join(f"(?:{fnmatch.translate(g.lower())})" for g in globs))
+    return lambda name: regex.match(name) is not None
+
+
+def names_of(source):
+    return [p.info["name"].lower() for p in source.procs.values()]
+
+
+@pytest.fixture
+def logger(tmp_path):
+    logger = Logger(str(tmp_path / "apps.log"), compress="none")
+    yield logger
+    asyncio.run(logger.close())
+
+
+def test_name_index_agrees_with_brute_force_fnmatch():
+    rng = random.Random(7)
+    patterns, hits = bench_rules(RULES)
+    patterns += extra_globs(rng, 500)
+    blocker = AppBlocker(patterns, dry_run=True, source=SyntheticProcesses(0))
+    source = SyntheticProcesses(PROCS, hits, hot=0.05, seed=3)
+    names = set(names_of(source)) | {h.lower() for h in hits} | {f"proc{i}.exe" for i in range(0, 5000, 7)}
+    expected = brute_force(patterns)
+    for name in names:
+        matched, _ = blocker._matches_any(_Identity(name, name))
+        assert matched == expected(name), name
+
+
+def test_matching_time_stays_bounded_with_many_rules():
+    patterns, hits = bench_rules(RULES)
+    blocker = AppBlocker(patterns, dry_run=True, source=SyntheticProcesses(0))
+    idents = [_Identity(n, n, f"/opt/apps/{n}") for n in names_of(SyntheticProcesses(PROCS, hits, hot=0.05))]
+    t0 = time.perf_counter()
+    for ident in idents:
+        blocker._matches_any(ident)
+    assert time.perf_counter() - t0 < MATCH_BOUND_S
+
+
+def test_scan_terminates_exactly_the_matching_processes(logger):
+    patterns, hits = bench_rules(RULES)
+    source = SyntheticProcesses(PROCS, hits, hot=0.05, churn=0, rename=0, denied=0.01, respawn=False, seed=5)
+    procs = list(source.procs.values())
+    # Denied processes hide their exe (so only the name is checked) and refuse the signal
+    expected = brute_force(patterns)
+    verdicts = {name: expected(name) for name in set(names_of(source))}
+    matching = {p.pid for p in procs if verdicts[p.info["name"].lower()]}
+    denied = {p.pid for p in procs if p.denied}
+    assert len(matching) > 500
+
+    async def scan():
+        blocker = AppBlocker(patterns, mode="strict", grace_seconds=0, logger=logger, source=source)
+        await blocker._scan_once()
+
+    asyncio.run(scan())
+    survivors = set(source.procs)
+    assert survivors == {p.pid for p in procs} - (matching - denied)
+    assert source.killed == len(matching - denied)
+
+
+def test_dry_run_scan_time_stays_bounded(logger):
+    patterns, hits = bench_rules(RULES)
+
+    async def scan():
+        blocker = AppBlocker(patterns, mode="strict", logger=logger, dry_run=True,
+                             source=SyntheticProcesses(PROCS, hits, respawn=False))
+        await blocker._scan_once()  # Warm-up, as the blocker's first scan is
+        t0 = time.perf_counter()
+        await blocker._scan_once()
+        return time.perf_counter() - t0
+
+    assert asyncio.run(scan()) < SCAN_BOUND_S
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import os
+import stat
+import sys
+
+import pytest
+
+from mvp_blocker import ControlServer, write_private
+
+
+class Service:
+    """Just enough of BlockerService for the control API"""
+
+    def __init__(self, handover_ok=True):
+        self.handover_ok = handover_ok
+        self.calls = []
+
+    def status(self):
+        return {"active": False}
+
+    async def close(self):
+        self.calls.append("close")
+
+    async def handover(self):
+        self.calls.append("handover")
+        return self.handover_ok
+
+
+async def control_session(service, exchange, **kwargs):
+    control = ControlServer(service, **kwargs)
+    server = await asyncio.start_server(control.handle, "127.0.0.1", 0)
+    addr = server.sockets[0].getsockname()[:2]
+    try:
+        await exchange(control, addr)
+    finally:
+        server.close()
+        await server.wait_closed()
+
+
+async def send(r, w, cmd, token=None):
+    w.write(json.dumps({"cmd": cmd, "token": token}).encode() + b"\n")
+    return json.loads(await asyncio.wait_for(r.readline(), 2))
+
+
+def test_shutdown_replies_then_hangs_up_on_every_client_before_closing():
+    service = Service()
+
+    async def exchange(control, addr):
+        idle_r, idle_w = await asyncio.open_connection(*addr)
+        r, w = await asyncio.open_connection(*addr)
+        assert (await send(r, w, "status", control.token))["ok"]
+        assert (await send(r, w, "shutdown", control.token))["ok"]
+        assert await asyncio.wait_for(r.read(), 2) == b""
+        assert await asyncio.wait_for(idle_r.read(), 2) == b""
+        await control._closing
+        assert service.calls == ["close"] and not control._clients
+        w.close()
+        idle_w.close()
+
+    asyncio.run(control_session(service, exchange))
+
+
+def test_failed_handover_keeps_serving():
+    service = Service(handover_ok=False)
+
+    async def exchange(control, addr):
+        r, w = await asyncio.open_connection(*addr)
+        assert (await send(r, w, "handover", control.token))["ok"]
+        await asyncio.wait_for(r.read(), 2)
+        while control._closing is not None:
+            await asyncio.sleep(0.01)
+        assert service.calls == ["handover"]
+        r, w = await asyncio.open_connection(*addr)
+        assert (await send(r, w, "bogus", control.token)) == {"ok": False, "error": "unknown command 'bogus'"}
+        w.close()
+
+    asyncio.run(control_session(service, exchange))
+
+
+def test_http_request_is_cut_off_at_the_first_line():
+    # What a cross-origin fetch("http://127.0.0.1:18081/", {method: "POST", body}) puts on the wire
+    service = Service()
+    body = b'{"cmd":"shutdown"}\n'
+    payload = (b"POST / HTTP/1.1\r\nHost: 127.0.0.1:18081\r\nContent-Type: text/plain\r\n"
+               b"Content-Length: %d\r\n\r\n" % len(body) + body)
+
+    async def exchange(control, addr):
+        r, w = await asyncio.open_connection(*addr)
+        w.write(payload)
+        reply = await asyncio.wait_for(r.read(), 2)
+        assert reply.count(b"\n") == 1 and json.loads(reply) == {"ok": False, "error": "bad request"}
+        await asyncio.sleep(0.05)
+        assert service.calls == [] and control._closing is None
+        w.close()
+
+    asyncio.run(control_session(service, exchange))
+
+
+@pytest.mark.parametrize("token", [None, "", "0" * 32])
+def test_tcp_endpoint_requires_the_run_token(token):
+    service = Service()
+
+    async def exchange(control, addr):
+        r, w = await asyncio.open_connection(*addr)
+        assert await send(r, w, "shutdown", token) == {"ok": False, "error": "bad token"}
+        assert await asyncio.wait_for(r.read(), 2) == b""
+        assert service.calls == []
+        w.close()
+
+    asyncio.run(control_session(service, exchange))
+
+
+def test_unix_socket_endpoint_needs_no_token(tmp_path):
+    assert ControlServer(Service(), path=str(tmp_path / "ctl.sock")).token is None
+    assert ControlServer(Service()).token != ControlServer(Service()).token
+
+
+def test_token_file_is_private(tmp_path):
+    path = str(tmp_path / "ctl.token")
+    with open(path + ".tmp", "w") as f:
+        f.write("stale")
+    os.chmod(path + ".tmp", 0o644)
+    write_private(path, "secret")
+    with open(path) as f:
+        assert f.read() == "secret"
+    if sys.platform != "win32":
+        assert stat.S_IMODE(os.stat(path).st_mode) == 0o600
@@ -0,0 +1,114 @@
+import random
+
+import pytest
+
+from UI.countdown import TICK_SLACK_MS, Countdown, ms_to_next_second, seconds_left
+
+
+class FakeClock:
+    """Monotonic clock that only moves when the test advances it"""
+
+    def __init__(self, start=1000.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def run(countdown, clock, first_tick, lateness=lambda: 0.0):
+    # Plays the widget's single-shot timer: fire after the returned delay (plus lateness), then re-arm
+    shown, fired = [countdown.remaining], []
+    delay = first_tick
+    while delay is not None:
+        clock.advance(delay / 1000 + lateness())
+        fired.append(clock())
+        delay = countdown.tick()
+        shown.append(countdown.remaining)
+    return shown, fired
+
+
+def test_seconds_left_rounds_up_and_never_goes_negative():
+    assert seconds_left(10.0, 0.0) == 10
+    assert seconds_left(10.0, 0.001) == 10
+    assert seconds_left(10.0, 9.999) == 1
+    assert seconds_left(10.0, 10.0) == 0
+    assert seconds_left(10.0, 25.0) == 0
+
+
+def test_next_tick_lands_just_after_the_boundary():
+    assert ms_to_next_second(10.0, 0.0) == 1000 + TICK_SLACK_MS
+    assert ms_to_next_second(10.0, 0.25) == 750 + TICK_SLACK_MS
+    assert ms_to_next_second(10.0, 10.0) == 0
+    assert ms_to_next_second(10.0, 11.0) == 0
+
+
+def test_on_time_ticks_show_every_second_once_without_drift():
+    clock = FakeClock()
+    countdown = Countdown(clock)
+    deadline = clock() + 90.4
+    shown, fired = run(countdown, clock, countdown.start(deadline))
+    assert shown == list(range(91, -1, -1))
+    # Every tick lands just after a whole second before the deadline, the 91st one included
+    for n, at in zip(range(90, -1, -1), fired):
+        assert deadline - n <= at <= deadline - n + (TICK_SLACK_MS + 1) / 1000
+
+
+def test_skipped_ticks_jump_straight_to_the_current_second():
+    clock = FakeClock()
+    countdown = Countdown(clock)
+    countdown.start(clock() + 10)
+    assert countdown.remaining == 10
+    clock.advance(3.5)  # The event loop stalled through three ticks
+    assert countdown.tick() == 500 + TICK_SLACK_MS
+    assert countdown.remaining == 7
+    clock.advance(6.0)
+    assert countdown.tick() is not None and countdown.remaining == 1
+    clock.advance(0.5)
+    assert countdown.tick() is None and countdown.remaining == 0
+    assert countdown.seconds_to_deadline() == 0
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_late_and_skipped_ticks_do_not_drift(seed):
+    rng = random.Random(seed)
+    clock = FakeClock()
+    countdown = Countdown(clock)
+    deadline = clock() + 300.0
+
+    def lateness():
+        # Mostly small jitter, sometimes a stall long enough to swallow several ticks
+        return rng.choice([0.0, rng.uniform(0, 0.4), rng.uniform(1, 7)])
+
+    shown, fired = run(countdown, clock, countdown.start(deadline), lateness)
+    assert shown[0] == 300 and shown[-1] == 0
+    assert all(a > b for a, b in zip(shown, shown[1:]))
+    assert len(shown) < 301  # Stalls skipped some seconds instead of replaying them
+    # Zero shows up only once the deadline itself has passed, however many ticks were lost
+    assert fired[-2] < deadline <= fired[-1]
+
+
+def test_clock_widget_counts_down_through_its_countdown():
+    pytest.importorskip("PyQt6.QtWidgets")
+    from PyQt6.QtWidgets import QApplication
+    from UI.clock_widget import ClockWidget
+
+    app = QApplication.instance() or QApplication(["test", "-platform", "offscreen"])
+    widget = ClockWidget()
+    try:
+        clock = FakeClock()
+        widget.countdown.clock = clock
+        widget.total_seconds = 10
+        widget.start_session(clock() + 10)
+        clock.advance(3.5)  # Three ticks missed
+        widget.update_countdown()
+        assert widget.remaining_seconds == 7 and widget.timer.isActive()
+        clock.advance(7)
+        widget.update_countdown()
+        assert widget.remaining_seconds == 0 and not widget.is_running
+    finally:
+        widget.blocker_worker.close()
+        widget.deleteLater()
+        app.processEvents()
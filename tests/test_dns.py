@@ -0,0 +1,166 @@
+import asyncio
+import socket
+import struct
+import time
+import types
+
+import pytest
+
+import mvp_blocker
+from mvp_blocker import DNS_NOERROR, DNS_NXDOMAIN, DnsServer, DomainMatcher, Logger, _DnsUdp
+
+
+def dns_query(name, qid=0x1234, qtype=1):
+    labels = b"".join(bytes([len(p)]) + p.encode() for p in name.split("."))
+    return struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0) + labels + b"\x00" + struct.pack("!HH", qtype, 1)
+
+
+def reply_answer(reply):
+    # (rcode, first A record address, its TTL) of a reply to a dns_query() question
+    rcode, ancount = reply[3] & 0x0F, struct.unpack_from("!H", reply, 6)[0]
+    if not ancount:
+        return rcode, None, None
+    pos = reply.index(b"\x00", 12) + 5  # end of the question
+    _, _, ttl, _ = struct.unpack_from("!HHIH", reply, pos + 2)
+    return rcode, socket.inet_ntoa(reply[pos + 12:pos + 16]), ttl
+
+
+class StubUpstream(asyncio.DatagramProtocol):
+    """Resolver answering every A query with 192.0.2.1 after an optional delay"""
+
+    def __init__(self, ttl=300, delay=0.0):
+        self.ttl, self.delay = ttl, delay
+        self.queries = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.queries.append(data)
+        q_end = data.index(b"\x00", 12) + 5
+        reply = (struct.pack("!HHHHHH", int.from_bytes(data[:2], "big"), 0x8180, 1, 1, 0, 0) + data[12:q_end]
+                 + b"\xc0\x0c" + struct.pack("!HHIH", 1, 1, self.ttl, 4) + socket.inet_aton("192.0.2.1"))
+        asyncio.get_running_loop().call_later(self.delay, self.transport.sendto, reply, addr)
+
+
+class FakeMonotonic:
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self):
+        return time.monotonic() + self.offset
+
+
+@pytest.fixture
+def fake_monotonic(monkeypatch):
+    # Only the DNS cache sees the shifted clock; the event loop keeps the real one
+    clock = FakeMonotonic()
+    shim = types.SimpleNamespace(**{n: getattr(time, n) for n in dir(time) if not n.startswith("_")})
+    shim.monotonic = clock
+    monkeypatch.setattr(mvp_blocker, "time", shim)
+    return clock
+
+
+async def dns_session(tmp_path, stub, exchange):
+    loop = asyncio.get_running_loop()
+    stub_t, _ = await loop.create_datagram_endpoint(lambda: stub, local_addr=("127.0.0.1", 0))
+    logger = Logger(str(tmp_path / "traffic.log"))
+    server = DnsServer("127.0.0.1", 0, DomainMatcher(["blocked.test"]), logger,
+                       upstream=stub_t.get_extra_info("sockname")[:2], timeout=2.0)
+    await server.upstream.open()
+    listen_t, _ = await loop.create_datagram_endpoint(lambda: _DnsUdp(server), local_addr=("127.0.0.1", 0))
+    listen = listen_t.get_extra_info("sockname")[:2]
+
+    replies = asyncio.Queue()
+
+    class Client(asyncio.DatagramProtocol):
+        def datagram_received(self, data, addr):
+            replies.put_nowait(data)
+
+    client_t, _ = await loop.create_datagram_endpoint(Client, remote_addr=listen)
+
+    async def ask(query):
+        client_t.sendto(query)
+        return await asyncio.wait_for(replies.get(), 2)
+
+    try:
+        await exchange(server, client_t, replies, ask)
+    finally:
+        client_t.close()
+        listen_t.close()
+        server.upstream.close()
+        stub_t.close()
+        await logger.close()
+
+
+def test_sinkholed_names_are_answered_locally(tmp_path):
+    stub = StubUpstream()
+
+    async def exchange(server, client_t, replies, ask):
+        for name in ("blocked.test", "www.blocked.test"):
+            reply = await ask(dns_query(name, qid=0x4242))
+            assert reply[:2] == b"\x42\x42"
+            assert reply_answer(reply) == (DNS_NXDOMAIN, None, None)
+        assert stub.queries == [] and server.blocked == 2
+
+    asyncio.run(dns_session(tmp_path, stub, exchange))
+
+
+def test_allowed_names_are_forwarded_and_cached(tmp_path):
+    stub = StubUpstream(ttl=300)
+
+    async def exchange(server, client_t, replies, ask):
+        reply = await ask(dns_query("example.org", qid=0x0101))
+        assert reply[:2] == b"\x01\x01"
+        assert reply_answer(reply) == (DNS_NOERROR, "192.0.2.1", 300)
+        assert len(stub.queries) == 1
+        # The upstream sees a fresh id, never the client's
+        assert stub.queries[0][2:] == dns_query("example.org")[2:]
+
+        reply = await ask(dns_query("example.org", qid=0x0202))
+        assert reply[:2] == b"\x02\x02" and reply_answer(reply)[1] == "192.0.2.1"
+        assert len(stub.queries) == 1 and server.cache_hits == 1
+
+    asyncio.run(dns_session(tmp_path, stub, exchange))
+
+
+def test_concurrent_identical_queries_share_one_upstream_trip(tmp_path):
+    stub = StubUpstream(delay=0.2)
+
+    async def exchange(server, client_t, replies, ask):
+        ids = list(range(1, 11))
+        for qid in ids:
+            client_t.sendto(dns_query("slow.example", qid=qid))
+        got = [await asyncio.wait_for(replies.get(), 2) for _ in ids]
+        assert sorted(int.from_bytes(r[:2], "big") for r in got) == ids
+        assert all(reply_answer(r)[1] == "192.0.2.1" for r in got)
+        assert len(stub.queries) == 1 and server.coalesced == len(ids) - 1
+
+    asyncio.run(dns_session(tmp_path, stub, exchange))
+
+
+def test_cached_answers_age_and_expire(tmp_path, fake_monotonic):
+    stub = StubUpstream(ttl=60)
+
+    async def exchange(server, client_t, replies, ask):
+        await ask(dns_query("ttl.example"))
+        fake_monotonic.offset = 45
+        assert reply_answer(await ask(dns_query("ttl.example")))[2] == 15
+        assert len(stub.queries) == 1
+        fake_monotonic.offset = 61
+        assert reply_answer(await ask(dns_query("ttl.example")))[2] == 60
+        assert len(stub.queries) == 2
+
+    asyncio.run(dns_session(tmp_path, stub, exchange))
+
+
+def test_transaction_ids_come_from_the_system_rng(tmp_path, monkeypatch):
+    stub = StubUpstream()
+    monkeypatch.setattr(mvp_blocker.random, "getrandbits", lambda n: pytest.fail("predictable id"))
+
+    async def exchange(server, client_t, replies, ask):
+        for i in range(5):
+            assert reply_answer(await ask(dns_query(f"n{i}.example")))[0] == DNS_NOERROR
+        assert len({q[:2] for q in stub.queries}) > 1
+
+    asyncio.run(dns_session(tmp_path, stub, exchange))
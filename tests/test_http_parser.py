@@ -0,0 +1,165 @@
+import random
+import time
+
+import pytest
+
+from mvp_blocker import HttpParseError, HttpRequestParser
+
+MAX_LINE, MAX_HEAD = 256, 1024
+
+
+def outcome(chunks):
+    # Everything the proxy reads off a parser, or the status it would answer with
+    parser = HttpRequestParser(MAX_LINE, MAX_HEAD)
+    state = HttpRequestParser.NEED_MORE
+    try:
+        for chunk in chunks:
+            new = parser.feed(chunk)
+            assert new >= state  # Parsing never moves backwards
+            state = new
+    except HttpParseError as e:
+        return ("error", e.code)
+    if state != HttpRequestParser.HEAD:
+        return ("incomplete", state, parser.method if state else b"")
+    return ("head", parser.method, parser.target, parser.version, parser.content_length,
+            parser.chunked, parser.header(b"host"), parser.head, parser.rest)
+
+
+def random_splits(data, rng):
+    cuts = sorted(rng.sample(range(1, len(data)), min(len(data) - 1, rng.randint(1, 12))))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+def random_request(rng):
+    method = rng.choice([b"GET", b"POST", b"CONNECT", b"get", b"PUT"])
+    target = rng.choice([b"http://example.com/", b"example.com:443", b"/" + b"a" * rng.randint(0, 300)])
+    line = rng.choice([
+        method + b" " + target + b" HTTP/1.1",
+        method + b" " + target,                   # HTTP/0.9 style, no version
+        method,                                   # malformed: no target
+        b"",                                      # malformed: empty request line
+    ])
+    headers = [b"Host: example.com"]
+    for _ in range(rng.randint(0, 8)):
+        headers.append(rng.choice([
+            b"Content-Length: %d" % rng.randint(0, 50),
+            b"Content-Length: nope",
+            b"Content-Length: -4",
+            b"Transfer-Encoding: gzip, Chunked",
+            b"X-Pad: " + b"x" * rng.randint(0, 400),
+            b"no colon here",
+            b" folded: value",
+        ]))
+    body = bytes(rng.randrange(256) for _ in range(rng.randint(0, 40)))
+    tail = rng.choice([b"\r\n\r\n", b"\r\n", b""])  # complete, truncated or missing terminator
+    return line + b"\r\n" + b"\r\n".join(headers) + tail + body
+
+
+def test_simple_request():
+    result = outcome([b"POST http://example.com/x HTTP/1.1\r\nHost: example.com\r\n"
+                      b"Content-Length: 3\r\n\r\nabcGET"])
+    assert result == ("head", b"POST", b"http://example.com/x", b"HTTP/1.1", 3, False, b"example.com",
+                      b"POST http://example.com/x HTTP/1.1\r\nHost: example.com\r\nContent-Length: 3\r\n\r\n",
+                      b"abcGET")
+
+
+def test_request_line_state_before_headers_arrive():
+    parser = HttpRequestParser(MAX_LINE, MAX_HEAD)
+    assert parser.feed(b"CONNECT example.com:443 HTTP/1.1\r") == HttpRequestParser.NEED_MORE
+    assert parser.feed(b"\n") == HttpRequestParser.LINE
+    assert (parser.method, parser.target) == (b"CONNECT", b"example.com:443")
+    assert parser.feed(b"Host: example.com\r\n\r") == HttpRequestParser.LINE
+    assert parser.feed(b"\n") == HttpRequestParser.HEAD
+
+
+@pytest.mark.parametrize("data, code", [
+    (b"GET\r\n\r\n", 400),
+    (b"\r\n\r\n", 400),
+    (b"GET / HTTP/1.1\r\nContent-Length: nope\r\n\r\n", 400),
+    (b"GET / HTTP/1.1\r\nContent-Length: -1\r\n\r\n", 400),
+    (b"GET /" + b"a" * MAX_LINE + b" HTTP/1.1\r\n\r\n", 414),
+    (b"GET /" + b"a" * MAX_LINE, 414),
+    (b"GET / HTTP/1.1\r\nX-Pad: " + b"x" * MAX_HEAD + b"\r\n\r\n", 431),
+    (b"GET / HTTP/1.1\r\n" + b"X: y\r\n" * MAX_HEAD, 431),
+])
+def test_malformed_and_oversized_heads(data, code):
+    assert outcome([data]) == ("error", code)
+    assert outcome([data[i:i + 1] for i in range(len(data))]) == ("error", code)
+
+
+@pytest.mark.parametrize("size", [MAX_LINE - 1, MAX_LINE, MAX_LINE + 1])
+def test_line_limit_is_the_same_for_every_split(size):
+    line = b"GET /" + b"a" * (size - len(b"GET / HTTP/1.1")) + b" HTTP/1.1"
+    assert len(line) == size
+    data = line + b"\r\nHost: h\r\n\r\n"
+    whole = outcome([data])
+    assert whole[0] == ("error" if size > MAX_LINE else "head")
+    for cut in range(size - 2, size + 3):
+        assert outcome([data[:cut], data[cut:]]) == whole, cut
+
+
+@pytest.mark.parametrize("size", [MAX_HEAD - 1, MAX_HEAD, MAX_HEAD + 1])
+def test_head_limit_is_the_same_for_every_split(size):
+    start = b"GET / HTTP/1.1\r\nX-Pad: "
+    data = start + b"x" * (size - len(start) - 4) + b"\r\n\r\nbody"
+    whole = outcome([data])
+    assert whole[0] == ("error" if size > MAX_HEAD else "head")
+    for cut in range(size - 5, size + 2):
+        assert outcome([data[:cut], data[cut:]]) == whole, cut
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_byte_by_byte_and_random_splits_match_single_shot(seed):
+    rng = random.Random(seed)
+    for _ in range(25):
+        data = random_request(rng)
+        whole = outcome([data])
+        assert outcome([data[i:i + 1] for i in range(len(data))]) == whole, data
+        if len(data) > 1:
+            assert outcome(random_splits(data, rng)) == whole, data
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_random_bytes_never_escape_as_other_errors(seed):
+    rng = random.Random(seed)
+    alphabet = b"GET /:\r\n x-Content-Length0123456789chunked"
+    for _ in range(50):
+        data = bytes(rng.choice(alphabet) for _ in range(rng.randint(1, 1500)))
+        whole = outcome([data])  # Only HttpParseError may escape the parser
+        assert outcome(random_splits(data, rng) if len(data) > 1 else [data]) == whole, data
+
+
+# Throughput floor of 20,000 heads/s; the parser does 100,000-250,000 here, so the bound leaves headroom
+THROUGHPUT_REQUESTS = 20000
+THROUGHPUT_BOUND_S = 1.0
+
+
+def test_pipelined_requests_parse_within_the_throughput_bound():
+    request = (b"GET http://example.com/%05d HTTP/1.1\r\nHost: example.com\r\nUser-Agent: bench\r\n"
+               b"Accept: */*\r\nContent-Length: 0\r\n\r\n")
+    stream = b"".join(request % i for i in range(THROUGHPUT_REQUESTS))
+    started = time.perf_counter()
+    # As HttpProxy._forward_http does: 64 KiB reads, each new parser starts from the previous rest
+    parser, pos, targets = HttpRequestParser(), 0, []
+    while True:
+        state = parser.feed(b"") if parser.buf else HttpRequestParser.NEED_MORE
+        while state != HttpRequestParser.HEAD and pos < len(stream):
+            state = parser.feed(stream[pos:pos + 65536])
+            pos += 65536
+        if state != HttpRequestParser.HEAD:
+            break
+        targets.append(parser.target)
+        parser = HttpRequestParser(initial=parser.rest)
+    elapsed = time.perf_counter() - started
+    assert targets == [b"http://example.com/%05d" % i for i in range(THROUGHPUT_REQUESTS)]
+    assert elapsed < THROUGHPUT_BOUND_S, f"{THROUGHPUT_REQUESTS / elapsed:.0f} requests/s"
+
+
+def test_single_request_heads_parse_within_the_throughput_bound():
+    request = b"CONNECT example.com:443 HTTP/1.1\r\nHost: example.com:443\r\nProxy-Connection: keep-alive\r\n\r\n"
+    started = time.perf_counter()
+    for _ in range(THROUGHPUT_REQUESTS):
+        parser = HttpRequestParser()
+        assert parser.feed(request) == HttpRequestParser.HEAD
+    elapsed = time.perf_counter() - started
+    assert elapsed < THROUGHPUT_BOUND_S, f"{THROUGHPUT_REQUESTS / elapsed:.0f} requests/s"
@@ -0,0 +1,35 @@
+import pytest
+
+from mvp_blocker import DAY_MINUTES, Schedule
+
+
+def test_windows_compile_into_interval_index():
+    schedule = Schedule({"Games": [{"days": "mon-fri", "start": "09:00", "end": "17:00"}]})
+    assert schedule.bounds[:3] == [0, 9 * 60, 17 * 60]
+    assert schedule.active[1] == frozenset({"Games"})
+    assert schedule.active[2] == frozenset()
+
+
+def test_window_past_midnight_wraps_into_next_day():
+    schedule = Schedule({"Social": [{"days": "sun", "start": "23:00", "end": "01:00"}]})
+    assert schedule.bounds[:2] == [0, 60]
+    assert schedule.active[0] == frozenset({"Social"})
+    assert schedule.bounds[-1] == 6 * DAY_MINUTES + 23 * 60
+
+
+def test_single_window_object_is_accepted():
+    assert Schedule({"Games": {"days": "daily"}}).active == [frozenset({"Games"})]
+
+
+@pytest.mark.parametrize("specs", [
+    "mon-fri",
+    ["09:00"],
+    [{"days": 5}],
+    [{"days": {"mon": True}}],
+    [{"start": "nine"}],
+    [{"end": "25:00"}],
+    [{"days": "someday"}],
+])
+def test_malformed_entry_raises_value_error_naming_it(specs):
+    with pytest.raises(ValueError, match="Games"):
+        Schedule({"Games": specs})
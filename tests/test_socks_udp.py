@@ -0,0 +1,154 @@
+import asyncio
+import socket
+
+import pytest
+
+from mvp_blocker import CategoryMeter, DomainMatcher, Logger, Socks5Proxy, UdpAssociation, _UdpFlow
+
+
+def has_ipv6_loopback():
+    try:
+        with socket.socket(socket.AF_INET6, socket.SOCK_DGRAM) as s:
+            s.bind(("::1", 0))
+        return True
+    except OSError:
+        return False
+
+
+class Collector(asyncio.DatagramProtocol):
+    """Datagram endpoint that queues what it receives, optionally echoing it back"""
+
+    def __init__(self, echo=False):
+        self.echo = echo
+        self.received = asyncio.Queue()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received.put_nowait(data)
+        if self.echo:
+            self.transport.sendto(data, addr)
+
+
+def udp_header(host, port, frag=0):
+    if ":" in host:
+        return bytes([0, 0, frag, 4]) + socket.inet_pton(socket.AF_INET6, host) + port.to_bytes(2, "big")
+    return bytes([0, 0, frag, 1]) + socket.inet_aton(host) + port.to_bytes(2, "big")
+
+
+async def relay_session(tmp_path, echo_host, exchange):
+    # SOCKS5 proxy and a UDP echo server on loopback; exchange() drives one UDP ASSOCIATE session
+    loop = asyncio.get_running_loop()
+    logger = Logger(str(tmp_path / "traffic.log"))
+    proxy = Socks5Proxy("127.0.0.1", 0, DomainMatcher([]), logger, udp_idle=5.0)
+    server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+    echo_t, echo = await loop.create_datagram_endpoint(lambda: Collector(echo=True), local_addr=(echo_host, 0))
+    client_t, client = await loop.create_datagram_endpoint(Collector, local_addr=("127.0.0.1", 0))
+    r, w = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+    try:
+        w.write(b"\x05\x01\x00")
+        assert await r.readexactly(2) == b"\x05\x00"
+        w.write(b"\x05\x03\x00\x01\x00\x00\x00\x00\x00\x00")
+        reply = await r.readexactly(10)
+        assert reply[:4] == b"\x05\x00\x00\x01"
+        relay = (socket.inet_ntoa(reply[4:8]), int.from_bytes(reply[8:10], "big"))
+        await exchange(client_t, client, relay, echo_t.get_extra_info("sockname")[:2], echo)
+    finally:
+        w.close()
+        client_t.close()
+        echo_t.close()
+        server.close()
+        await server.wait_closed()
+        await logger.close()
+
+
+def test_udp_associate_echoes_datagrams(tmp_path):
+    async def exchange(client_t, client, relay, echo_addr, echo):
+        header = udp_header(*echo_addr)
+        for payload in (b"ping", b"pong" * 100):
+            client_t.sendto(header + payload, relay)
+            assert await asyncio.wait_for(client.received.get(), 2) == header + payload
+            assert await asyncio.wait_for(echo.received.get(), 2) == payload
+
+    asyncio.run(relay_session(tmp_path, "127.0.0.1", exchange))
+
+
+def test_udp_associate_drops_fragments(tmp_path):
+    async def exchange(client_t, client, relay, echo_addr, echo):
+        header = udp_header(*echo_addr)
+        client_t.sendto(udp_header(*echo_addr, frag=1) + b"fragment", relay)
+        client_t.sendto(header + b"whole", relay)
+        # Datagrams are handled in order, so the fragment had its chance before this arrives
+        assert await asyncio.wait_for(echo.received.get(), 2) == b"whole"
+        assert await asyncio.wait_for(client.received.get(), 2) == header + b"whole"
+        await asyncio.sleep(0.05)
+        assert echo.received.empty() and client.received.empty()
+
+    asyncio.run(relay_session(tmp_path, "127.0.0.1", exchange))
+
+
+@pytest.mark.skipif(not has_ipv6_loopback(), reason="no IPv6 loopback")
+def test_udp_associate_relays_ipv6_destinations(tmp_path):
+    async def exchange(client_t, client, relay, echo_addr, echo):
+        header = udp_header(*echo_addr)
+        assert header[3] == 4
+        client_t.sendto(header + b"six", relay)
+        assert await asyncio.wait_for(echo.received.get(), 2) == b"six"
+        assert await asyncio.wait_for(client.received.get(), 2) == header + b"six"
+
+    asyncio.run(relay_session(tmp_path, "::1", exchange))
+
+
+class SimulatedLoop:
+    """Loop stand-in for driving a UdpAssociation on a simulated clock"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def call_soon(self, callback, *args):
+        pass  # Sends stay queued; the test reads them straight off the queues
+
+
+def throttled_association(rate):
+    proxy = Socks5Proxy("127.0.0.1", 0, DomainMatcher([]), None)
+    assoc = UdpAssociation(proxy, "127.0.0.1", idle=60.0)
+    assoc._loop = SimulatedLoop()
+    assoc.client_addr = ("127.0.0.1", 40000)
+    flow = _UdpFlow("198.51.100.7", 9, False, 0.0, CategoryMeter("Video", None, rate=rate))
+    flow.addr = ("198.51.100.7", 9)
+    assoc.flows[(flow.host, flow.port)] = flow
+    assoc.by_addr[flow.addr] = flow
+    return assoc
+
+
+@pytest.mark.parametrize("direction", ["upstream", "downstream"])
+def test_udp_throttle_holds_the_cap_under_overload(direction):
+    rate = 125_000                      # 1 Mbit/s
+    size, interval, seconds = 1000, 0.004, 20.0   # 2 Mbit/s offered
+    assoc = throttled_association(rate)
+    datagram = udp_header("198.51.100.7", 9) + bytes(size)
+    out = assoc._out_remote if direction == "upstream" else assoc._out_client
+    sent = 0
+    for i in range(int(seconds / interval)):
+        assoc._loop.now = i * interval
+        if direction == "upstream":
+            assoc.from_client(datagram, assoc.client_addr)
+        else:
+            assoc.from_remote(bytes(size), ("198.51.100.7", 9))
+        sent += size * len(out)
+        out.clear()
+    # One full bucket at the start, then the cap; dropped datagrams must not eat into it
+    assert rate * seconds * 0.95 <= sent <= rate * (seconds + 1) + size
+
+
+def test_meter_allows_without_charging():
+    meter = CategoryMeter("Video", None, rate=1000)
+    meter.account(1000, 10.0)
+    assert not meter.allows(500, 10.1)
+    assert not meter.allows(500, 10.1)  # Asking again took nothing
+    assert meter.allows(500, 10.5)
+    assert meter.allows(5000, 11.0)     # Larger than the bucket: allowed once it is full
@@ -0,0 +1,143 @@
+import asyncio
+import random
+import ssl
+
+import pytest
+
+from mvp_blocker import DomainMatcher, HostPeeker, Logger, TransparentProxy
+
+
+def client_hello(server_hostname="example.com"):
+    # The first flight of a real TLS client, captured from memory BIOs
+    ctx = ssl.create_default_context()
+    if server_hostname is None:
+        ctx.check_hostname = False
+        ctx.verify_mode = ssl.CERT_NONE
+    incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+    tls = ctx.wrap_bio(incoming, outgoing, server_hostname=server_hostname)
+    with pytest.raises(ssl.SSLWantReadError):
+        tls.do_handshake()
+    return outgoing.read()
+
+
+def peek(chunks):
+    peeker = HostPeeker()
+    for chunk in chunks:
+        if peeker.feed(chunk):
+            break
+    return peeker
+
+
+def random_splits(data, rng):
+    cuts = sorted(rng.sample(range(1, len(data)), rng.randint(1, 20)))
+    return [data[a:b] for a, b in zip([0] + cuts, cuts + [len(data)])]
+
+
+@pytest.mark.parametrize("name", ["example.com", "Video.Example.ORG", "a" * 60 + ".test"])
+def test_sni_from_a_real_client_hello(name):
+    hello = client_hello(name)
+    assert hello[0] == 0x16
+    peeker = peek([hello])
+    assert (peeker.kind, peeker.host, peeker.port) == ("tls", name.lower(), 443)
+
+
+def test_sni_survives_byte_by_byte_and_random_splits():
+    hello = client_hello("split.example.net")
+    peeker = HostPeeker()
+    for i in range(len(hello) - 1):
+        assert not peeker.feed(hello[i:i + 1])  # No decision before the record is complete
+    assert peeker.feed(hello[-1:]) and peeker.host == "split.example.net"
+    rng = random.Random(1)
+    for _ in range(50):
+        assert peek(random_splits(hello, rng)).host == "split.example.net"
+
+
+def test_client_hello_without_sni():
+    peeker = peek([client_hello(None)])
+    assert peeker.done and peeker.kind == "tls" and peeker.host is None
+
+
+def test_truncated_client_hello_never_raises():
+    hello = client_hello("cut.example")
+    for n in range(5, len(hello)):
+        # Every prefix parsed as if it were the whole record
+        assert HostPeeker.parse_sni(memoryview(hello)[5:n]) in (None, "cut.example")
+    # A record that never completes keeps the peeker waiting for more
+    assert not peek([hello[:len(hello) // 2]]).done
+
+
+def test_garbage_records_never_raise():
+    rng = random.Random(2)
+    hello = client_hello("fuzz.example")
+    for _ in range(2000):
+        data = bytearray(hello)
+        for _ in range(rng.randint(1, 8)):
+            data[rng.randrange(5, len(data))] = rng.randrange(256)
+        peeker = peek([bytes(data)])
+        assert peeker.done and (peeker.host is None or isinstance(peeker.host, str))
+    for _ in range(500):
+        junk = bytes([0x16, 3, 1]) + bytes(rng.randrange(256) for _ in range(rng.randint(2, 300)))
+        peek([junk])  # Whatever the claimed lengths, parsing stays inside the buffer
+
+
+def test_unknown_protocol_is_decided_at_once():
+    peeker = peek([b"\x00\x01binary"])
+    assert peeker.done and peeker.kind is None and peeker.host is None
+
+
+def test_http_host_header_in_split_chunks():
+    request = b"GET / HTTP/1.1\r\nUser-Agent: t\r\nHost: Shop.Example:8080\r\n\r\n"
+    rng = random.Random(3)
+    for _ in range(20):
+        peeker = peek(random_splits(request, rng))
+        assert (peeker.kind, peeker.host, peeker.port) == ("http", "shop.example", 8080)
+
+
+async def transparent_session(tmp_path, exchange):
+    # Upstream web server on loopback, and the transparent proxy reached directly (no redirect rule)
+    upstream_seen = []
+
+    async def upstream(r, w):
+        head = await r.readuntil(b"\r\n\r\n")
+        upstream_seen.append(head)
+        w.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+        await w.drain()
+        w.close()
+
+    web = await asyncio.start_server(upstream, "127.0.0.1", 0)
+    logger = Logger(str(tmp_path / "traffic.log"))
+    proxy = TransparentProxy("127.0.0.1", 0, DomainMatcher(["blocked.test"]), logger, peek_timeout=2.0)
+    server = await asyncio.start_server(proxy.handle, "127.0.0.1", 0)
+    try:
+        await exchange(server.sockets[0].getsockname()[:2], web.sockets[0].getsockname()[1], upstream_seen)
+    finally:
+        server.close()
+        web.close()
+        await server.wait_closed()
+        await web.wait_closed()
+        await logger.close()
+
+
+def test_transparent_proxy_relays_allowed_and_resets_blocked(tmp_path):
+    async def exchange(proxy_addr, web_port, upstream_seen):
+        # Allowed: the Host header names the loopback web server, bytes are replayed and relayed
+        r, w = await asyncio.open_connection(*proxy_addr)
+        w.write(b"GET /hello HTTP/1.1\r\n")
+        await asyncio.sleep(0.05)  # Split across reads
+        w.write(b"Host: 127.0.0.1:%d\r\n\r\n" % web_port)
+        assert (await asyncio.wait_for(r.read(), 2)).endswith(b"\r\n\r\nok")
+        assert upstream_seen[0].startswith(b"GET /hello HTTP/1.1\r\nHost: 127.0.0.1:")
+        w.close()
+
+        # Blocked by SNI: the connection is reset and nothing reaches an upstream
+        for payload in (client_hello("www.blocked.test"), b"GET / HTTP/1.1\r\nHost: blocked.test\r\n\r\n"):
+            r, w = await asyncio.open_connection(*proxy_addr)
+            w.write(payload)
+            try:
+                assert await asyncio.wait_for(r.read(), 2) == b""
+            except ConnectionResetError:
+                pass
+            w.close()
+        assert len(upstream_seen) == 1
+
+    asyncio.run(transparent_session(tmp_path, exchange))